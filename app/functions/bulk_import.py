@@ -0,0 +1,399 @@
+"""
+Bulk import of chat history from NDJSON or CSV, for migrating rooms from other chat systems.
+
+Input rows use the field names of the room export (app/functions/export.py), so an export
+can be loaded back as is: room_id or rooms (the room name), created_at, message, receiver_id,
+fileUrl, voiceUrl, videoUrl, id_return, edited, deleted and optionally id.
+
+Messages are encrypted on a process pool while the previous batch is written, and every
+batch goes in with one COPY into a temporary staging table followed by
+INSERT ... ON CONFLICT DO NOTHING into chat_messages, or into chat_archive for rows older
+than the hot partitions. The same statement adds the inserted rows to room_message_counts,
+so unread counts include them. Rows without a UUID id get one derived from their content,
+so re-running an import (or resuming a failed one) inserts nothing twice.
+
+Rows whose room does not exist or without a valid created_at are skipped; an author that
+does not exist is stored as NULL, like a deleted user. A month that no partition covers is
+created as a monthly partition, in chat_archive when it is older than the hot partitions;
+rows dated after the newest partition, or in a month only partly covered, are skipped. Run from the project root:
+
+    python -m app.functions.bulk_import rooms.ndjson
+    python -m app.functions.bulk_import rooms.csv --format csv --batch-size 10000 --workers 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+import pytz
+
+from _log_config.log_config import get_logger
+from app.functions.crypto_pool import encrypt_batch, init_worker
+from app.settings.config import settings
+from app.settings.database import engine_async
+from app.settings.partitions import (ARCHIVE_SCHEMA, add_months, lower_bound, month_start, partition_maintainer,
+                                     partition_name, upper_bound)
+
+logger = get_logger('bulk_import', 'bulk_import.log')
+
+# Namespace of the ids derived for rows that come without one; never change it,
+# or re-runs of old imports would insert every message again
+IMPORT_NAMESPACE = UUID("0b1e6f0c-4c5e-4d2a-9a51-6f3c1c0e7a11")
+
+STAGING_TABLE = "chat_messages_import"
+
+COLUMNS = ("id", "created_at", "message", "fileUrl", "voiceUrl", "videoUrl",
+           "receiver_id", "rooms", "room_id", "id_return", "edited", "deleted")
+MESSAGE = COLUMNS.index("message")
+RECEIVER = COLUMNS.index("receiver_id")
+
+QUOTED_COLUMNS = ", ".join(f'"{column}"' for column in COLUMNS)
+CREATED_AT = COLUMNS.index("created_at")
+MESSAGE_ID = COLUMNS.index("id")
+
+# Range of one partition; None stands for MINVALUE
+PartitionRange = Tuple[Optional[datetime], datetime]
+
+
+class RejectedRow(Exception):
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def _uuid(value: Any) -> Optional[UUID]:
+    if value in (None, ""):
+        return None
+    try:
+        return UUID(str(value))
+    except ValueError:
+        raise RejectedRow("invalid UUID", repr(value))
+
+
+def _bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "t", "1", "yes")
+    return bool(value)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value in (None, "") else str(value)
+
+
+def _created_at(value: Any) -> datetime:
+    try:
+        created_at = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise RejectedRow("invalid created_at", repr(value))
+    if created_at.tzinfo is None:
+        created_at = pytz.utc.localize(created_at)
+    return created_at
+
+
+class RoomDirectory:
+    def __init__(self, rooms: List[Tuple[UUID, str]]):
+        self.names: Dict[UUID, str] = {room_id: name for room_id, name in rooms}
+        self.ids: Dict[str, UUID] = {name: room_id for room_id, name in rooms}
+
+    def resolve(self, raw: Dict[str, Any]) -> Tuple[UUID, str]:
+        room_id = _uuid(raw.get("room_id"))
+        if room_id is not None:
+            if room_id not in self.names:
+                raise RejectedRow("unknown room", str(room_id))
+            return room_id, self.names[room_id]
+
+        name = raw.get("rooms")
+        if name not in self.ids:
+            raise RejectedRow("unknown room", repr(name))
+        return self.ids[name], name
+
+
+def message_id(raw: Dict[str, Any], room_id: UUID, created_at: datetime) -> UUID:
+    """
+    The row's own id if it is a UUID; otherwise a UUID derived from the source id, or from the content.
+    """
+    source_id = raw.get("id")
+    if source_id not in (None, ""):
+        try:
+            return UUID(str(source_id))
+        except ValueError:
+            return uuid.uuid5(IMPORT_NAMESPACE, f"{room_id}:{source_id}")
+    return uuid.uuid5(IMPORT_NAMESPACE, f"{room_id}|{created_at.isoformat()}|"
+                                        f"{raw.get('receiver_id')}|{raw.get('message')}")
+
+
+def normalize(raw: Dict[str, Any], rooms: RoomDirectory) -> tuple:
+    """
+    Turns an input row into a record in COLUMNS order, message still in plain text.
+    Raises RejectedRow when the row cannot be imported.
+    """
+    room_id, room_name = rooms.resolve(raw)
+    if not raw.get("created_at"):
+        raise RejectedRow("missing created_at")
+    created_at = _created_at(raw["created_at"])
+
+    return (
+        message_id(raw, room_id, created_at),
+        created_at,
+        _text(raw.get("message")),
+        _text(raw.get("fileUrl")),
+        _text(raw.get("voiceUrl")),
+        _text(raw.get("videoUrl")),
+        _uuid(raw.get("receiver_id")),
+        room_name,
+        room_id,
+        _uuid(raw.get("id_return")),
+        _bool(raw.get("edited", False)),
+        _bool(raw.get("deleted", False)),
+    )
+
+
+def read_rows(path: str, file_format: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """
+    Yields (line number, row); the row is None for an NDJSON line that is not a JSON object.
+    """
+    with open(path, newline="", encoding="utf-8") as source:
+        if file_format == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.written = 0
+        self.inserted = 0
+        self.rejected: Counter = Counter()
+        self.receivers_dropped = 0
+
+    def reject(self, line_number: int, rejected: RejectedRow):
+        self.rejected[rejected.reason] += 1
+        logger.warning(f"Skipped row {line_number}: {rejected}")
+
+    def reject_record(self, record: tuple, rejected: RejectedRow):
+        # Rows rejected after batching no longer know their line number
+        self.rejected[rejected.reason] += 1
+        logger.warning(f"Skipped message {record[MESSAGE_ID]}: {rejected}")
+
+    @property
+    def rate(self) -> float:
+        return self.written / max(time.monotonic() - self.started, 1e-9)
+
+    def report(self, final: bool = False) -> str:
+        skipped = sum(self.rejected.values())
+        line = (f"{self.read} rows read, {self.inserted} inserted, {self.written - self.inserted} already present, "
+                f"{skipped} skipped, {self.rate:.0f} rows/s")
+        if final and self.rejected:
+            line += "\n" + "\n".join(f"  skipped ({reason}): {count}" for reason, count in self.rejected.most_common())
+        if final and self.receivers_dropped:
+            line += f"\n  unknown authors stored as NULL: {self.receivers_dropped}"
+        return line
+
+
+class BulkWriter:
+    """
+    Writes batches of records through COPY into a staging table and on into the message tables.
+    """
+
+    def __init__(self, connection, archive_boundary: Optional[datetime], stats: ImportStats):
+        self.connection = connection
+        self.archive_boundary = archive_boundary
+        self.stats = stats
+        self.partitions: List[PartitionRange] = []
+
+    async def prepare(self):
+        # Rows are cleared at every commit, so each batch starts from an empty staging table
+        await self.connection.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+            f"(LIKE chat_messages INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        rows = await self.connection.fetch(
+            "SELECT pg_get_expr(c.relpartbound, c.oid) AS bound FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent IN ('public.chat_messages'::regclass, $1::regclass)",
+            f"{ARCHIVE_SCHEMA}.chat_messages"
+        )
+        self.partitions = [(lower_bound(row["bound"]), upper_bound(row["bound"])) for row in rows]
+
+    def _covered(self, created_at: datetime) -> bool:
+        return any((start is None or start <= created_at) and created_at < end for start, end in self.partitions)
+
+    async def _create_partition(self, month: datetime):
+        end = add_months(month, 1)
+        if self.archive_boundary is not None and end <= self.archive_boundary:
+            parent, name = f"{ARCHIVE_SCHEMA}.chat_messages", f"{ARCHIVE_SCHEMA}.{partition_name(month)}"
+            tablespace = f" TABLESPACE {settings.archive_tablespace}" if settings.archive_tablespace else ""
+        else:
+            parent, name, tablespace = "chat_messages", partition_name(month), ""
+        await self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}'){tablespace}"
+        )
+        self.partitions.append((month, end))
+        logger.info(f"Created partition {name} for imported messages")
+
+    async def _fit_partitions(self, records: List[tuple]) -> List[tuple]:
+        """
+        Creates the monthly partitions the batch is missing, so COPY cannot fail on a row no partition
+        takes; returns the records that now have a partition, the others are rejected.
+        """
+        newest_month = month_start(datetime.now(pytz.utc))
+        fitted = []
+        for record in records:
+            created_at = record[CREATED_AT]
+            if not self._covered(created_at):
+                month = month_start(created_at)
+                end = add_months(month, 1)
+                if month > newest_month:
+                    self.stats.reject_record(record, RejectedRow("created_at in the future", created_at.isoformat()))
+                    continue
+                if any((start is None or start < end) and month < stop for start, stop in self.partitions):
+                    self.stats.reject_record(record, RejectedRow("no partition for created_at",
+                                                                 created_at.isoformat()))
+                    continue
+                await self._create_partition(month)
+            fitted.append(record)
+        return fitted
+
+    async def _known_users(self, user_ids: List[UUID]) -> set:
+        rows = await self.connection.fetch("SELECT id FROM users WHERE id = ANY($1::uuid[])", user_ids)
+        return {row["id"] for row in rows}
+
+    async def _insert(self, table: str, condition: str, *args) -> int:
+        # Rooms in key order, like the unread flush, so the two cannot deadlock on room_message_counts
+        return await self.connection.fetchval(
+            f"WITH inserted AS ("
+            f"INSERT INTO {table} ({QUOTED_COLUMNS}) "
+            f"SELECT {QUOTED_COLUMNS} FROM {STAGING_TABLE} WHERE {condition} "
+            f"ON CONFLICT DO NOTHING RETURNING room_id"
+            f"), counted AS ("
+            f"INSERT INTO room_message_counts (room_id, message_count) "
+            f"SELECT room_id, count(*) FROM inserted WHERE room_id IS NOT NULL GROUP BY room_id ORDER BY room_id "
+            f"ON CONFLICT (room_id) DO UPDATE "
+            f"SET message_count = room_message_counts.message_count + EXCLUDED.message_count"
+            f") SELECT count(*) FROM inserted",
+            *args
+        )
+
+    async def write(self, records: List[tuple]):
+        receivers = list({record[RECEIVER] for record in records if record[RECEIVER] is not None})
+        known = await self._known_users(receivers) if receivers else set()
+        for index, record in enumerate(records):
+            if record[RECEIVER] is not None and record[RECEIVER] not in known:
+                records[index] = record[:RECEIVER] + (None,) + record[RECEIVER + 1:]
+                self.stats.receivers_dropped += 1
+
+        records = await self._fit_partitions(records)
+        if not records:
+            return
+
+        if self.connection.is_in_transaction():
+            raise RuntimeError("Bulk import connection is already in a transaction; batches would not be committed")
+        async with self.connection.transaction():
+            await self.connection.copy_records_to_table(STAGING_TABLE, records=records, columns=COLUMNS)
+            if self.archive_boundary is not None:
+                self.stats.inserted += await self._insert(
+                    "chat_archive.chat_messages", "created_at < $1", self.archive_boundary
+                )
+                self.stats.inserted += await self._insert("chat_messages", "created_at >= $1", self.archive_boundary)
+            else:
+                self.stats.inserted += await self._insert("chat_messages", "true")
+        # The staging rows are cleared by the commit, so any left over mean the batch did not land
+        if await self.connection.fetchval(f"SELECT EXISTS (SELECT 1 FROM {STAGING_TABLE})"):
+            raise RuntimeError("Bulk import batch was not committed")
+        self.stats.written += len(records)
+
+
+async def run_import(path: str, file_format: str, batch_size: int, workers: int) -> ImportStats:
+    stats = ImportStats()
+    loop = asyncio.get_running_loop()
+
+    async with engine_async.connect() as sa_connection:
+        # Without autocommit the adapter opens a transaction for load() that every batch would
+        # only be a savepoint of, and that is rolled back when the connection is released
+        sa_connection = await sa_connection.execution_options(isolation_level="AUTOCOMMIT")
+        await partition_maintainer.load(sa_connection)
+        raw_connection = await sa_connection.get_raw_connection()
+        connection = raw_connection.driver_connection
+
+        rooms = RoomDirectory([(row["id"], row["name_room"]) for row in
+                               await connection.fetch("SELECT id, name_room FROM rooms")])
+        writer = BulkWriter(connection, partition_maintainer.archive_boundary, stats)
+        await writer.prepare()
+
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(settings.key_crypto,)) as pool:
+            # Batches being encrypted while the oldest one is written
+            pending: deque = deque()
+
+            async def write_oldest():
+                records, encrypting = pending.popleft()
+                for index, encrypted in enumerate(await encrypting):
+                    records[index] = records[index][:MESSAGE] + (encrypted,) + records[index][MESSAGE + 1:]
+                await writer.write(records)
+                print(stats.report(), file=sys.stderr)
+
+            batch: List[tuple] = []
+            for line_number, raw in read_rows(path, file_format):
+                stats.read += 1
+                try:
+                    if raw is None:
+                        raise RejectedRow("invalid JSON")
+                    batch.append(normalize(raw, rooms))
+                except RejectedRow as e:
+                    stats.reject(line_number, e)
+
+                if len(batch) >= batch_size:
+                    messages = [record[MESSAGE] for record in batch]
+                    pending.append((batch, loop.run_in_executor(pool, encrypt_batch, messages)))
+                    batch = []
+                    if len(pending) > workers:
+                        await write_oldest()
+
+            if batch:
+                messages = [record[MESSAGE] for record in batch]
+                pending.append((batch, loop.run_in_executor(pool, encrypt_batch, messages)))
+            while pending:
+                await write_oldest()
+
+    logger.info(f"Imported {path}: {stats.report(final=True)}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import chat messages from NDJSON or CSV")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default=None,
+                        help="Input format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per COPY (default 5000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Encryption processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    stats = asyncio.run(run_import(args.path, file_format, args.batch_size, args.workers))
+    print(stats.report(final=True), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Message encryption for process-pool workers.
+
+Kept free of app imports (settings, database), so the workers load nothing but the cipher.
+The output format must stay identical to func_socket.async_encrypt: base64 of the Fernet token.
+"""
+import base64
+from typing import List, Optional
+
+from cryptography.fernet import Fernet
+
+cipher: Optional[Fernet] = None
+
+
+def init_worker(key: str):
+    global cipher
+    cipher = Fernet(key)
+
+
+def encrypt_batch(messages: List[Optional[str]]) -> List[Optional[str]]:
+    return [
+        base64.b64encode(cipher.encrypt(message.encode())).decode('utf-8') if message is not None else None
+        for message in messages
+    ]
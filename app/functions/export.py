@@ -0,0 +1,187 @@
+"""
+Streaming export of a room's full history as NDJSON, one message per line, oldest first.
+
+Rows are read through a server-side cursor (yield_per) and decrypted batch by batch in a
+thread, so memory stays flat however large the room is. Every line carries a "cursor";
+passing the cursor of the last line received resumes the export right after it.
+
+The export is also available from the command line, run from the project root:
+
+    python -m app.functions.export <room_id> -o room.ndjson.gz --gzip
+    python -m app.functions.export <room_id> --after "$(tail -n1 room.ndjson | jq -r .cursor)" >> room.ndjson
+"""
+import argparse
+import asyncio
+import json
+import sys
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+from uuid import UUID
+
+import pytz
+from sqlalchemy import func, tuple_
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.functions.func_socket import decrypt_message
+from app.models import models
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+from app.settings.replicas import replica_router
+
+logger = get_logger('export', 'export.log')
+
+ExportCursor = Tuple[datetime, UUID]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def encode_cursor(created_at: datetime, message_id: UUID) -> str:
+    # Microseconds since the epoch rather than isoformat, so the cursor needs no escaping in a URL
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}_{message_id}"
+
+
+def parse_cursor(cursor: str) -> ExportCursor:
+    """
+    Parses "<created_at in microseconds since the epoch>_<message id>". Raises ValueError for anything else.
+    """
+    created_at, message_id = cursor.split("_", 1)
+    return EPOCH + timedelta(microseconds=int(created_at)), UUID(message_id)
+
+
+def export_query(message_model, room_id: UUID, after: Optional[ExportCursor] = None):
+    """
+    Every message of a room after the cursor, oldest first, with its author and vote total.
+
+    The vote total is a correlated subquery rather than a GROUP BY, so rows leave the
+    server as the index scan produces them instead of after aggregating the whole room.
+    """
+    votes = select(
+        func.coalesce(func.sum(models.ChatMessageVote.dir), 0)
+    ).where(
+        models.ChatMessageVote.message_id == message_model.id
+    ).scalar_subquery()
+
+    query = select(
+        message_model,
+        models.User.user_name,
+        votes.label('votes')
+    ).outerjoin(
+        models.User, message_model.receiver_id == models.User.id
+    ).filter(
+        message_model.room_id == room_id
+    )
+    if after is not None:
+        # The plain created_at bound is what the (room_id, created_at) index can seek on
+        query = query.filter(
+            message_model.created_at >= after[0],
+            tuple_(message_model.created_at, message_model.id) > tuple_(*after)
+        )
+    return query.order_by(message_model.created_at, message_model.id)
+
+
+def export_lines(rows) -> List[str]:
+    """
+    Decrypts and serializes a batch of (message, user_name, votes) rows. Runs in a worker thread.
+    """
+    lines = []
+    for message, user_name, votes in rows:
+        lines.append(json.dumps({
+            "cursor": encode_cursor(message.created_at, message.id),
+            "id": str(message.id),
+            "room_id": str(message.room_id),
+            "created_at": message.created_at.isoformat(),
+            "receiver_id": str(message.receiver_id) if message.receiver_id else None,
+            "user_name": user_name,
+            "message": decrypt_message(message.message),
+            "fileUrl": message.fileUrl,
+            "voiceUrl": message.voiceUrl,
+            "videoUrl": message.videoUrl,
+            "id_return": str(message.id_return) if message.id_return else None,
+            "edited": message.edited,
+            "deleted": message.deleted,
+            "vote": votes,
+        }, ensure_ascii=False) + "\n")
+    return lines
+
+
+async def export_room(room_id: UUID, after: Optional[ExportCursor] = None,
+                      batch_size: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Yields the NDJSON lines of a room, one chunk of lines per batch.
+
+    Args:
+        room_id (UUID): The room to export.
+        after (ExportCursor): Resume after this (created_at, id), as returned by parse_cursor.
+        batch_size (int): Rows fetched from the cursor and decrypted at a time.
+
+    The archive is read before the hot partitions, as every archived partition is older.
+    Both run in one REPEATABLE READ transaction, so they share a snapshot: a message
+    written, or a partition archived, between the two reads is neither missed nor
+    exported twice. It runs on a replica when one is fresh enough, else on the primary.
+    """
+    batch_size = batch_size or settings.export_batch_size
+    replica = replica_router.pick()
+    session_maker = replica.session_maker if replica is not None else async_session_maker
+
+    exported = 0
+    async with session_maker() as session:
+        async with session.begin():
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ",
+                                                        "postgresql_readonly": True})
+            for message_model in (models.ArchivedChatMessages, models.ChatMessages):
+                query = export_query(message_model, room_id, after).execution_options(yield_per=batch_size)
+                result = await session.stream(query)
+                async for rows in result.partitions():
+                    lines = await asyncio.to_thread(export_lines, rows)
+                    exported += len(lines)
+                    metrics.inc("export_messages", len(lines))
+                    yield "".join(lines)
+
+    logger.info(f"Exported {exported} messages of room {room_id}")
+
+
+async def gzip_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """
+    Gzips a stream of text chunks on the fly; only complete compressed blocks are yielded.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def write_export(room_id: UUID, after: Optional[ExportCursor], output, compress: bool):
+    chunks = export_room(room_id, after)
+    if compress:
+        async for data in gzip_chunks(chunks):
+            output.write(data)
+    else:
+        async for chunk in chunks:
+            output.write(chunk.encode())
+    output.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the full history of a room as NDJSON")
+    parser.add_argument("room_id", type=UUID)
+    parser.add_argument("--after", type=parse_cursor, default=None,
+                        help="Resume after this cursor (the \"cursor\" of the last line already exported)")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+    parser.add_argument("-o", "--output", default="-", help="File to write, or - for stdout (default)")
+    args = parser.parse_args()
+
+    if args.output == "-":
+        asyncio.run(write_export(args.room_id, args.after, sys.stdout.buffer, args.gzip))
+    else:
+        # A resumed gzip export appended to the same file is a valid multi-member gzip stream
+        with open(args.output, "ab" if args.after else "wb") as output:
+            asyncio.run(write_export(args.room_id, args.after, output, args.gzip))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from uuid import UUID
 from datetime import datetime, timedelta
+import time
 import pytz
 import logging
 from fastapi import HTTPException, status
@@ -7,10 +8,16 @@ from app.schemas import schemas
 from app.settings.config import settings
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import func, desc, update
-from typing import List
+from sqlalchemy import func, desc, update, delete, exists, literal, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from typing import Dict, List, Optional
 
 from app.models import models
+from app.settings.ban_index import ban_index
+from app.settings import outbound
+from app.settings.partitions import partition_maintainer
+from app.settings.profiles import AuthorProfile, profile_cache
+from app.settings.tracing import tracer
 
 import base64
 from cryptography.fernet import Fernet, InvalidToken
@@ -23,6 +30,10 @@ cipher = Fernet(key)
 
 logger = get_logger('func_socket', 'func_socket.log')
 
+# Sayory's profile is needed for every system notice; keep it instead of querying each time
+SAYORY_CACHE_SECONDS = 300
+sayory_cache = (None, 0.0)
+
 def is_base64(s):
     try:
         return base64.b64encode(base64.b64decode(s)).decode('utf-8') == s
@@ -37,7 +48,12 @@ async def async_encrypt(data: str):
     return encoded_string
 
 async def async_decrypt(encoded_data: str):
+    return decrypt_message(encoded_data)
 
+def decrypt_message(encoded_data: str):
+    """
+    Synchronous decryption, for callers that decrypt whole batches off the event loop.
+    """
     if not is_base64(encoded_data):
         # logger.error(f"Data is not valid base64, returning original data: {encoded_data}")
         return encoded_data
@@ -51,126 +67,169 @@ async def async_decrypt(encoded_data: str):
         return None
 
 
-async def fetch_last_messages(room_id: UUID, limit: int,
-                              session: AsyncSession) -> List[schemas.ChatMessagesSchema]:
+def message_schema(message, text: Optional[str], user: Optional[AuthorProfile],
+                   votes: int) -> schemas.ChatMessagesSchema:
+    """
+    Build a ChatMessagesSchema from a message row, its decrypted text, its author's profile and its vote total.
     """
-    This function fetches the last 50 messages in a given room and returns them as a list of SocketModel objects.
+    return schemas.ChatMessagesSchema(
+        created_at=message.created_at,
+        receiver_id=message.receiver_id,
+        message=text,
+        fileUrl=message.fileUrl,
+        voiceUrl=message.voiceUrl,
+        videoUrl=message.videoUrl,
+        user_name=user.user_name if user is not None else "Unknown user",
+        avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
+        verified=user.verified if user is not None else None,
+        id=message.id,
+        vote=votes,
+        id_return=message.id_return,
+        edited=message.edited,
+        deleted=message.deleted,
+        room_id=message.room_id
+    )
 
-    Parameters:
-    rooms (str): The name of the room to fetch messages from.
-    session (AsyncSession): The database session to use for querying the database.
 
-    Returns:
-    List[schemas.SocketModel]: A list of SocketModel objects representing the last 50 messages in the room.
+async def hydrate_messages(raw_messages, profiles: Dict[UUID, AuthorProfile]) -> List[schemas.ChatMessagesSchema]:
     """
-    try:
-        query = select(
-        models.ChatMessages,
-        models.User,
-        func.coalesce(func.sum(models.ChatMessageVote.dir), 0).label('votes')
-        ).outerjoin(
-            models.ChatMessageVote, models.ChatMessages.id == models.ChatMessageVote.message_id
-        ).outerjoin(
-            models.User, models.ChatMessages.receiver_id == models.User.id
-        ).filter(
-            models.ChatMessages.room_id == room_id
-        ).group_by(
-            models.ChatMessages.id, models.User.id
-        ).order_by(
-            desc(models.ChatMessages.created_at)
-        ).limit(limit)
-
-        result = await session.execute(query)
-        raw_messages = result.all()
-
-        # Convert raw messages to SocketModel
-        messages = []
-        for message, user, votes in raw_messages:
+    Convert (ChatMessages, votes) rows into decrypted ChatMessagesSchema objects,
+    taking each author from profiles (see fetch_authors).
+    """
+    messages = []
+    with tracer.span("decrypt") as span:
+        for message, votes in raw_messages:
             decrypted_message = await async_decrypt(message.message)
+            messages.append(message_schema(message, decrypted_message, profiles.get(message.receiver_id), votes))
+        if span is not None:
+            span.attributes["messages"] = len(messages)
+    return messages
 
-            messages.append(
-                schemas.ChatMessagesSchema(
-                    created_at=message.created_at,
-                    receiver_id=message.receiver_id,
-                    message=decrypted_message,
-                    fileUrl=message.fileUrl,
-                    voiceUrl=message.voiceUrl,
-                    videoUrl=message.videoUrl,
-                    user_name=user.user_name if user is not None else "Unknown user",
-                    avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
-                    verified=user.verified if user is not None else None,
-                    id=message.id,
-                    vote=votes,
-                    id_return=message.id_return,
-                    edited=message.edited,
-                    deleted=message.deleted,
-                    room_id=message.room_id
-                )
-            )
-        messages.reverse()
-        return messages
-    except Exception as e:
-        logger.error(f"Failed to fetch last messages: {str(e)}")
-        return []
 
-async def send_messages_via_websocket(messages, websocket):
-    for message in messages:
-        wrapped_message = await schemas.wrap_message(message)
-        json_message = wrapped_message.model_dump_json()
-        await websocket.send_text(json_message)
-    
-    
-async def fetch_one_message(message_id: UUID, session: AsyncSession) -> schemas.ChatMessagesSchema:
+async def fetch_authors(raw_messages) -> Dict[UUID, AuthorProfile]:
+    """
+    Profiles of the authors of (message, votes) rows, from the cache or one query for the misses.
+    """
+    with tracer.span("authors"):
+        return await profile_cache.get_many(message.receiver_id for message, _ in raw_messages)
+
+
+def history_query(message_model, room_id: UUID, limit: int, before: Optional[datetime] = None,
+                  after: Optional[datetime] = None, before_id: Optional[UUID] = None):
     """
-    Fetch a single message by its ID and return as a SocketModel object.
+    The newest messages of a room (older than before, newer than after, if given) with their
+    vote total. message_model is models.ChatMessages or models.ArchivedChatMessages.
+    Authors are not joined; they come from the profile cache (app/settings/profiles.py).
+
+    With before_id, before is a (created_at, id) keyset position rather than a time, so paging
+    does not skip messages that share the created_at of the last one seen.
     """
     query = select(
-        models.ChatMessages,
-        models.User, 
+        message_model,
         func.coalesce(func.sum(models.ChatMessageVote.dir), 0).label('votes')
     ).outerjoin(
-        models.ChatMessageVote, models.ChatMessages.id == models.ChatMessageVote.message_id
-    ).outerjoin( 
-        models.User, models.ChatMessages.receiver_id == models.User.id
+        models.ChatMessageVote, message_model.id == models.ChatMessageVote.message_id
     ).filter(
-        models.ChatMessages.id == message_id
-    ).group_by(
-        models.ChatMessages.id, models.User.id
+        message_model.room_id == room_id
     )
-    
-    result = await session.execute(query)
-    raw_message = result.first()
+    if before is not None and before_id is not None:
+        # The plain created_at bound is what the (room_id, created_at) index can seek on
+        query = query.filter(
+            message_model.created_at <= before,
+            tuple_(message_model.created_at, message_model.id) < tuple_(before, before_id)
+        )
+    elif before is not None:
+        query = query.filter(message_model.created_at < before)
+    if after is not None:
+        query = query.filter(message_model.created_at > after)
+    return query.group_by(
+        message_model.id, message_model.created_at
+    ).order_by(
+        desc(message_model.created_at), desc(message_model.id)
+    ).limit(limit)
+
+
+def last_messages_query(room_id: UUID, limit: int, before: Optional[datetime] = None,
+                        before_id: Optional[UUID] = None):
+    """
+    The history query on the hot table.
+    Kept separate so benchmarks/query_plans.py can EXPLAIN the exact statement.
+    """
+    return history_query(models.ChatMessages, room_id, limit, before, before_id=before_id)
 
-    # Convert raw messages to SocketModel
-    if raw_message:
-        message, user, votes = raw_message
-        decrypted_message = await async_decrypt(message.message)
-        
-        message = schemas.ChatMessagesSchema(
-                created_at=message.created_at,
-                receiver_id=message.receiver_id,
-                message=decrypted_message,
-                fileUrl=message.fileUrl,
-                voiceUrl=message.voiceUrl,
-                videoUrl=message.videoUrl,
-                user_name=user.user_name if user is not None else "Unknown user",
-                avatar=user.avatar if user is not None else "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/photo_2024-06-14_19-20-40.jpg",
-                verified=user.verified if user is not None else None,
-                id=message.id,
-                vote=votes,
-                id_return=message.id_return,
-                edited=message.edited,
-                deleted=message.deleted,
-                room_id=message.room_id
-            )
-        wrapped_message_update = await schemas.wrap_message_update(message)
-        return wrapped_message_update.model_dump_json()
-        
-    else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Message not found")
-    
 
+def archived_messages_query(room_id: UUID, limit: int, before: Optional[datetime] = None,
+                            before_id: Optional[UUID] = None):
+    return history_query(models.ArchivedChatMessages, room_id, limit, before, before_id=before_id)
+
+
+async def fetch_last_messages(room_id: UUID, limit: int,
+                              session: AsyncSession,
+                              before: Optional[datetime] = None,
+                              before_id: Optional[UUID] = None) -> List[schemas.ChatMessagesSchema]:
+    """
+    This function fetches the last messages in a given room and returns them as a list of ChatMessagesSchema objects.
+
+    Parameters:
+    room_id (UUID): The room to fetch messages from.
+    limit (int): How many messages to return at most.
+    session (AsyncSession): The database session to use for querying the database.
+    before (datetime): Only return messages older than this, for paging back through history.
+    before_id (UUID): With before, the id of the last message seen: messages come strictly before
+        (before, before_id), so none sharing its created_at are skipped.
+
+    Returns:
+    List[schemas.ChatMessagesSchema]: The messages, oldest first.
+
+    When the hot chat_messages partitions run out before limit is reached, the rest is
+    read from chat_archive, continuing from the oldest hot message.
+
+    Database errors are raised, so replica_router.read can retry on the primary.
+    """
+    result = await session.execute(last_messages_query(room_id, limit, before, before_id))
+    raw_messages = result.all()
+
+    if len(raw_messages) < limit and partition_maintainer.has_archive:
+        if raw_messages:
+            oldest, oldest_id = raw_messages[-1][0].created_at, raw_messages[-1][0].id
+        else:
+            oldest, oldest_id = before, before_id
+        archived = await session.execute(
+            archived_messages_query(room_id, limit - len(raw_messages), oldest, oldest_id)
+        )
+        raw_messages += archived.all()
+
+    messages = await hydrate_messages(raw_messages, await fetch_authors(raw_messages))
+    messages.reverse()
+    return messages
+
+async def fetch_messages_since(room_id: UUID, since: datetime, limit: int,
+                               session: AsyncSession) -> Optional[List[schemas.ChatMessagesSchema]]:
+    """
+    Messages of a room created after since, oldest first, for a client resuming after a gap.
+
+    Returns None when there are more than limit of them, in which case the client has to
+    reload the history instead. Database errors are raised, as in fetch_last_messages.
+    """
+    result = await session.execute(history_query(models.ChatMessages, room_id, limit + 1, after=since))
+    raw_messages = result.all()
+    if len(raw_messages) > limit:
+        return None
+
+    messages = await hydrate_messages(raw_messages, await fetch_authors(raw_messages))
+    messages.reverse()
+    return messages
+
+
+async def send_messages_via_websocket(messages, connection):
+    """
+    Sends history one message per frame in the history class, so live traffic can overtake it.
+    """
+    for message in messages:
+        wrapped_message = await schemas.wrap_message(message)
+        await connection.send_frame(wrapped_message, outbound.HISTORY)
+    
+    
 async def update_room_for_user(user_id: UUID, room_id: UUID,
                                session: AsyncSession):
     """
@@ -257,7 +316,11 @@ async def update_room_for_user_live(user_id: UUID, session: AsyncSession):
 
 async def process_vote(vote: schemas.Vote, session: AsyncSession, current_user: models.User):
     """
-    Process a vote submitted by a user.
+    Process a vote submitted by a user in a single round trip.
+
+    A vote with dir 1 toggles the user's vote on the message (adds it, or removes it if it
+    already exists); any other dir removes the user's vote. The existence and deleted checks,
+    the toggle and the new total are all one statement.
 
     Args:
         vote (schemas.Vote): The vote submitted by the user.
@@ -265,51 +328,54 @@ async def process_vote(vote: schemas.Vote, session: AsyncSession, current_user:
         current_user (models.User): The current user.
 
     Returns:
-        Dict[str, Any]: A response indicating whether the vote was added or removed, and any errors that may have occurred.
+        schemas.VoteDelta: The message id, its room and the updated vote total.
 
     Raises:
-        HTTPException: If an error occurs while processing the vote.
+        HTTPException: If the message does not exist or is deleted, or an error occurs while processing the vote.
     """
     try:
+        votes = models.ChatMessageVote
+        message = select(
+            models.ChatMessages.id, models.ChatMessages.room_id, models.ChatMessages.deleted
+        ).where(models.ChatMessages.id == vote.message_id).cte("message")
+        live_message = select(message.c.id).where(message.c.deleted.isnot(True))
+
+        removed = delete(votes).where(
+            votes.message_id.in_(live_message),
+            votes.user_id == current_user.id
+        ).returning(votes.dir).cte("removed")
+
+        # Every CTE sees the table as it was before the statement, so the new total is
+        # the old sum minus what was removed plus what was added.
+        total = func.coalesce(
+            select(func.sum(votes.dir)).where(votes.message_id == message.c.id).scalar_subquery(), 0
+        ) - func.coalesce(select(func.sum(removed.c.dir)).scalar_subquery(), 0)
 
-        if vote.message_id == 0:
-            return
+        if vote.dir == 1:
+            added = insert(votes).from_select(
+                ["user_id", "message_id", "dir"],
+                select(literal(current_user.id, votes.user_id.type), message.c.id, literal(vote.dir)).where(
+                    message.c.deleted.isnot(True),
+                    ~exists(select(removed.c.dir))
+                )
+            ).on_conflict_do_nothing().returning(votes.dir).cte("added")
+            total = total + func.coalesce(select(func.sum(added.c.dir)).scalar_subquery(), 0)
 
-        result = await session.execute(select(models.ChatMessages).filter(models.ChatMessages.id == vote.message_id))
-        message = result.scalar_one_or_none()
-        
-        if not message:
+        result = await session.execute(
+            select(message.c.room_id, message.c.deleted, total.label("votes"))
+        )
+        row = result.first()
+        await session.commit()
+
+        if row is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Message with id: {vote.message_id} does not exist")
 
-        if message.deleted:
+        if row.deleted:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Cannot vote on a deleted message")
-        
-        vote_result = await session.execute(select(models.ChatMessageVote).filter(
-            models.ChatMessageVote.message_id == vote.message_id,
-            models.ChatMessageVote.user_id == current_user.id
-        ))
-        found_vote = vote_result.scalar_one_or_none()
-        
-        if vote.dir == 1:
-            if found_vote:
-                await session.delete(found_vote)
-                await session.commit()
-                return vote.message_id
-            else:
-                new_vote = models.ChatMessageVote(message_id=vote.message_id, user_id=current_user.id, dir=vote.dir)
-                session.add(new_vote)
-                await session.commit()
-                return vote.message_id
 
-        else:
-            if not found_vote:
-                return {"message": "Vote does not exist or has already been removed"}
-            
-            await session.delete(found_vote)
-            await session.commit()
-            return vote.message_id
+        return schemas.VoteDelta(message_id=vote.message_id, room_id=row.room_id, votes=row.votes)
 
     except HTTPException as http_exc:
         logging.error(f"HTTP error occurred: {http_exc.detail}")
@@ -327,7 +393,7 @@ async def change_message(message_id: UUID, message_update: schemas.ChatUpdateMes
                          session: AsyncSession, 
                          current_user: models.User):
     """
-    This function updates a message in the database.
+    This function updates a message in the database with a single UPDATE ... RETURNING statement.
 
     Parameters:
         message_id (int): The ID of the message to update.
@@ -336,25 +402,37 @@ async def change_message(message_id: UUID, message_update: schemas.ChatUpdateMes
         current_user (models.User): The current user.
 
     Returns:
-        Dict[str, Any]: A response indicating whether the message was updated and any errors that may have occurred.
+        schemas.MessageEditDelta: The changed fields of the message and the room it belongs to.
 
     Raises:
-        HTTPException: If an error occurs while updating the message.
+        HTTPException: If the message does not exist, belongs to another user or is deleted.
     """
-    
-    message = await get_message_by_id(message_id, current_user.id, session)
+    messages = models.ChatMessages
+    target = select(messages.id, messages.deleted).where(
+        messages.id == message_id,
+        messages.receiver_id == current_user.id
+    ).cte("target")
+
+    encrypt_message = await async_encrypt(message_update.message)
+    changed = update(messages).where(
+        messages.id.in_(select(target.c.id).where(target.c.deleted.isnot(True)))
+    ).values(message=encrypt_message, edited=True).returning(messages.id, messages.room_id).cte("changed")
+
+    result = await session.execute(
+        select(target.c.deleted, changed.c.room_id).select_from(
+            target.outerjoin(changed, changed.c.id == target.c.id)
+        )
+    )
+    row = result.first()
+    await session.commit()
 
-    if message is None:
+    if row is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found or you don't have permission to edit this message")
 
-    if message.deleted:
+    if row.deleted:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You cannot edit a deleted message")
 
-
-    message.message = message_update.message 
-    message.edited = True
-    session.add(message)
-    await session.commit()
+    return schemas.MessageEditDelta(id=message_id, room_id=row.room_id, message=message_update.message)
 
 
 
@@ -365,45 +443,55 @@ async def delete_message(message_id: UUID,
     """
     Delete a message from the database.
 
+    The message content is cleared and the user's votes on it are removed in a single
+    statement (UPDATE ... RETURNING plus DELETE in the same WITH).
+
     Args:
         message_id (int): The ID of the message to delete.
         session (AsyncSession): The database session.
         current_user (models.User): The current user.
 
     Returns:
-        Dict[str, Any]: A response indicating whether the message was deleted and any errors that may have occurred.
+        schemas.MessageDeleteDelta: The id of the deleted message and the room it belongs to.
 
     Raises:
-        HTTPException: If an error occurs while deleting the message.
+        HTTPException: If the message does not exist, belongs to another user or is already deleted.
     """
-    message = await get_message_by_id(message_id, current_user.id, session)
+    messages = models.ChatMessages
+    votes = models.ChatMessageVote
+    target = select(messages.id, messages.deleted).where(
+        messages.id == message_id,
+        messages.receiver_id == current_user.id
+    ).cte("target")
+
+    cleared = update(messages).where(
+        messages.id.in_(select(target.c.id).where(target.c.deleted.isnot(True)))
+    ).values(
+        message=None, fileUrl=None, voiceUrl=None, videoUrl=None, id_return=None, deleted=True
+    ).returning(messages.id, messages.room_id).cte("cleared")
+
+    removed_votes = delete(votes).where(
+        votes.message_id.in_(select(cleared.c.id)),
+        votes.user_id == current_user.id
+    ).returning(votes.message_id).cte("removed_votes")
+
+    result = await session.execute(
+        select(
+            target.c.deleted,
+            cleared.c.room_id,
+            select(func.count()).select_from(removed_votes).scalar_subquery().label("removed_votes")
+        ).select_from(target.outerjoin(cleared, cleared.c.id == target.c.id))
+    )
+    row = result.first()
+    await session.commit()
 
-    if message is None:
+    if row is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Message not found or you don't have permission to delete this message")
-    if message.deleted:
+    if row.deleted:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You cannot edit a deleted message")
 
-    message.message = None
-    message.fileUrl = None
-    message.voiceUrl = None
-    message.videoUrl = None
-    message.id_return = None
-    message.deleted = True
-
-    vote_result = await session.execute(select(models.ChatMessageVote).filter(
-        models.ChatMessageVote.message_id == message_id,
-        models.ChatMessageVote.user_id == current_user.id
-    ))
-    found_vote = vote_result.scalars().all()
-    for vote in found_vote:
-        await session.delete(vote)
-
-    session.add(message)
-    await session.commit()
-    return str(message_id)
-
-    # return message
+    return schemas.MessageDeleteDelta(id=message_id, room_id=row.room_id)
 
 
 async def online(user_id: UUID, session: AsyncSession, ):
@@ -464,54 +552,6 @@ async def fetch_room_data(room_id: UUID, session: AsyncSession):
     
     return room_record
 
-async def send_message_deleted_room(room_id: UUID, manager: object,
-                                    session: AsyncSession):
-    """
-    This function sends a message to all users in a specific room, indicating that the room will be deleted in a certain number of days.
-
-    Parameters:
-    room_id (int): The unique identifier of the room.
-    manager (object): The object responsible for managing messages and broadcasting them.
-    session (AsyncSession): The database session object for executing database queries.
-
-    Returns:
-    None
-
-    This function first retrieves the user object with id 2 from the database.
-    If the user object is not found, the function returns without sending a message.
-    Then, it retrieves the room object with the given room_id from the database.
-    If the room object is not found or the room's delete_at attribute is None, the function returns without sending a message.
-    If the room will be deleted in more than 0 days, the function constructs a message indicating the remaining days.
-    The message is sent to all users in the specified room using the manager's broadcast_all method.
-    """
-    
-    sayory = await get_sayory(session)
-    
-    if not sayory:
-        return
-    room = await get_room_by_id(room_id=room_id, session=session)
-    
-    if room.delete_at:
-        days_to_deletion = room.delete_at + timedelta(days=30) - datetime.now(pytz.utc)
-        if days_to_deletion.days > 0:
-            current_time = datetime.now(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
-            await manager.broadcast_all(
-                message=f"😑 This room will be DELETED in {days_to_deletion.days} days. 😑",
-                fileUrl=None,
-                voiceUrl=None,
-                vdeoUrl=None,
-                rooms=room.name_room,
-                created_at=current_time,
-                receiver_id=sayory.id,
-                user_name=sayory.user_name,
-                avatar=sayory.avatar,
-                verified=sayory.verified,
-                id_return=None,
-                room_id=room_id,
-                add_to_db=False
-            )
-
-
 async def send_message_blocking(room_id: UUID, manager: object,
                                 session: AsyncSession):
     """
@@ -553,89 +593,47 @@ async def send_message_blocking(room_id: UUID, manager: object,
                             add_to_db=False
                         )
     
-async def send_message_mute_user(room_id: UUID, current_user: models.User,
+async def send_message_mute_user(room: models.Rooms, current_user: models.User,
                                  manager: object, session: AsyncSession):
     """
     This function sends a message to a user when they are muted in a specific room.
 
     Parameters:
-    room (str): The name of the room where the user is muted.
+    room (models.Rooms): The room where the user is muted.
     current_user (models.User): The user object representing the muted user.
     manager (object): The object responsible for managing messages and broadcasting them.
     session (AsyncSession): The database session object for executing database queries.
 
     Returns:
     None
-    """
 
-    # Query to retrieve the user object with id 2
+    The remaining time comes from the in-memory ban index, so no bans query is made.
+    """
     sayory = await get_sayory(session)
-
-    # Query to retrieve the room object with the given name
-    room_info = await get_room_by_id(room_id=room_id, session=session)
-    if not room_info:
-        return
-
-    # Get the current time in UTC and convert it to naive datetime
-    current_time_utc = datetime.now(pytz.timezone('UTC'))
-    current_time_naive = current_time_utc.replace(tzinfo=None)
-
-    # Query to retrieve the ban record for the muted user in the given room
-    ban = select(models.Ban).where(
-        models.Ban.user_id == current_user.id,
-        models.Ban.room_id == room_id,
-        models.Ban.end_time > current_time_naive  # Filter banned
-    )
-    ban_result = await session.execute(ban)
-    ban_record = ban_result.scalar()
-
-    # If a ban record is found, calculate the remaining minutes and send a message to the user
-    if ban_record:
-        minutes = (ban_record.end_time - current_time_naive).total_seconds() / 60
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        await manager.send_message_to_user(
-            message=f"Sorry, but the owner of the room has blocked you. Until the end of the block remained {minutes:.0f} minutes.",
-            fileUrl=None,
-            voiceUrl=None,
-            videoUrl=None,
-            room=room_info.name_room,
-            created_at=current_time,
-            receiver_id=sayory.id,
-            user_id=current_user.id,
-            user_name=sayory.user_name,
-            avatar=sayory.avatar,
-            verified=sayory.verified,
-            id_return=None,
-            add_to_db=False
-        )
-
-
-async def ban_user(room_id: UUID, current_user: models.User, session: AsyncSession):
-
-    room_record = await get_room_by_id(room_id, session)
-    
-    if not room_record:
+    if not sayory:
         return
 
-    ban_query = select(models.Ban).where(models.Ban.user_id == current_user.id,
-                                         models.Ban.room_id == room_id)
-    ban_result = await session.execute(ban_query)
-    ban_record = ban_result.scalar()
-    
-    current_time_utc = datetime.now(pytz.timezone('UTC'))
-    current_time_naive = current_time_utc.replace(tzinfo=None)
-    # print(current_time_naive)
-    # print(ban_record.end_time)
-    
-    if ban_record:
-        if current_time_naive > ban_record.end_time:
-            await session.delete(ban_record)
-            await session.commit()
-            return False
-        else:
-            return True
+    remaining = ban_index.remaining(current_user.id, room.id)
+    if remaining is None:
+        text = "Sorry, but the owner of the room has blocked you."
     else:
-        return False
+        text = f"Sorry, but the owner of the room has blocked you. Until the end of the block remained {remaining / 60:.0f} minutes."
+
+    await manager.send_message_to_user(
+        message=text,
+        fileUrl=None,
+        voiceUrl=None,
+        videoUrl=None,
+        room=room.name_room,
+        receiver_id=sayory.id,
+        user_id=current_user.id,
+        user_name=sayory.user_name,
+        avatar=sayory.avatar,
+        verified=sayory.verified,
+        id_return=None,
+        room_id=room.id,
+        add_to_db=False
+    )
 
 
 
@@ -765,10 +763,17 @@ async def get_user_by_id(user_id: UUID, session: AsyncSession):
 
 
 async def get_sayory(session: AsyncSession):
+    global sayory_cache
+    sayory_user, loaded_at = sayory_cache
+    if sayory_user is not None and time.monotonic() - loaded_at < SAYORY_CACHE_SECONDS:
+        return sayory_user
+
     sayory = settings.sayory
     sayory_query = select(models.User).where(models.User.user_name == sayory)
     sayory_result = await session.execute(sayory_query)
-    return sayory_result.scalar_one_or_none()
+    sayory_user = sayory_result.scalar_one_or_none()
+    sayory_cache = (sayory_user, time.monotonic())
+    return sayory_user
 
 async def get_hell(session: AsyncSession):
     hell = settings.hell
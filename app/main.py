@@ -1,10 +1,17 @@
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import chat_socket
+from .routers import chat_socket, export, metrics, unread
 
 import sentry_sdk
 from .settings.config import settings
+from .settings.ban_index import ban_index
+from .settings.partitions import partition_maintainer
+from .settings.presence import presence_store
+from .settings.profiles import profile_cache
+from .settings.replicas import replica_router
+from .settings.unread import unread_counters
 
 # sentry_sdk.init(
 #     dsn=settings.sentry_url,
@@ -16,7 +23,31 @@ from .settings.config import settings
 #     # We recommend adjusting this value in production.
 #     profiles_sample_rate=1.0,
 # )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background services start with the worker, not on the first join, so joins never wait on them.
+    # Startup waits only for small initial loads (bans, archive boundary, Hell room), never for partition DDL.
+    await replica_router.ensure_started()
+    await ban_index.ensure_started()
+    await partition_maintainer.ensure_started()
+    await presence_store.ensure_started()
+    await unread_counters.ensure_started()
+    await profile_cache.ensure_started()
+    await chat_socket.room_scheduler.ensure_started()
+    yield
+    # Sockets are closed before shutdown runs, so every leave is in the final flush
+    await presence_store.close()
+    await unread_counters.close()
+    await profile_cache.close()
+    await chat_socket.manager.close()
+    await partition_maintainer.close()
+    await ban_index.close()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     docs_url="/docs",
     title="Chat",
     version="0.1.0",
@@ -36,3 +67,6 @@ app.add_middleware(
 
 
 app.include_router(chat_socket.router)
+app.include_router(export.router)
+app.include_router(metrics.router)
+app.include_router(unread.router)
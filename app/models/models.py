@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, Interval, String, ForeignKey, Enum, UniqueConstraint, JSON
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, Interval, String, ForeignKey, Enum, UniqueConstraint, JSON, Index
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.orm import relationship
@@ -18,7 +18,8 @@ class ChatMessages(Base):
     __tablename__ = 'chat_messages'
 
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text('uuid_generate_v4()'), nullable=False)
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    # Part of the primary key because the table is range-partitioned by it
+    created_at = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, server_default=text('now()'))
     message = Column(String)
     fileUrl = Column(String)
     voiceUrl = Column(String)
@@ -32,11 +33,46 @@ class ChatMessages(Base):
     return_message = Column(JSON, server_default=None)
     deleted = Column(Boolean, server_default='false')
 
+    # History is read per room, newest first
+    __table_args__ = (
+        Index('ix_chat_messages_room_id_created_at', 'room_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
     # # Relationships
     # reports = relationship("Report", back_populates="message")
     # notifications = relationship("Notification", back_populates="message")
 
 
+class ArchivedChatMessages(Base):
+    """
+    Monthly partitions of chat_messages older than settings.partition_hot_months,
+    moved to the chat_archive schema by PartitionMaintainer. Read-only for the app,
+    except for RoomDeletionScheduler purging the messages of deleted rooms.
+    """
+    __tablename__ = 'chat_messages'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False)
+    message = Column(String)
+    fileUrl = Column(String)
+    voiceUrl = Column(String)
+    videoUrl = Column(String)
+    receiver_id = Column(UUID)
+    rooms = Column(String, nullable=False)
+    room_id = Column(UUID)
+    id_return = Column(UUID, nullable=True)
+
+    edited = Column(Boolean, server_default='false')
+    return_message = Column(JSON, server_default=None)
+    deleted = Column(Boolean, server_default='false')
+
+    __table_args__ = (
+        Index('ix_chat_archive_messages_room_id_created_at', 'room_id', 'created_at'),
+        {'schema': 'chat_archive', 'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -79,6 +115,8 @@ class UserStatus(Base):
     user_name = Column(String, nullable=False)
     status = Column(Boolean, server_default='True', nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    # When the join or leave last written by PresenceStore happened; older flushes are skipped
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=True)
 
 
 class Rooms(Base):
@@ -112,14 +150,25 @@ class Ban(Base):
 
     users = relationship("User", back_populates="bans")
 
+    __table_args__ = (
+        Index('ix_bans_user_id_room_id', 'user_id', 'room_id'),
+    )
+
 
 class ChatMessageVote(Base):
     __tablename__ = 'chat_message_votes'
 
     user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    message_id = Column(UUID, ForeignKey("chat_messages.id", ondelete="CASCADE"), primary_key=True)
+    # No foreign key: chat_messages is partitioned and its id alone is not unique there
+    message_id = Column(UUID, primary_key=True)
     dir = Column(Integer)
-    
+
+    # The primary key leads with user_id, vote totals are summed per message
+    __table_args__ = (
+        Index('ix_chat_message_votes_message_id', 'message_id'),
+    )
+
+
 class UserOnlineTime(Base):
     __tablename__ = 'user_online_time'
 
@@ -127,4 +176,30 @@ class UserOnlineTime(Base):
     user_id = Column(UUID, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
     session_start = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
     session_end = Column(TIMESTAMP(timezone=True), nullable=True)
-    total_online_time = Column(Interval, nullable=True, default=timedelta())
\ No newline at end of file
+    total_online_time = Column(Interval, nullable=True, default=timedelta())
+
+    __table_args__ = (
+        Index('ix_user_online_time_user_id', 'user_id'),
+    )
+
+
+class RoomMessageCount(Base):
+    """
+    Messages ever posted to a room; unread counts are this minus RoomReadState.read_count.
+    """
+    __tablename__ = 'room_message_counts'
+
+    room_id = Column(UUID, ForeignKey('rooms.id', ondelete="CASCADE"), primary_key=True)
+    message_count = Column(BigInteger, nullable=False, server_default='0')
+
+
+class RoomReadState(Base):
+    """
+    Last-read marker of a user in a room: the room's message_count when they last read it.
+    """
+    __tablename__ = 'room_read_state'
+
+    user_id = Column(UUID, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    room_id = Column(UUID, ForeignKey('rooms.id', ondelete="CASCADE"), primary_key=True)
+    read_count = Column(BigInteger, nullable=False, server_default='0')
+    last_read_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
@@ -6,7 +6,8 @@ from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from ..settings import oauth2, utils, database
+from ..settings import oauth2, database
+from ..settings.password_pool import PasswordPoolFull, password_pool
 from app.models.models import User
 
 from ..schemas import schemas
@@ -33,11 +34,12 @@ async def login(user_credentials: Annotated[OAuth2PasswordRequestForm, Depends()
 
     Raises:
     HTTPException: 403 Forbidden error if the credentials are invalid.
+    HTTPException: 503 Service Unavailable if too many logins are waiting for password verification.
 
     The function performs the following steps:
     - Extracts the username and password from the OAuth2PasswordRequestForm.
     - Verifies that a user with the provided email exists in the database.
-    - Checks if the provided password is correct.
+    - Checks if the provided password is correct, on the bcrypt thread pool so the event loop stays free.
     - Generates an access token using the user's ID.
     - Returns the access token and the token type as a JSON object.
     """
@@ -58,7 +60,14 @@ async def login(user_credentials: Annotated[OAuth2PasswordRequestForm, Depends()
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f"User with ID {user.id} is not active")
 
-        if not utils.verify(user_credentials.password, user.password):
+        try:
+            password_ok = await password_pool.verify(user_credentials.password, user.password)
+        except PasswordPoolFull:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many logins, try again shortly",
+                                headers={"Retry-After": "1"})
+
+        if not password_ok:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Invalid Credentials")
 
@@ -1,18 +1,34 @@
+import asyncio
+import time
 from datetime import datetime
+from functools import partial
+from typing import Optional, Tuple
 from uuid import UUID
+import pytz
 from _log_config.log_config import get_logger
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 from app.settings.connection_manager import ConnectionManager
+from app.settings.rate_limit import RateLimiter, frame_action
+from app.settings.ban_index import ban_index
+from app.settings.room_scheduler import RoomDeletionScheduler
+from app.settings.presence import presence_store
+from app.settings.unread import unread_counters
+from app.settings.tenants import tenant_quotas, tenant_scheduler
+from app.settings.replicas import replica_router
+from app.settings.admission import JoinRejected, join_admission
+from app.settings.event_log import DB_RESUME_OVERLAP, parse_resume_token
+from app.settings.metrics import metrics
+from app.settings.tracing import tracer
 from app.settings.database import get_async_session
 from app.settings import oauth2
 from ..schemas import schemas
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.functions.func_socket import update_user_status, change_message, fetch_last_messages, update_room_for_user, \
-    update_room_for_user_live, process_vote, delete_message, fetch_one_message, send_messages_via_websocket, \
-    get_room_by_id, get_hell, get_sayory
-from app.functions.func_socket import fetch_room_data, send_message_blocking, ban_user, send_message_mute_user, \
-    start_session, end_session, send_message_deleted_room, count_messages_in_room
+from app.functions.func_socket import change_message, fetch_last_messages, fetch_messages_since, \
+    process_vote, delete_message, \
+    send_messages_via_websocket, get_room_by_id, get_sayory
+from app.functions.func_socket import fetch_room_data, send_message_blocking, send_message_mute_user, \
+    count_messages_in_room
 
 from app.functions.moderator import censor_message, load_banned_words, tag_sayory
 from app.AI import sayory
@@ -28,6 +44,125 @@ router = APIRouter(
 )
 
 manager = ConnectionManager()
+rate_limiter = RateLimiter()
+metrics.add_collector(rate_limiter.publish)
+room_scheduler = RoomDeletionScheduler(manager)
+
+
+async def notify_mute_lifted(user_id: UUID, room_id: UUID):
+    """
+    Tells a connected user that their mute in the room they are in has ended.
+    """
+    user_connection = manager.user_connections.get(user_id)
+    if user_connection is not None and user_connection[3] == room_id:
+        await user_connection[0].send_frame({"notice": "Your mute in this room has ended"})
+
+
+ban_index.on_expire = notify_mute_lifted
+
+
+async def catch_up(connection, room_id: UUID, limit: int, resume: str,
+                   user_id: UUID) -> Optional[Tuple[datetime, UUID, int]]:
+    """
+    Brings a joining client up to date and tells it how, in a {"resume": {"status", "token", "backfill"}} frame:
+
+    - fresh: no resume token was given, the last `limit` messages were sent
+    - replayed: only the events missed since the token were sent, from the in-memory event log
+    - history: the log could not cover the gap, messages created since the token were sent from
+      the database (edits, deletes and votes of older messages are not included)
+    - reload: the token is too old or unknown, the client must drop its state; the last `limit` messages were sent
+    - unavailable: history could not be read from any database; nothing was sent
+
+    For fresh and reload only the newest history_first_screen messages are sent here. The rest
+    of the `limit` window is left to backfill_history; this returns where it starts (created_at
+    and id of the oldest message sent) and how many messages it may still send, which is also
+    the frame's backfill.
+    """
+    status = "fresh"
+    backfill = None
+    if resume:
+        status = "reload"
+        token = parse_resume_token(resume)
+        missed = manager.event_log.replay(room_id, token) if token else None
+
+        if missed is not None:
+            for frame in missed:
+                await connection.send_frame(frame)
+            status = "replayed"
+        elif token and time.time() - token.at <= settings.resume_max_age:
+            since = datetime.fromtimestamp(token.at - DB_RESUME_OVERLAP, pytz.utc)
+            try:
+                messages = await replica_router.read(fetch_messages_since, room_id, since, limit, user_id=user_id)
+            except Exception as e:
+                # Reloading the last messages may still work
+                logger.error(f"Failed to fetch messages of room {room_id} since {since}: {e}")
+                messages = None
+            if messages is not None:
+                await send_messages_via_websocket(messages, connection)
+                status = "history"
+
+    if status in ("fresh", "reload"):
+        first_screen = min(limit, settings.history_first_screen) if settings.history_first_screen > 0 else limit
+        try:
+            messages = await replica_router.read(fetch_last_messages, room_id, first_screen, user_id=user_id)
+        except Exception as e:
+            logger.error(f"Failed to fetch the last messages of room {room_id}: {e}")
+            status = "unavailable"
+        else:
+            await send_messages_via_websocket(messages, connection)
+            # A short first screen means the room has no older messages
+            if limit > first_screen and len(messages) == first_screen:
+                backfill = (messages[0].created_at, messages[0].id, limit - first_screen)
+
+    metrics.inc("session_resumes", status=status)
+    await connection.send_frame({"resume": {"status": status, "token": manager.event_log.token(room_id),
+                                            "backfill": backfill[2] if backfill else 0}})
+    return backfill
+
+
+async def backfill_history(connection, room_id: UUID, before: datetime, before_id: UUID, remaining: int,
+                           user_id: UUID):
+    """
+    Sends up to `remaining` messages older than the message (before, before_id) in pages of
+    history_backfill_page, newest page first and each page oldest first like any history, then
+    {"backfill": {"status": "done", "messages": <sent>}}. Pages continue from the (created_at, id)
+    of the oldest message sent, so messages sharing a timestamp are not skipped. If a page
+    cannot be read the stream ends with status "error" instead.
+
+    Runs next to the receive loop, so the user can send and receive while it goes; its frames
+    are in the history class and live traffic overtakes them (see app/settings/outbound.py).
+    """
+    tracer.begin("ws.backfill", room_id=room_id, user_id=user_id, remaining=remaining)
+    sent = 0
+    status = "done"
+    try:
+        while remaining > 0:
+            page_size = min(remaining, settings.history_backfill_page)
+            try:
+                with tracer.span("history", messages=page_size):
+                    messages = await replica_router.read(
+                        partial(fetch_last_messages, before=before, before_id=before_id),
+                        room_id, page_size, user_id=user_id
+                    )
+            except Exception as e:
+                logger.error(f"Failed to read a history backfill page of room {room_id}: {e}")
+                status = "error"
+                break
+            await send_messages_via_websocket(messages, connection)
+            sent += len(messages)
+            remaining -= page_size
+            if len(messages) < page_size:
+                break
+            before, before_id = messages[0].created_at, messages[0].id
+
+        await connection.send_frame({"backfill": {"status": status, "messages": sent}})
+        metrics.inc("history_backfilled_messages", sent)
+        metrics.inc("history_backfills", status=status)
+    except Exception as e:
+        # Usually the client left mid-way; the endpoint cancels the backfill on a clean disconnect
+        logger.warning(f"History backfill for room {room_id} stopped after {sent} messages: {e}")
+    finally:
+        tracer.finish()
 
 
 @router.websocket("/ws/{room_id}")
@@ -36,93 +171,142 @@ async def websocket_endpoint(
         room_id: UUID,
         limit: int = 20,
         token: str = '',
+        resume: str = '',
         session: AsyncSession = Depends(get_async_session)
 ):
-    user = await oauth2.get_current_user(token, session)
-    room = await get_room_by_id(room_id, session)
-
-    if user.blocked:
-        await websocket.close(code=1008)
-        return
-
-    await count_messages_in_room(room_id, session)
-    # print(room)
-
-    room_data = await fetch_room_data(room_id, session)
-    user_baned = await ban_user(room_id, user, session)
-
-    await manager.connect(websocket, user.id, user.user_name, user.avatar, room_id, user.verified)
-
-    if room_data.block:
-        if user.role != 'admin':
-            await send_message_blocking(room_id, manager, session)
-            await websocket.close(code=1008)
-            return
-        else:
-            logger.info(f"Admin {user.user_name} has accessed the blocked room {room_id}.")
-
-    await update_room_for_user(user.id, room_id, session)
-
-    x_real_ip = websocket.headers.get('x-real-ip')
-    x_forwarded_for = websocket.headers.get('x-forwarded-for')
-
-    await start_session(user.id, session)
-
-    # Use of received IP addresses
-    print(f"X-Real-IP: {x_real_ip}")
-    print(f"X-Forwarded-For: {x_forwarded_for}")
+    # Every stage of the join is timed; see app/settings/tracing.py
+    tracer.begin("ws.join", room_id=room_id, limit=limit, resume=bool(resume))
+    # Set once the join counts against the company's connection cap, and once it completed
+    company_counted = False
+    joined = False
+    # Bounded so a reconnect storm does not exhaust the database pool; see app/settings/admission.py
+    try:
+        async with join_admission.slot():
+            # Lookups and history are read from a replica when one is fresh enough; writes use session (the primary)
+            with tracer.span("auth"):
+                user = await replica_router.read(oauth2.get_current_user, token)
+            tracer.annotate(user_id=user.id, company_id=user.company_id)
+            with tracer.span("room_lookup"):
+                room = await replica_router.read(get_room_by_id, room_id, user_id=user.id)
+
+            if user.blocked:
+                await websocket.close(code=1008)
+                return
+
+            if not tenant_quotas.can_connect(user.company_id):
+                raise JoinRejected("tenant_connections", join_admission.retry_after_ms())
+            # Counted right away, so concurrent handshakes of the same company cannot overshoot the cap
+            tenant_quotas.opened(user.company_id)
+            company_counted = True
+
+            with tracer.span("count_messages"):
+                await replica_router.read(count_messages_in_room, room_id, user_id=user.id)
+            # print(room)
+
+            with tracer.span("room_data"):
+                room_data = await replica_router.read(fetch_room_data, room_id, user_id=user.id)
+            with tracer.span("accept"):
+                connection = await manager.connect(websocket, user.id, user.user_name, user.avatar, room_id,
+                                                   user.verified)
+
+            if room_data.block:
+                if user.role != 'admin':
+                    await send_message_blocking(room_id, manager, session)
+                    await websocket.close(code=1008)
+                    return
+                else:
+                    logger.info(f"Admin {user.user_name} has accessed the blocked room {room_id}.")
 
-    await manager.send_active_users(room_id)
+            # Room, online flag and session start are written by the presence store's next flush
+            presence_store.join(user.id, room)
 
-    # Get the latest notifications
-    await update_user_status(user.id, True, session)
+            x_real_ip = websocket.headers.get('x-real-ip')
+            x_forwarded_for = websocket.headers.get('x-forwarded-for')
 
-    messages = await fetch_last_messages(room_id, limit, session)
+            # Use of received IP addresses
+            print(f"X-Real-IP: {x_real_ip}")
+            print(f"X-Forwarded-For: {x_forwarded_for}")
 
-    await send_messages_via_websocket(messages, websocket)
+            with tracer.span("active_users"):
+                await manager.send_active_users(room_id)
 
-    await send_message_deleted_room(room_id, manager, session)
+            with tracer.span("history"):
+                backfill = await catch_up(connection, room_id, limit, resume, user.id)
+            unread_counters.mark_read(user.id, room_id)
 
+            with tracer.span("room_scheduler"):
+                await room_scheduler.on_join(user.id, room)
+            joined = True
+    except JoinRejected as rejected:
+        tracer.annotate(rejected=rejected.reason)
+        await join_admission.reject(websocket, rejected)
+        return
+    finally:
+        tracer.finish()
+        if company_counted and not joined:
+            tenant_quotas.closed(user.company_id)
+
+    # The rest of the join history streams in while the user already chats
+    backfill_task = None
+    if backfill is not None:
+        backfill_task = asyncio.create_task(backfill_history(connection, room_id, *backfill, user.id))
     try:
         while True:
-            data = await websocket.receive_json()
+            # The trace of the previous frame ends here, before waiting for the next one
+            tracer.finish()
+            data = await connection.receive_frame()
+
+            # Throttle before any DB work or fan-out, per user and then per company
+            action = frame_action(data)
+            tracer.begin(f"ws.{action}", room_id=room_id, user_id=user.id)
+            if not await rate_limiter.admit(connection, user.id, room_id, action):
+                continue
+            if not await tenant_quotas.admit(connection, user.company_id, action):
+                continue
 
             if 'type' in data:
-                if not user_baned:
+                if not ban_index.is_muted(user.id, room_id):
                     await manager.notify_users_typing(room_id, user.user_name, user.id)
                 continue
 
             if 'limit' in data:
                 limit = data['limit']
 
-                messages = await fetch_last_messages(room_id, limit, session)
+                try:
+                    with tracer.span("history"):
+                        messages = await replica_router.read(fetch_last_messages, room_id, limit, user_id=user.id)
+                except Exception as e:
+                    logger.error(f"Failed to fetch the last messages of room {room_id}: {e}")
+                    await connection.send_frame({"notice": "Could not load messages, try again later"})
+                    continue
 
-                count_messages = await count_messages_in_room(room_id, session)
+                count_messages = await replica_router.read(count_messages_in_room, room_id, user_id=user.id)
                 limit = min(limit, count_messages)
 
                 if limit < count_messages:
-                    await websocket.send_json({"notice": "Load older messages"})
+                    await connection.send_frame({"notice": "Load older messages"})
                 else:
-                    await websocket.send_json({"notice": "Loading all messages"})
+                    await connection.send_frame({"notice": "Loading all messages"})
 
-                await send_messages_via_websocket(messages, websocket)
+                await send_messages_via_websocket(messages, connection)
 
-            if user_baned:
-                await send_message_mute_user(room_id, user, manager, session)
+            if ban_index.is_muted(user.id, room_id):
+                await send_message_mute_user(room, user, manager, session)
                 continue
             # Created likes
             if 'vote' in data:
                 try:
                     vote_data = schemas.Vote(**data['vote'])
-                    await process_vote(vote_data, session, user)
+                    async with tenant_scheduler.turn(user.company_id, manager.room_population(room_id)):
+                        with tracer.span("vote_db"):
+                            vote_delta = await process_vote(vote_data, session, user)
+                    await replica_router.note_write(user.id)
 
-                    message_json = await fetch_one_message(vote_data.message_id, session)
-                    for user_id, (connection, _, _, user_room, _) in manager.user_connections.items():
-                        await connection.send_text(str(message_json))
+                    await manager.publish(vote_delta.room_id, await schemas.wrap_vote_delta(vote_delta))
 
                 except Exception as e:
                     logger.error(f"Error processing vote: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing vote: {e}"})
+                    await connection.send_frame({"notice": f"Error processing vote: {e}"})
 
             # Block change message
             elif 'update' in data:
@@ -130,32 +314,36 @@ async def websocket_endpoint(
                     message_data = schemas.ChatUpdateMessage(**data['update'])
 
                     censored_text = censor_message(message_data.message, banned_words)
-                    await change_message(message_data.id, schemas.ChatUpdateMessage(id=message_data.id,
-                                                                               message=censored_text
-                                                                               ), session, user)
-                    update_message = await fetch_one_message(message_data.id, session)
+                    async with tenant_scheduler.turn(user.company_id, manager.room_population(room_id)):
+                        with tracer.span("edit_db"):
+                            edit_delta = await change_message(message_data.id,
+                                                              schemas.ChatUpdateMessage(id=message_data.id,
+                                                                                        message=censored_text
+                                                                                        ), session, user)
+                    await replica_router.note_write(user.id)
 
-                    for user_id, (connection, _, _, user_room_id, _) in manager.user_connections.items():
-                        await connection.send_text(str(update_message))
+                    await manager.publish(edit_delta.room_id, await schemas.wrap_message_edit(edit_delta))
 
                 except Exception as e:
                     logger.error(f"Error processing change: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing change: {e}"})
+                    await connection.send_frame({"notice": f"Error processing change: {e}"})
 
             # Block delete message
             elif 'delete' in data:
                 try:
                     message_data = schemas.ChatMessageDelete(**data['delete'])
-                    message_id = await delete_message(message_data.id, session, user)
+                    async with tenant_scheduler.turn(user.company_id, manager.room_population(room_id)):
+                        with tracer.span("delete_db"):
+                            delete_delta = await delete_message(message_data.id, session, user)
+                    await replica_router.note_write(user.id)
 
-                    for user_id, (connection, _, _, user_room_id, _) in manager.user_connections.items():
-                        await connection.send_json({"deleted": {"id": message_id}})
+                    await manager.publish(delete_delta.room_id, await schemas.wrap_message_delete(delete_delta))
 
 
 
                 except Exception as e:
                     logger.error(f"Error processing deleted: {e}", exc_info=True)
-                    await websocket.send_json({"notice": f"Error processing deleted: {e}"})
+                    await connection.send_frame({"notice": f"Error processing deleted: {e}"})
 
             # Block send message
             elif 'send' in data:
@@ -177,8 +365,9 @@ async def websocket_endpoint(
                         "type": "system_warning",
                         "content": "Your message has been modified because it contained obscene language."
                     }
-                    await websocket.send_json(warning_message)
+                    await connection.send_frame(warning_message)
 
+                # Persistence takes a weighted-fair turn among companies; see broadcast_all
                 await manager.broadcast_all(
                     message=censored_message,
                     fileUrl=file_url,
@@ -191,12 +380,14 @@ async def websocket_endpoint(
                     verified=user.verified,
                     id_return=original_message_id,
                     room_id=room_id,
-                    add_to_db=True
+                    add_to_db=True,
+                    company_id=user.company_id
                 )
                 if not censored_message:
                     pass
                 elif tag_sayory(censored_message):
-                    response_sayory = await sayory.ask_to_gpt(censored_message)
+                    with tracer.span("sayory"):
+                        response_sayory = await sayory.ask_to_gpt(censored_message)
                     sayory_user = await get_sayory(session)
                     await manager.broadcast_all(
                         message=response_sayory,
@@ -210,7 +401,8 @@ async def websocket_endpoint(
                         verified=sayory_user.verified,
                         id_return=original_message_id,
                         room_id=room_id,
-                        add_to_db=True
+                        add_to_db=True,
+                        company_id=user.company_id
                     )
 
 
@@ -218,11 +410,12 @@ async def websocket_endpoint(
         print("Couldn't connect to")
         manager.disconnect(websocket, user.id)
     finally:
-        hell = await get_hell(session)
-        await end_session(user.id, session)
-        await update_room_for_user(user.id, hell.id, session)
-        await update_user_status(user.id, False, session)
-        await update_room_for_user_live(user.id, session)
+        tracer.finish()
+        if backfill_task is not None:
+            backfill_task.cancel()
+        tenant_quotas.closed(user.company_id)
+        presence_store.leave(user.id)
+        unread_counters.mark_read(user.id, room_id)
         await manager.send_active_users(room_id)
         await session.close()
         print("Session closed")
\ No newline at end of file
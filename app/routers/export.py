@@ -0,0 +1,62 @@
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from _log_config.log_config import get_logger
+from app.functions.export import export_room, gzip_chunks, parse_cursor
+from app.functions.func_socket import get_room_by_id
+from app.models import models
+from app.settings import oauth2
+from app.settings.database import get_async_session
+
+logger = get_logger('export', 'export.log')
+
+router = APIRouter(
+    tags=["Export"]
+)
+
+
+@router.get("/rooms/{room_id}/export")
+async def export_room_history(room_id: UUID,
+                              after: Optional[str] = None,
+                              gzip: bool = False,
+                              session: AsyncSession = Depends(get_async_session),
+                              current_user: models.User = Depends(oauth2.get_current_user)):
+    """
+    Streams every message of a room as NDJSON, oldest first.
+
+    Args:
+        room_id (UUID): The room to export.
+        after (str): The "cursor" of the last line already received, to resume an interrupted export.
+        gzip (bool): Send the export gzipped, as a .ndjson.gz file.
+
+    Raises:
+        HTTPException: 403 unless the user is a super admin, or an admin of the room's company;
+            404 if the room does not exist; 400 for a malformed cursor.
+    """
+    if current_user is None or current_user.role not in (models.UserRole.admin, models.UserRole.super_admin):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can export rooms")
+
+    room = await get_room_by_id(room_id, session)
+    if room is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Room {room_id} not found")
+    if current_user.role != models.UserRole.super_admin and room.company_id != current_user.company_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Room belongs to another company")
+
+    try:
+        cursor = parse_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid export cursor")
+
+    logger.info(f"User {current_user.id} exports room {room_id} after {after or 'the start'}")
+
+    chunks = export_room(room_id, cursor)
+    filename = f"room-{room_id}.ndjson"
+    if gzip:
+        return StreamingResponse(gzip_chunks(chunks), media_type="application/gzip",
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'})
+    return StreamingResponse(chunks, media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
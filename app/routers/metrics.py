@@ -0,0 +1,38 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+
+from app.settings.config import settings
+from app.settings.metrics import metrics
+
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def check_metrics_access(request: Request, authorization: Optional[str]):
+    """
+    Raises:
+        HTTPException: 403 without "Authorization: Bearer <METRICS_TOKEN>", or, when no token is set,
+            for any client but the loopback interface.
+    """
+    if settings.metrics_token:
+        expected = f"Bearer {settings.metrics_token}"
+        if authorization is not None and secrets.compare_digest(authorization.encode(), expected.encode()):
+            return
+    elif request.client is not None and request.client.host in LOOPBACK_HOSTS:
+        return
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read metrics")
+
+
+@router.get("/metrics")
+async def get_metrics(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    In-process counters, gauges and summaries of this worker.
+    """
+    check_metrics_access(request, authorization)
+    return metrics.snapshot()
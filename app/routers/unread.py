@@ -0,0 +1,22 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+
+from app.models import models
+from app.schemas import schemas
+from app.settings import oauth2
+from app.settings.unread import unread_counters
+
+router = APIRouter(
+    tags=["Unread"]
+)
+
+
+@router.get("/unread", response_model=List[schemas.UnreadCount])
+async def get_unread_counts(current_user: models.User = Depends(oauth2.get_current_user)):
+    """
+    Unread message counts of every room the current user has visited, in one call.
+
+    Rooms are marked read when the user joins and when they leave them over the WebSocket.
+    """
+    return await unread_counters.unread(current_user.id)
@@ -25,8 +25,13 @@ class ChatMessagesSchema(BaseModel):
     room_id: Annotated[UUID4, Strict(False)] = None
 
 
+# Frames of room events carry their resume token (see app/settings/event_log.py)
+class RoomEvent(BaseModel):
+    seq: Optional[str] = None
+
+
 # Send message to chat
-class WrappedSocketMessage(BaseModel):
+class WrappedSocketMessage(RoomEvent):
     message: ChatMessagesSchema
 
 
@@ -42,6 +47,37 @@ async def wrap_message_update(socket_model_update: ChatMessagesSchema) -> Wrappe
     return WrappedUpdateMessage(update=socket_model_update)
 
 
+# Changed fields of an edited message
+class MessageEditDelta(BaseModel):
+    id: Annotated[UUID4, Strict(False)]
+    room_id: Annotated[UUID4, Strict(False)] = Field(default=None, exclude=True)
+    message: Optional[str] = None
+    edited: bool = True
+
+
+class WrappedEditDelta(RoomEvent):
+    update: MessageEditDelta
+
+
+async def wrap_message_edit(edit_delta: MessageEditDelta) -> WrappedEditDelta:
+    return WrappedEditDelta(update=edit_delta)
+
+
+# Deleted message
+class MessageDeleteDelta(BaseModel):
+    id: Annotated[UUID4, Strict(False)]
+    room_id: Annotated[UUID4, Strict(False)] = Field(default=None, exclude=True)
+    deleted: bool = True
+
+
+class WrappedDeleteDelta(RoomEvent):
+    deleted: MessageDeleteDelta
+
+
+async def wrap_message_delete(delete_delta: MessageDeleteDelta) -> WrappedDeleteDelta:
+    return WrappedDeleteDelta(deleted=delete_delta)
+
+
 class ChatUpdateMessage(BaseModel):
     id: Annotated[UUID4, Strict(False)]
     message: str
@@ -58,4 +94,25 @@ class TokenData(BaseModel):
     
 class Vote(BaseModel):
     message_id: Annotated[UUID4, Strict(False)]
-    dir: Annotated[int, Field(strict=True, le=1)]
\ No newline at end of file
+    dir: Annotated[int, Field(strict=True, le=1)]
+
+
+# Vote total changed
+class VoteDelta(BaseModel):
+    message_id: Annotated[UUID4, Strict(False)]
+    room_id: Annotated[UUID4, Strict(False)] = Field(default=None, exclude=True)
+    votes: int
+
+
+class WrappedVoteDelta(RoomEvent):
+    votes: VoteDelta
+
+
+async def wrap_vote_delta(vote_delta: VoteDelta) -> WrappedVoteDelta:
+    return WrappedVoteDelta(votes=vote_delta)
+
+
+class UnreadCount(BaseModel):
+    room_id: Annotated[UUID4, Strict(False)]
+    unread: int
+    last_read_at: datetime
@@ -0,0 +1,100 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import WebSocket
+
+from app.settings import wire_format
+from app.settings.config import settings
+from app.settings.metrics import metrics
+from app.settings.tracing import tracer
+
+# "Try Again Later"; the close reason carries the delay as retry_after_ms=<n>
+RETRY_LATER_CLOSE_CODE = 1013
+
+
+class JoinRejected(Exception):
+    def __init__(self, reason: str, retry_after_ms: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_ms = retry_after_ms
+
+
+class JoinAdmission:
+    """
+    Bounds how many WebSocket join handshakes (auth, lookups, history) run at once.
+
+    Up to join_concurrency joins run; up to join_queue_size more wait at most
+    join_queue_deadline seconds for a slot. Anything beyond that is rejected with a retry
+    delay that grows with the queue and is jittered, so a reconnect storm after a restart
+    spreads out instead of coming back all at once.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, queue_size: Optional[int] = None,
+                 deadline: Optional[float] = None):
+        self.concurrency = concurrency or settings.join_concurrency
+        self.queue_size = queue_size if queue_size is not None else settings.join_queue_size
+        self.deadline = deadline if deadline is not None else settings.join_queue_deadline
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+
+    def retry_after_ms(self) -> int:
+        backlog = (self.in_flight + self.waiting) / self.concurrency
+        delay = min(settings.join_retry_base_ms * (1 + backlog), settings.join_retry_max_ms)
+        return int(random.uniform(delay / 2, delay))
+
+    def _reject(self, reason: str) -> JoinRejected:
+        metrics.inc("joins_rejected", reason=reason)
+        return JoinRejected(reason, self.retry_after_ms())
+
+    def _update_gauges(self):
+        metrics.set_gauge("join_queue_depth", self.waiting)
+        metrics.set_gauge("join_handshakes_in_flight", self.in_flight)
+
+    async def _acquire(self):
+        if self._semaphore.locked() and self.waiting >= self.queue_size:
+            raise self._reject("queue_full")
+
+        started = time.monotonic()
+        self.waiting += 1
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.deadline)
+        except TimeoutError:
+            raise self._reject("deadline") from None
+        finally:
+            self.waiting -= 1
+            metrics.observe("join_queue_wait_seconds", time.monotonic() - started)
+
+        self.in_flight += 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds a handshake slot for the body. Raises JoinRejected when none frees up in time.
+        """
+        with tracer.span("admission_wait"):
+            await self._acquire()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._update_gauges()
+
+    @staticmethod
+    async def reject(websocket: WebSocket, rejected: JoinRejected):
+        """
+        Closes a join that was not admitted. The socket is accepted first, as a close before
+        accept reaches the client as a bare HTTP 403 without the code and reason.
+        """
+        protocol = wire_format.negotiate_protocol(websocket)
+        await websocket.accept(subprotocol=protocol if protocol != wire_format.JSON_PROTOCOL else None)
+        await websocket.close(code=RETRY_LATER_CLOSE_CODE, reason=f"retry_after_ms={rejected.retry_after_ms}")
+
+
+join_admission = JoinAdmission()
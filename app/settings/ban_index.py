@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+import pytz
+from sqlalchemy import delete, or_, tuple_
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.models import models
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+from app.settings.notifications import RECONNECT_DELAY, listen
+
+logger = get_logger('ban_index', 'ban_index.log')
+
+BanKey = Tuple[UUID, UUID]
+
+# Sent by the bans_changed trigger (migration 0005) with "user_id,room_id" as payload
+BANS_CHANNEL = "bans_changed"
+
+# Stored for bans without an end_time, which never expire on their own
+PERMANENT = datetime.max
+
+
+def utc_now_naive() -> datetime:
+    # bans.end_time is a naive UTC timestamp
+    return datetime.now(pytz.utc).replace(tzinfo=None)
+
+
+class BanIndex:
+    """
+    In-process index of active bans (mutes) keyed by (user_id, room_id).
+
+    The whole bans table is loaded in one query; after that the index follows the table
+    through Postgres: a trigger on bans sends the (user_id, room_id) of every changed row
+    on bans_changed and a listener connection queues the pair to be reloaded. The table
+    is loaded again whenever the listener (re)connects, and every
+    ban_index_refresh_interval seconds while it is disconnected. A heap of end times lets
+    a single task lift each mute exactly when it ends, delete the expired rows and call
+    on_expire so the user can be told without reconnecting.
+    """
+
+    def __init__(self):
+        self.bans: Dict[BanKey, datetime] = {}
+        self.expiry_heap: List[Tuple[datetime, UUID, UUID]] = []
+        self.on_expire: Optional[Callable[[UUID, UUID], Awaitable[None]]] = None
+        self.listening = False
+        # Pairs named by bans_changed notifications, reloaded by the update task
+        self.changed: Set[BanKey] = set()
+        # Loop time of the next full load, None while the listener keeps the index current
+        self._next_load: Optional[float] = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._loaded = asyncio.Event()
+
+    async def ensure_started(self):
+        """
+        Loads the index and starts the update and listener tasks on first use.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._listener = asyncio.create_task(self._listen_forever())
+        await self._loaded.wait()
+
+    def is_muted(self, user_id: UUID, room_id: UUID) -> bool:
+        end_time = self.bans.get((user_id, room_id))
+        return end_time is not None and end_time > utc_now_naive()
+
+    def remaining(self, user_id: UUID, room_id: UUID) -> Optional[float]:
+        """
+        Seconds left on a mute, None when the user is not muted or the ban is permanent.
+        """
+        end_time = self.bans.get((user_id, room_id))
+        if end_time is None or end_time == PERMANENT:
+            return None
+        return max(0.0, (end_time - utc_now_naive()).total_seconds())
+
+    @staticmethod
+    async def _select_active(*criteria) -> Dict[BanKey, datetime]:
+        now = utc_now_naive()
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(models.Ban.user_id, models.Ban.room_id, models.Ban.end_time).where(
+                    or_(models.Ban.end_time.is_(None), models.Ban.end_time > now),
+                    *criteria
+                )
+            )
+            rows = result.all()
+
+        bans: Dict[BanKey, datetime] = {}
+        for user_id, room_id, end_time in rows:
+            key = (user_id, room_id)
+            bans[key] = max(end_time or PERMANENT, bans.get(key, now))
+        return bans
+
+    async def load(self):
+        """
+        Replaces the index with the active bans from the database.
+        Bans that disappeared since the last load were lifted and are reported through on_expire.
+        """
+        bans = await self._select_active()
+
+        lifted = [key for key in self.bans if key not in bans]
+        self.bans = bans
+        self.expiry_heap = [(end_time, *key) for key, end_time in bans.items() if end_time != PERMANENT]
+        heapq.heapify(self.expiry_heap)
+
+        for user_id, room_id in lifted:
+            await self._notify(user_id, room_id)
+
+    async def reload(self, keys: Iterable[BanKey]):
+        """
+        Reloads the given (user_id, room_id) pairs; pairs left without an active ban are reported through on_expire.
+        """
+        keys = list(keys)
+        bans = await self._select_active(tuple_(models.Ban.user_id, models.Ban.room_id).in_(keys))
+
+        lifted = []
+        for key in keys:
+            end_time = bans.get(key)
+            if end_time is None:
+                if self.bans.pop(key, None) is not None:
+                    lifted.append(key)
+                continue
+            self.bans[key] = end_time
+            # Entries of the previous end time are skipped lazily when they come up
+            if end_time != PERMANENT:
+                heapq.heappush(self.expiry_heap, (end_time, *key))
+
+        for user_id, room_id in lifted:
+            await self._notify(user_id, room_id)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            user_id, room_id = payload.split(",")
+            self.changed.add((UUID(user_id), UUID(room_id)))
+        except ValueError:
+            logger.warning(f"Ignoring {channel} notification with payload {payload!r}")
+            return
+        self._wakeup.set()
+
+    async def _connected(self):
+        # Changes made while the listener was away were not heard: load everything again
+        self.listening = True
+        self._next_load = 0.0
+        self._wakeup.set()
+        logger.info(f"Listening on {BANS_CHANNEL}")
+
+    async def _listen_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await listen(BANS_CHANNEL, self._on_notification, self._connected)
+                logger.warning(f"Connection listening on {BANS_CHANNEL} was lost")
+            except Exception as e:
+                logger.error(f"Failed to listen on {BANS_CHANNEL}: {e}")
+            if self.listening:
+                self.listening = False
+                self._next_load = loop.time()
+                self._wakeup.set()
+            metrics.inc("ban_listener_reconnects")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Cleared before the work, so a notification arriving during it is not lost
+            self._wakeup.clear()
+            try:
+                if self._next_load is not None and loop.time() >= self._next_load:
+                    scheduled = self._next_load = loop.time() + settings.ban_index_refresh_interval
+                    self.changed.clear()
+                    await self.load()
+                    if self.listening and self._next_load == scheduled:
+                        self._next_load = None
+                elif self.changed:
+                    keys, self.changed = self.changed, set()
+                    try:
+                        await self.reload(keys)
+                    except Exception:
+                        # Picked up by the next full load instead
+                        self._next_load = loop.time() + settings.ban_index_refresh_interval
+                        raise
+
+                now = utc_now_naive()
+                expired = []
+                while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                    end_time, user_id, room_id = heapq.heappop(self.expiry_heap)
+                    if self.bans.get((user_id, room_id)) == end_time:
+                        del self.bans[(user_id, room_id)]
+                        expired.append((user_id, room_id))
+                if expired:
+                    await self._expire(expired, now)
+            except Exception as e:
+                logger.error(f"Ban index update failed: {e}", exc_info=True)
+            finally:
+                self._loaded.set()
+
+            timeout = None
+            if self._next_load is not None:
+                timeout = self._next_load - loop.time()
+            if self.expiry_heap:
+                until_expiry = (self.expiry_heap[0][0] - utc_now_naive()).total_seconds()
+                timeout = until_expiry if timeout is None else min(timeout, until_expiry)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=None if timeout is None else max(timeout, 0))
+            except TimeoutError:
+                pass
+
+    async def _expire(self, expired: List[BanKey], now: datetime):
+        # Only the rows that just ended: a ban extended meanwhile, or one another worker handles, is left alone
+        async with async_session_maker() as session:
+            await session.execute(
+                delete(models.Ban).where(
+                    tuple_(models.Ban.user_id, models.Ban.room_id).in_(expired),
+                    models.Ban.end_time <= now
+                )
+            )
+            await session.commit()
+        logger.info(f"Lifted {len(expired)} expired mutes")
+
+        for user_id, room_id in expired:
+            await self._notify(user_id, room_id)
+
+    async def _notify(self, user_id: UUID, room_id: UUID):
+        if self.on_expire is None:
+            return
+        try:
+            await self.on_expire(user_id, room_id)
+        except Exception as e:
+            logger.error(f"Failed to notify user {user_id} about lifted mute: {e}")
+
+    async def close(self):
+        for task in (self._task, self._listener):
+            if task is not None:
+                task.cancel()
+        self._task = None
+        self._listener = None
+
+
+ban_index = BanIndex()
@@ -1,3 +1,4 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +8,11 @@ class Settings(BaseSettings):
     database_hostname: str
     database_password: str
     database_port: str
+    # Hosts of streaming replicas, as a JSON list; reads fall back to the primary when a replica lags
+    # more than replica_max_lag seconds or has not replayed the WAL position of the reading user's latest write
+    database_replica_hostnames: List[str] = []
+    replica_max_lag: float = 5.0
+    replica_lag_check_interval: float = 1.0
 
     secret_key: str
     algorithm: str
@@ -19,6 +25,109 @@ class Settings(BaseSettings):
     sayory: str
     hell: str
 
+    # permessage-deflate for WebSocket frames (opt-in)
+    ws_deflate_enabled: bool = False
+    ws_deflate_level: int = 6
+    ws_deflate_mem_level: int = 5
+    ws_deflate_window_bits: int = 12
+    ws_deflate_min_size: int = 512
+
+    # Inbound frame limits per user and action: {action: [tokens per second, burst]}
+    rate_limits: Dict[str, List[float]] = {
+        "send": [2, 10],
+        "type": [2, 5],
+        "vote": [3, 10],
+        "update": [1, 5],
+        "delete": [1, 5],
+        "limit": [0.5, 3],
+    }
+    # drop | delay | notify | disconnect
+    rate_limit_response: str = "notify"
+    rate_limit_max_delay: float = 1.0
+    # Seconds a user's buckets are kept after their last frame, across reconnects
+    rate_limit_bucket_ttl: float = 300.0
+    # /metrics lists the top N throttled users and rooms of the last bucket ttl, out of at most this many tracked
+    rate_limit_top_n: int = 10
+    rate_limit_tracked_keys: int = 1000
+
+    # Application-level ping interval in seconds (0 disables) and how many may go unanswered
+    heartbeat_interval: float = 20.0
+    heartbeat_missed_beats: int = 3
+
+    # How often the in-memory ban index is reloaded from the bans table while its bans_changed listener is down, in seconds
+    ban_index_refresh_interval: float = 30.0
+
+    # Room deletion warnings are checked every room_notice_interval seconds,
+    # expired rooms are purged every room_purge_interval seconds in chunks of messages
+    room_notice_interval: float = 300.0
+    room_purge_interval: float = 3600.0
+    room_purge_chunk_size: int = 1000
+
+    # Presence and online time are kept in memory and written every presence_flush_interval seconds
+    presence_flush_interval: float = 5.0
+
+    # chat_messages is partitioned by month: partitions are created partition_premake_months ahead
+    # and moved to the chat_archive schema (and archive_tablespace, if set) after partition_hot_months
+    partition_premake_months: int = 2
+    partition_hot_months: int = 6
+    partition_maintenance_interval: float = 3600.0
+    archive_tablespace: str = ""
+
+    # Events kept per room for resuming clients, and how old a resume token may be
+    # for the gap to be filled from the database instead of a full reload
+    event_log_size: int = 500
+    resume_max_age: float = 600.0
+
+    # Join admission: join_concurrency handshakes run at once, up to join_queue_size more wait
+    # join_queue_deadline seconds; the rest are closed with 1013 and a jittered retry delay
+    join_concurrency: int = 32
+    join_queue_size: int = 256
+    join_queue_deadline: float = 5.0
+    join_retry_base_ms: int = 1000
+    join_retry_max_ms: int = 30000
+
+    # Room export: rows fetched from the server-side cursor and decrypted per batch
+    export_batch_size: int = 1000
+
+    # Unread counters: message counts and read markers are written in batches this often
+    unread_flush_interval: float = 5.0
+
+    # Per-company limits on this worker (0 = unlimited): open connections, and a shared token bucket
+    # for send/vote/update/delete frames. tenant_work_slots broadcast and persistence jobs run at once,
+    # handed out to companies in weighted-fair order. tenant_quotas overrides any of max_connections,
+    # message_rate, message_burst and weight (default 1) per company id, as JSON
+    tenant_max_connections: int = 0
+    tenant_message_rate: float = 0.0
+    tenant_message_burst: float = 0.0
+    tenant_work_slots: int = 16
+    tenant_quotas: Dict[str, Dict[str, float]] = {}
+
+    # bcrypt runs on this many threads; up to password_hash_queue logins wait for one, the rest get a 503
+    password_hash_workers: int = 4
+    password_hash_queue: int = 64
+
+    # Stage tracing of joins and frames: the share of traces sampled for metrics and the exporter,
+    # the duration above which a trace goes to the slow log (0 turns it off), and an OTLP/HTTP collector
+    trace_sample_rate: float = 0.0
+    trace_slow_threshold_ms: float = 500.0
+    trace_exporter_url: str = ""
+    trace_export_interval: float = 5.0
+
+    # Author profiles (user_name, avatar, verified) kept in memory for history reads
+    profile_cache_size: int = 10000
+    # LISTEN connections (profiles, bans) run SELECT 1 this often, in seconds, and reconnect when it goes unanswered
+    listener_ping_interval: float = 15.0
+
+    # Typing frames are dropped for a socket that already has this many frames waiting to be written
+    outbound_typing_drop_backlog: int = 4
+
+    # Messages sent before the join completes; the rest of the requested history follows in pages (0 sends it all at once)
+    history_first_screen: int = 20
+    history_backfill_page: int = 100
+
+    # Bearer token required by /metrics; when empty, /metrics answers loopback clients only
+    metrics_token: str = ""
+
     model_config = SettingsConfigDict(env_file = ".env")
 
 
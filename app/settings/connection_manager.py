@@ -1,9 +1,12 @@
 from uuid import UUID
 import uuid
+import json
+import time
+import asyncio
 from datetime import datetime
 import pytz
 from _log_config.log_config import get_logger
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 
 from app.settings.database import async_session_maker
 from app.models import models
@@ -11,11 +14,100 @@ from app.schemas import schemas
 from sqlalchemy import insert
 from typing import List, Dict, Optional, Tuple
 from app.functions.func_socket import async_encrypt
+from app.settings import outbound, wire_format
+from app.settings.config import settings
+from app.settings.metrics import metrics
+from app.settings.tracing import tracer
+from app.settings.replicas import replica_router
+from app.settings.tenants import tenant_scheduler
+from app.settings.unread import unread_counters
+from app.settings.event_log import RoomEventLog
 
 logger = get_logger('connect_manager', 'connect_manager.log')
 
+# Close code sent to a client that stopped answering heartbeats
+HEARTBEAT_TIMEOUT_CLOSE_CODE = 4000
 
 
+class SocketConnection:
+    """
+    A client WebSocket together with the wire protocol negotiated for it.
+    Every frame sent to the client goes through send_frame so it is encoded
+    as JSON text or MessagePack binary depending on the protocol, and written
+    in the order of its priority class (see app/settings/outbound.py).
+    """
+
+    def __init__(self, websocket: WebSocket, protocol: str = wire_format.JSON_PROTOCOL):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        # Only clients that answered a ping are known to keep sending pongs while idle
+        self.answers_pings = False
+        self.lanes = outbound.OutboundLanes()
+
+    async def send_frame(self, frame, priority: int = outbound.LIVE):
+        if self.lanes.should_drop(priority):
+            return
+        if not isinstance(frame, wire_format.Frame):
+            frame = wire_format.Frame(frame)
+        encoded = frame.encode(self.protocol)
+        async with self.lanes.turn(priority):
+            if isinstance(encoded, bytes):
+                await self.websocket.send_bytes(encoded)
+            else:
+                await self.websocket.send_text(encoded)
+
+    async def receive_frame(self):
+        """
+        Receives the next client frame and decodes it according to the negotiated protocol.
+
+        Any frame, including heartbeat pongs (which are consumed here), counts as a sign of life.
+        Once the client has answered a ping, nothing arriving for heartbeat_missed_beats heartbeat
+        intervals means the connection is dead: it is closed and WebSocketDisconnect is raised so
+        the caller runs its normal teardown. Clients that never answer pings are not reaped, as
+        a quiet client that does not know the heartbeat is indistinguishable from a dead one.
+        """
+        idle_timeout = settings.heartbeat_interval * settings.heartbeat_missed_beats
+        while True:
+            try:
+                async with asyncio.timeout(idle_timeout if idle_timeout > 0 and self.answers_pings else None):
+                    data = await self._receive()
+            except TimeoutError:
+                await self.reap()
+                raise WebSocketDisconnect(code=HEARTBEAT_TIMEOUT_CLOSE_CODE)
+
+            self.last_seen = time.monotonic()
+            if isinstance(data, dict) and "pong" in data:
+                self.answers_pings = True
+                continue
+            return data
+
+    async def _receive(self):
+        if self.protocol != wire_format.MSGPACK_PROTOCOL:
+            return await self.websocket.receive_json()
+
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        if message.get("bytes") is not None:
+            return wire_format.decode_msgpack(message["bytes"])
+        return json.loads(message["text"])
+
+    async def reap(self):
+        """
+        Closes a connection that missed too many heartbeats and records how long it lingered.
+        """
+        now = time.monotonic()
+        metrics.inc("reaped_connections")
+        metrics.observe("reaped_connection_idle_seconds", now - self.last_seen)
+        metrics.observe("reaped_connection_age_seconds", now - self.connected_at)
+        try:
+            # A half-open socket never completes the closing handshake, so don't wait for it
+            await asyncio.wait_for(self.websocket.close(code=HEARTBEAT_TIMEOUT_CLOSE_CODE), timeout=1)
+        except Exception:
+            pass
+
 
 class ConnectionManager:
     def __init__(self):
@@ -23,25 +115,69 @@ class ConnectionManager:
         self.active_connections: List[WebSocket] = []
         
         # Dictionary to map user IDs to their WebSocket connection, username, and avatar
-        self.user_connections: Dict[UUID, Tuple[WebSocket, str, str, UUID, bool]] = {}
+        self.user_connections: Dict[UUID, Tuple[SocketConnection, str, str, UUID, bool]] = {}
+
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+        # Sequence numbers and recent events of each room, for resuming clients
+        self.event_log = RoomEventLog()
 
     async def connect(self, websocket: WebSocket, user_id: UUID,
-                      user_name: str, avatar: str, room_id: UUID, verified: bool):
+                      user_name: str, avatar: str, room_id: UUID, verified: bool) -> SocketConnection:
         """
-        Accepts a new WebSocket connection and stores it in the list of active connections
-        and the dictionary of user connections.
+        Accepts a new WebSocket connection with the wire protocol requested by the client
+        and stores it in the list of active connections and the dictionary of user connections.
         """
-        await websocket.accept()
+        protocol = wire_format.negotiate_protocol(websocket)
+        subprotocol = protocol if protocol != wire_format.JSON_PROTOCOL else None
+        await websocket.accept(subprotocol=subprotocol)
+
+        connection = SocketConnection(websocket, protocol)
         self.active_connections.append(websocket)
-        self.user_connections[user_id] = (websocket, user_name, avatar, room_id, verified)
+        self.user_connections[user_id] = (connection, user_name, avatar, room_id, verified)
+
+        if self.heartbeat_task is None and settings.heartbeat_interval > 0:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        return connection
 
     def disconnect(self, websocket: WebSocket, user_id: UUID):
         """
         Removes a WebSocket connection from the list of active connections and the user
         connections dictionary when a user disconnects.
         """
-        self.active_connections.remove(websocket)
-        self.user_connections.pop(user_id, None)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+
+        # A reaped zombie may be torn down after the same user already reconnected
+        current = self.user_connections.get(user_id)
+        if current is not None and current[0].websocket is websocket:
+            self.user_connections.pop(user_id, None)
+
+    async def heartbeat(self):
+        """
+        Sends an application-level ping to every connection each heartbeat interval.
+        Clients answer with {"pong": <ping value>}; connections that stay silent are
+        reaped by SocketConnection.receive_frame.
+        """
+        while True:
+            await asyncio.sleep(settings.heartbeat_interval)
+            frame = wire_format.Frame({"ping": int(time.time() * 1000)})
+            connections = [connection for connection, *_ in self.user_connections.values()]
+            metrics.set_gauge("open_connections", len(connections))
+            await asyncio.gather(*(self._ping(connection, frame) for connection in connections))
+
+    async def close(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    @staticmethod
+    async def _ping(connection: SocketConnection, frame: wire_format.Frame):
+        try:
+            await asyncio.wait_for(connection.send_frame(frame), timeout=settings.heartbeat_interval)
+        except Exception as e:
+            metrics.inc("heartbeat_send_failures")
+            logger.warning(f"Failed to send heartbeat: {e}")
         
             
     async def send_active_users(self, room_id: UUID):
@@ -53,34 +189,62 @@ class ConnectionManager:
                 for user_id, user_info in self.user_connections.items()
                 if user_info[3] == room_id  # Check if the user is in the specified room
             ]
-            message_data = {"active_users": active_users}
+            frame = wire_format.Frame({"active_users": active_users})
 
             # Send the message only to users in the specified room
-            for websocket, _, _, user_room_id, _ in self.user_connections.values():
-                if user_room_id == room_id:
-                    await websocket.send_json(message_data)
+            with tracer.span("fan_out", recipients=len(active_users)):
+                for connection, _, _, user_room_id, _ in self.user_connections.values():
+                    if user_room_id == room_id:
+                        await connection.send_frame(frame)
                     
                     
+    def room_population(self, room_id: UUID) -> int:
+        """
+        Number of connections in a room, i.e. the fan-out of a frame sent to it.
+        """
+        return sum(1 for _, _, _, user_room_id, _ in self.user_connections.values() if user_room_id == room_id)
+
+    async def send_to_room(self, room_id: UUID, payload):
+        """
+        Sends one frame to every WebSocket connection in a specific room.
+        """
+        frame = payload if isinstance(payload, wire_format.Frame) else wire_format.Frame(payload)
+        recipients = [connection for connection, _, _, user_room_id, _ in list(self.user_connections.values())
+                      if user_room_id == room_id]
+        with tracer.span("fan_out", recipients=len(recipients)):
+            for connection in recipients:
+                await connection.send_frame(frame)
+
+    async def publish(self, room_id: UUID, event: schemas.RoomEvent):
+        """
+        Sends a room event (message, edit, delete, vote) to the room and records it in the event log.
+        """
+        await self.send_to_room(room_id, self.event_log.append(room_id, event))
+
     async def notify_users_typing(self, room_id: UUID, user_name: str, typing_user_id: UUID):
         """
         Sends a message to all active WebSocket connections in a specific room 
         except for the user who is typing.
         """
-        message_data = {"type": user_name}
+        frame = wire_format.Frame({"type": user_name})
  
-        for user_id, (connection, _, _, user_room_id, _) in self.user_connections.items():
-            if user_room_id == room_id and user_id != typing_user_id:
-                await connection.send_json(message_data)
+        with tracer.span("fan_out"):
+            for user_id, (connection, _, _, user_room_id, _) in self.user_connections.items():
+                if user_room_id == room_id and user_id != typing_user_id:
+                    await connection.send_frame(frame, outbound.TYPING)
 
     async def broadcast_all(self, message: Optional[str], fileUrl: Optional[str],
                             voiceUrl: Optional[str], videoUrl: Optional[str],
                             room: str, receiver_id: UUID,
                             id_return: Optional[UUID],
                             user_name: str, avatar: str,
-                            verified: bool, room_id: UUID, add_to_db: bool):
+                            verified: bool, room_id: UUID, add_to_db: bool,
+                            company_id: Optional[UUID] = None):
         """
         Sends a message to all active WebSocket connections. If `add_to_db` is True, it also
-        adds the message to the database.
+        adds the message to the database, in a weighted-fair turn of the sender's company
+        (see app/settings/tenants.py). The turn is released before the fan-out, so slow
+        receivers cannot hold the shared work slots.
         """
         try:
             timezone = pytz.timezone('UTC')
@@ -88,8 +252,9 @@ class ConnectionManager:
             file_id = None
 
             if add_to_db:
-                file_id = await self.add_all_to_database(message, fileUrl, voiceUrl,
-                                                         videoUrl, room, receiver_id, id_return, room_id)
+                async with tenant_scheduler.turn(company_id, self.room_population(room_id)):
+                    file_id = await self.add_all_to_database(message, fileUrl, voiceUrl,
+                                                             videoUrl, room, receiver_id, id_return, room_id)
 
             if file_id is None:
                 file_id = uuid.uuid4()
@@ -113,12 +278,9 @@ class ConnectionManager:
             )
 
             wrapped_message = await schemas.wrap_message(socket_message)
-            message_json = wrapped_message.model_dump_json()
 
             # Send the message only to users in the specified room
-            for user_id, (connection, _, _, user_room, _) in self.user_connections.items():
-                if user_room == room_id:
-                    await connection.send_text(message_json)
+            await self.publish(room_id, wrapped_message)
         except Exception as e:
             logger.error(f"Failed to broadcast message: {str(e)}")
 
@@ -131,14 +293,20 @@ class ConnectionManager:
         Adds a message to the database asynchronously.
         """
         try:
-            encrypt_message = await async_encrypt(message)
+            with tracer.span("encrypt"):
+                encrypt_message = await async_encrypt(message)
             async with async_session_maker() as session:
                 stmt = insert(models.ChatMessages).values(message=encrypt_message,
                                                           fileUrl=fileUrl, voiceUrl=voiceUrl, videoUrl=videoUrl,
                                                           rooms=room, receiver_id=receiver_id,
                                                           id_return=id_message, room_id=room_id)
-                result = await session.execute(stmt)
-                await session.commit()
+                with tracer.span("persist"):
+                    result = await session.execute(stmt)
+                    await session.commit()
+                # The author's next history read must not go to a replica that has not seen this yet
+                await replica_router.note_write(receiver_id)
+                if room_id is not None:
+                    unread_counters.message_added(room_id)
 
                 message_id = result.inserted_primary_key[0]
                 return message_id
@@ -147,12 +315,12 @@ class ConnectionManager:
 
     async def send_message_to_user(self, message: Optional[str], fileUrl: Optional[str],
                             voiceUrl: Optional[str], videoUrl: Optional[str],
-                            room: str, receiver_id: UUID,
+                            room: str, receiver_id: UUID, user_id: UUID,
                             id_return: Optional[UUID],
                             user_name: str, avatar: str,
                             verified: bool, room_id: UUID, add_to_db: bool):
         """
-        Sends a message to all active WebSocket connections. If `add_to_db` is True, it also
+        Sends a message to the WebSocket connection of a single user. If `add_to_db` is True, it also
         adds the message to the database.
         """
         try:
@@ -185,11 +353,9 @@ class ConnectionManager:
                 room_id=room_id
             )
 
-            message_json = socket_message.model_dump_json()
-
             # Send the message only to the specified user_id
             connection = self.user_connections.get(user_id)
             if connection:
-                await connection[0].send_text(message_json)
+                await connection[0].send_frame(await schemas.wrap_message(socket_message))
         except Exception as e:
             logger.error(f"Failed to send message to user: {str(e)}")
\ No newline at end of file
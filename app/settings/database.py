@@ -20,6 +20,16 @@ Base = declarative_base()
 engine_async = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
 async_session_maker = async_sessionmaker(bind=engine_async, expire_on_commit=False)
 
+# Read replicas share the primary's credentials and database name; reads are routed by app.settings.replicas
+replica_engines = {
+    hostname: create_async_engine(
+        f'postgresql+asyncpg://{settings.database_username}:'
+        f'{settings.database_password}@{hostname}:'
+        f'{settings.database_port}/{settings.database_name}'
+    )
+    for hostname in settings.database_replica_hostnames
+}
+
 # Асинхронна функція для отримання сесії
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
@@ -0,0 +1,84 @@
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from app.schemas import schemas
+from app.settings.config import settings
+from app.settings.wire_format import Frame
+
+
+# Messages are stamped by the database before they are sent, so a resume from the database
+# starts this many seconds before the token; clients drop the repeats by message id
+DB_RESUME_OVERLAP = 5.0
+
+
+class ResumeToken(NamedTuple):
+    epoch: str
+    seq: int
+    at: float
+
+
+def parse_resume_token(token: str) -> Optional[ResumeToken]:
+    """
+    Parses "<epoch>.<seq>.<unix ms>"; returns None for anything else.
+    """
+    try:
+        epoch, seq, at = token.split(".")
+        return ResumeToken(epoch, int(seq), int(at) / 1000)
+    except ValueError:
+        return None
+
+
+class RoomEventLog:
+    """
+    Numbers the events sent to each room (messages, edits, deletes, votes) and keeps the
+    last event_log_size of them per room.
+
+    Every event frame carries a resume token: the epoch of this process, the room sequence
+    number and the send time. A reconnecting client passes its last token back and gets
+    only the frames it missed, as long as they are still in the log and the process has not
+    restarted (the epoch matches); otherwise the caller falls back to the database by time.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.size = size or settings.event_log_size
+        self.sequences: Dict[UUID, int] = {}
+        self.logs: Dict[UUID, Deque[Tuple[int, Frame]]] = {}
+
+    def _token(self, seq: int, at: float) -> str:
+        return f"{self.epoch}.{seq}.{int(at * 1000)}"
+
+    def token(self, room_id: UUID) -> str:
+        """
+        Token of a client that has seen every event of the room so far.
+        """
+        return self._token(self.sequences.get(room_id, 0), time.time())
+
+    def append(self, room_id: UUID, event: schemas.RoomEvent) -> Frame:
+        seq = self.sequences.get(room_id, 0) + 1
+        self.sequences[room_id] = seq
+        frame = Frame(event.model_copy(update={"seq": self._token(seq, time.time())}))
+
+        log = self.logs.get(room_id)
+        if log is None:
+            log = self.logs[room_id] = deque(maxlen=self.size)
+        log.append((seq, frame))
+        return frame
+
+    def replay(self, room_id: UUID, token: ResumeToken) -> Optional[List[Frame]]:
+        """
+        Frames of the room after token, or None when the log cannot tell what was missed.
+        """
+        current = self.sequences.get(room_id, 0)
+        if token.epoch != self.epoch or token.seq > current:
+            return None
+        if token.seq == current:
+            return []
+
+        log = self.logs.get(room_id)
+        if not log or log[0][0] > token.seq + 1:
+            return None
+        return [frame for seq, frame in log if seq > token.seq]
@@ -0,0 +1,70 @@
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+    """
+    Minimal in-process registry of counters, gauges and summaries.
+    Values are exposed as JSON by the /metrics route; collectors run first, for gauges
+    that are only worth computing when someone reads them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self.summaries: Dict[str, Dict[LabelKey, Dict[str, float]]] = defaultdict(dict)
+        self.collectors: List[Callable[[], None]] = []
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._lock:
+            self.counters[name][_label_key(labels)] += amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[name][_label_key(labels)] = value
+
+    def replace_gauge(self, name: str, series: Iterable[Tuple[Dict[str, Any], float]]):
+        """
+        Replaces every labelled value of a gauge, e.g. a top-N list whose members change.
+        """
+        values = {_label_key(labels): value for labels, value in series}
+        with self._lock:
+            self.gauges[name] = values
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            summary = self.summaries[name].setdefault(
+                _label_key(labels), {"count": 0, "sum": 0.0, "max": 0.0}
+            )
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        for collector in self.collectors:
+            collector()
+        with self._lock:
+            return {
+                "counters": {name: _expand(values) for name, values in self.counters.items()},
+                "gauges": {name: _expand(values) for name, values in self.gauges.items()},
+                "summaries": {name: _expand(values) for name, values in self.summaries.items()},
+            }
+
+
+def _expand(values: Dict[LabelKey, Any]):
+    return [{"labels": dict(key), "value": value} for key, value in values.items()]
+
+
+metrics = Metrics()
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+import asyncpg
+
+from app.settings.config import settings
+
+# Seconds before a listener reconnects after losing its connection
+RECONNECT_DELAY = 5.0
+
+
+async def listen(channel: str, on_notification: Callable,
+                 on_connected: Optional[Callable[[], Awaitable[None]]] = None):
+    """
+    Opens a dedicated connection to the primary, LISTENs on channel and returns once
+    the connection is lost. on_connected runs after LISTEN is in place, so anything it
+    loads cannot miss a notification sent meanwhile. Callers wrap this in their own
+    reconnect loop.
+
+    An idle connection whose peer vanished (failover, dropped NAT entry) may never be
+    reported as closed, so every listener_ping_interval seconds it runs SELECT 1 and
+    raises if no answer comes within the same interval.
+    """
+    connection = await asyncpg.connect(
+        host=settings.database_hostname,
+        port=int(settings.database_port),
+        user=settings.database_username,
+        password=settings.database_password,
+        database=settings.database_name,
+    )
+    lost = asyncio.Event()
+    try:
+        connection.add_termination_listener(lambda _: lost.set())
+        await connection.add_listener(channel, on_notification)
+        if on_connected is not None:
+            await on_connected()
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), timeout=settings.listener_ping_interval)
+            except asyncio.TimeoutError:
+                await asyncio.wait_for(connection.fetchval("SELECT 1"), timeout=settings.listener_ping_interval)
+    finally:
+        if not connection.is_closed():
+            # Terminated instead when the peer does not answer the close either
+            await connection.close(timeout=settings.listener_ping_interval)
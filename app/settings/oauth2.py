@@ -4,6 +4,7 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 
 from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
 from uuid import UUID
 
 from app.settings import database
@@ -69,6 +70,9 @@ async def verify_access_token(token: str, credentials_exception, db: AsyncSessio
 
     except JWTError:
         oauth2_logger.error(f"Invalid JWT token: {token}")
+    except (DBAPIError, OSError):
+        # Database failures are not bad credentials: let the caller retry elsewhere (see ReplicaRouter.read)
+        raise
     except Exception as e:
         oauth2_logger.error(f"Error verifying access token: {e}")
 
@@ -91,6 +95,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
 
     Raises:
         HTTPException: If the credentials are invalid.
+        DBAPIError, OSError: If the database could not be read; left unwrapped so a replica read can fall back.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -106,6 +111,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
             oauth2_logger.error("Could not find user")
 
         return user
+    except (DBAPIError, OSError):
+        raise
     except Exception as e:
         oauth2_logger.error(f"Error getting current user: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
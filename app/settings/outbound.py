@@ -0,0 +1,75 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+from app.settings.config import settings
+from app.settings.metrics import metrics
+
+# Priority classes of outgoing frames; when frames compete for a socket the lowest goes first
+LIVE = 0      # chat messages and control events: edits, deletes, votes, notices, presence, pings
+TYPING = 1    # typing indicators, dropped when the socket is backed up
+HISTORY = 2   # history pages sent on join and on "limit" requests
+
+LANE_NAMES = {LIVE: "live", TYPING: "typing", HISTORY: "history"}
+
+
+class OutboundLanes:
+    """
+    Orders the frames waiting to be written to one WebSocket by priority class.
+
+    Each frame holds the socket only while it is written, and when it is done the waiting
+    frame of the lowest class goes next (first come, first served within a class). A
+    history load is written frame by frame, so live messages and control events sent
+    meanwhile are interleaved right away instead of queueing behind the whole page. Typing
+    frames are dropped when outbound_typing_drop_backlog frames are already waiting.
+    """
+
+    def __init__(self):
+        self.busy = False
+        self.waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def should_drop(self, priority: int) -> bool:
+        if priority == TYPING and len(self.waiting) >= settings.outbound_typing_drop_backlog:
+            metrics.inc("outbound_frames_dropped", lane=LANE_NAMES[priority])
+            return True
+        return False
+
+    async def _acquire(self, priority: int):
+        if not self.busy and not self.waiting:
+            self.busy = True
+            return
+
+        queued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just before the cancellation arrived: pass the socket on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        metrics.observe("outbound_wait_seconds", time.monotonic() - queued, lane=LANE_NAMES[priority])
+
+    def _release(self):
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.busy = False
+
+    @asynccontextmanager
+    async def turn(self, priority: int):
+        """
+        Holds the socket for the body once every waiting frame of a lower class has been written.
+        """
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
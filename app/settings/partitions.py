@@ -0,0 +1,252 @@
+import asyncio
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import pytz
+from sqlalchemy import text
+
+from _log_config.log_config import get_logger
+from app.settings.config import settings
+from app.settings.database import engine_async
+from app.settings.metrics import metrics
+
+logger = get_logger('partitions', 'partitions.log')
+
+ARCHIVE_SCHEMA = "chat_archive"
+
+# Arbitrary key of the advisory lock that keeps workers from maintaining partitions at the same time
+MAINTENANCE_LOCK_KEY = 0x63686174
+
+PARTITIONS_QUERY = text("""
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:parent AS regclass)
+""")
+
+# Partitions left half-detached by an interrupted DETACH ... CONCURRENTLY
+PENDING_DETACH_QUERY = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST('public.chat_messages' AS regclass) AND i.inhdetachpending
+""")
+
+# Message partitions attached to neither parent, left behind by an archive move that failed half-way
+DETACHED_QUERY = text("""
+    SELECT n.nspname, c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r' AND NOT c.relispartition
+      AND n.nspname IN ('public', :archive)
+      AND (c.relname ~ '^chat_messages_[0-9]{4}_[0-9]{2}$' OR c.relname = 'chat_messages_legacy')
+""")
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+LOWER_BOUND = re.compile(r"FROM \('([^']+)'\)")
+MONTHLY_PARTITION = re.compile(r"^chat_messages_(\d{4})_(\d{2})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(pytz.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"chat_messages_{month:%Y_%m}"
+
+
+def partition_month(name: str) -> Optional[datetime]:
+    match = MONTHLY_PARTITION.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=pytz.utc) if match else None
+
+
+def month_bound(month: datetime) -> str:
+    return f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+def upper_bound(bound: str) -> Optional[datetime]:
+    match = UPPER_BOUND.search(bound)
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+def lower_bound(bound: str) -> Optional[datetime]:
+    # None for FROM (MINVALUE)
+    match = LOWER_BOUND.search(bound)
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+class PartitionMaintainer:
+    """
+    Keeps the monthly partitions of chat_messages in shape.
+
+    Every partition_maintenance_interval seconds one worker (guarded by an advisory lock)
+    creates the partitions for the next partition_premake_months months and moves partitions
+    older than partition_hot_months to the chat_archive schema: DETACH CONCURRENTLY, SET SCHEMA,
+    optionally SET TABLESPACE to archive_tablespace, then ATTACH to chat_archive.chat_messages.
+    archive_boundary is the upper bound of the newest archived partition, so history reads
+    only look at the archive for rooms whose hot rows run out before it.
+
+    A move that fails half-way would leave a partition in no parent, its rows gone from every
+    read, so each run first finishes what an earlier one left: DETACH ... FINALIZE for a
+    partition still pending detach, then the rest of the move for any chat_messages_* table
+    attached to neither parent.
+    """
+
+    def __init__(self):
+        self.archive_boundary: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loaded = asyncio.Event()
+
+    async def ensure_started(self):
+        """
+        Starts maintenance in the background and waits only for archive_boundary to be read;
+        the DDL of the first run may wait on open transactions and must not hold up startup.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        await self._loaded.wait()
+
+    @property
+    def has_archive(self) -> bool:
+        return self.archive_boundary is not None
+
+    @staticmethod
+    async def _partitions(connection, parent: str) -> List[Tuple[str, str]]:
+        result = await connection.execute(PARTITIONS_QUERY, {"parent": parent})
+        return [(name, bound) for name, bound in result.all()]
+
+    async def load(self, connection):
+        archived = await self._partitions(connection, f"{ARCHIVE_SCHEMA}.chat_messages")
+        bounds = [upper_bound(bound) for _, bound in archived]
+        self.archive_boundary = max((bound for bound in bounds if bound), default=None)
+
+    async def maintain(self):
+        # DETACH ... CONCURRENTLY cannot run inside a transaction block
+        async with engine_async.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            locked = await connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+            if not locked:
+                await self.load(connection)
+                return
+            try:
+                await self._recover_partitions(connection)
+                await self._create_partitions(connection)
+                await self._archive_partitions(connection)
+                await self.load(connection)
+            finally:
+                await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+
+    async def _create_partitions(self, connection):
+        partitions = await self._partitions(connection, "public.chat_messages")
+        existing = {name for name, _ in partitions}
+        current = month_start(datetime.now(pytz.utc))
+        # Months before the end of the legacy partition are already covered by it
+        legacy_end = max((upper_bound(bound) for name, bound in partitions if partition_month(name) is None
+                          and upper_bound(bound) is not None), default=None)
+
+        for offset in range(settings.partition_premake_months + 1):
+            start = add_months(current, offset)
+            name = partition_name(start)
+            if name in existing or (legacy_end is not None and start < legacy_end):
+                continue
+            end = add_months(start, 1)
+            await connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF chat_messages "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            metrics.inc("chat_message_partitions_created")
+            logger.info(f"Created partition {name}")
+
+    async def _archive_partitions(self, connection):
+        cutoff = add_months(month_start(datetime.now(pytz.utc)), -settings.partition_hot_months)
+
+        for name, bound in await self._partitions(connection, "public.chat_messages"):
+            end = upper_bound(bound)
+            if end is None or end > cutoff:
+                continue
+
+            await connection.execute(text(f"ALTER TABLE chat_messages DETACH PARTITION {name} CONCURRENTLY"))
+            await self._move_to_archive(connection, "public", name, bound)
+
+    @staticmethod
+    async def _move_to_archive(connection, schema: str, name: str, bound: str):
+        """
+        The steps of an archive move after the DETACH, from wherever an earlier attempt stopped.
+        """
+        if schema != ARCHIVE_SCHEMA:
+            await connection.execute(text(f"ALTER TABLE {schema}.{name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        if settings.archive_tablespace:
+            await connection.execute(text(
+                f"ALTER TABLE {ARCHIVE_SCHEMA}.{name} SET TABLESPACE {settings.archive_tablespace}"
+            ))
+        # DETACH CONCURRENTLY left a CHECK matching the bounds, so this does not rescan the rows
+        await connection.execute(text(
+            f"ALTER TABLE {ARCHIVE_SCHEMA}.chat_messages ATTACH PARTITION {ARCHIVE_SCHEMA}.{name} {bound}"
+        ))
+        metrics.inc("chat_message_partitions_archived")
+        logger.info(f"Archived partition {name} ({bound})")
+
+    async def _recover_partitions(self, connection):
+        for (name,) in (await connection.execute(PENDING_DETACH_QUERY)).all():
+            await connection.execute(text(f"ALTER TABLE chat_messages DETACH PARTITION {name} FINALIZE"))
+            logger.warning(f"Finished the interrupted detach of partition {name}")
+
+        detached = (await connection.execute(DETACHED_QUERY, {"archive": ARCHIVE_SCHEMA})).all()
+        if not detached:
+            return
+
+        # The legacy partition ends where the oldest monthly partition, attached or not, begins
+        attached = [name for parent in ("public.chat_messages", f"{ARCHIVE_SCHEMA}.chat_messages")
+                    for name, _ in await self._partitions(connection, parent)]
+        months = [month for month in map(partition_month, attached + [name for _, name in detached]) if month]
+        cutoff = add_months(month_start(datetime.now(pytz.utc)), -settings.partition_hot_months)
+
+        for schema, name in detached:
+            month = partition_month(name)
+            if month is not None:
+                bound, end = month_bound(month), add_months(month, 1)
+            elif months:
+                end = min(months)
+                bound = f"FOR VALUES FROM (MINVALUE) TO ('{end.isoformat()}')"
+            else:
+                logger.error(f"Cannot tell the bounds of detached partition {schema}.{name}; reattach it by hand")
+                continue
+
+            metrics.inc("chat_message_partitions_recovered")
+            if schema == "public" and end > cutoff:
+                # Still hot: it goes back where it came from
+                await connection.execute(text(f"ALTER TABLE chat_messages ATTACH PARTITION public.{name} {bound}"))
+                logger.warning(f"Reattached detached partition {name} ({bound})")
+            else:
+                logger.warning(f"Resuming the archive move of detached partition {schema}.{name}")
+                await self._move_to_archive(connection, schema, name, bound)
+
+    async def _run(self):
+        try:
+            async with engine_async.connect() as connection:
+                await self.load(connection)
+        except Exception as e:
+            logger.error(f"Initial partition load failed: {e}", exc_info=True)
+        finally:
+            self._loaded.set()
+
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}", exc_info=True)
+            await asyncio.sleep(settings.partition_maintenance_interval)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+partition_maintainer = PartitionMaintainer()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app.settings import utils
+from app.settings.config import settings
+from app.settings.metrics import metrics
+
+
+class PasswordPoolFull(Exception):
+    pass
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashing and verification on a bounded thread pool instead of the event loop.
+
+    bcrypt is deliberately slow (100-300 ms) and releases the GIL while it works, so on
+    threads it runs alongside the loop and WebSocket delivery keeps going during a login
+    burst. At most password_hash_workers run at once; up to password_hash_queue more wait
+    for a thread, and anything beyond that fails fast with PasswordPoolFull.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        self.workers = workers or settings.password_hash_workers
+        self.queue_size = queue_size if queue_size is not None else settings.password_hash_queue
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.waiting = 0
+        self.in_flight = 0
+
+    def _update_gauges(self):
+        metrics.set_gauge("password_hash_queue_depth", self.waiting)
+        metrics.set_gauge("password_hash_in_flight", self.in_flight)
+
+    async def _run(self, func, *args):
+        if self._semaphore.locked() and self.waiting >= self.queue_size:
+            metrics.inc("password_hash_rejected")
+            raise PasswordPoolFull()
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+        queued = time.monotonic()
+        self.waiting += 1
+        self._update_gauges()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        metrics.observe("password_hash_wait_seconds", started - queued)
+
+        self.in_flight += 1
+        self._update_gauges()
+        try:
+            # The semaphore matches the pool size, so the executor never queues work of its own
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._update_gauges()
+            metrics.observe("password_hash_seconds", time.monotonic() - started)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(utils.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(utils.hash_password, password)
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,240 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+import pytz
+from sqlalchemy import Boolean, Interval, String, cast, column, exists, func, insert, or_, update, values
+from sqlalchemy.dialects.postgresql import TIMESTAMP, UUID as PG_UUID
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.functions.func_socket import get_hell
+from app.models import models
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+
+logger = get_logger('presence', 'presence.log')
+
+# (room_id, name_room, online, at) as it should end up in user_status; at is when the join or leave happened
+StatusRow = Tuple[UUID, str, bool, datetime]
+
+
+def _session_end(pending):
+    # A VALUES column holding only NULLs is typed as text by Postgres
+    return cast(pending.c.session_end, TIMESTAMP(timezone=True))
+
+
+class PendingSession:
+    """
+    Online-time changes of one user that have not been written to user_online_time yet.
+    """
+
+    def __init__(self, session_start: datetime):
+        self.session_start = session_start
+        self.session_end: Optional[datetime] = None
+        self.added = timedelta()
+
+    def merge_older(self, older: "PendingSession"):
+        # Times from the newer entry win, durations add up
+        self.added += older.added
+
+
+class PresenceStore:
+    """
+    Keeps user presence (room, online flag) and online-time sessions of this node in memory.
+
+    Joins and leaves only touch the in-memory state; a background task writes whatever
+    changed every presence_flush_interval seconds with one set-based UPDATE per table,
+    so a user hopping between rooms costs at most one row write per flush instead of
+    several commits per join. close() does a final flush on shutdown, and a failed flush
+    keeps its rows pending for the next one. Each status row carries the time of its join
+    or leave, and a flush only overwrites rows older than that, so when a user moves
+    between nodes the slower node's flush cannot undo the newer state.
+    """
+
+    def __init__(self):
+        self.open_sessions: Dict[UUID, datetime] = {}
+        self.pending_status: Dict[UUID, StatusRow] = {}
+        self.pending_sessions: Dict[UUID, PendingSession] = {}
+        self.hell: Optional[Tuple[UUID, str]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        await self.load_hell()
+
+    async def load_hell(self):
+        """
+        Looks up the room users are moved to when they leave; retried by every flush until found.
+        """
+        if self.hell is not None:
+            return
+        try:
+            async with async_session_maker() as session:
+                hell = await get_hell(session)
+        except Exception as e:
+            logger.error(f"Failed to look up the Hell room: {e}")
+            return
+        if hell is not None:
+            self.hell = (hell.id, hell.name_room)
+
+    def join(self, user_id: UUID, room: models.Rooms):
+        now = datetime.now(pytz.utc)
+        self.pending_status[user_id] = (room.id, room.name_room, True, now)
+        self.open_sessions[user_id] = now
+
+        pending = self.pending_sessions.get(user_id)
+        if pending is None:
+            self.pending_sessions[user_id] = PendingSession(now)
+        else:
+            pending.session_start = now
+            pending.session_end = None
+
+    def leave(self, user_id: UUID):
+        """
+        Moves the user to Hell, marks them offline and closes their online session.
+        """
+        now = datetime.now(pytz.utc)
+        if self.hell is not None:
+            self.pending_status[user_id] = (*self.hell, False, now)
+
+        session_start = self.open_sessions.pop(user_id, None)
+        if session_start is None:
+            return
+        pending = self.pending_sessions.setdefault(user_id, PendingSession(session_start))
+        pending.session_end = now
+        pending.added += now - session_start
+
+    async def flush(self):
+        """
+        Writes the pending presence changes in one transaction.
+        """
+        async with self._flush_lock:
+            status_batch, self.pending_status = self.pending_status, {}
+            session_batch, self.pending_sessions = self.pending_sessions, {}
+            if not status_batch and not session_batch:
+                return
+
+            try:
+                async with async_session_maker() as session:
+                    if status_batch:
+                        await session.execute(self._status_update(status_batch))
+                    if session_batch:
+                        pending = self._session_values(session_batch)
+                        await session.execute(self._online_time_update(pending))
+                        await session.execute(self._online_time_insert(pending))
+                    await session.commit()
+            except Exception:
+                self._requeue(status_batch, session_batch)
+                metrics.inc("presence_flush_failures")
+                raise
+
+        metrics.inc("presence_status_rows_flushed", len(status_batch))
+        metrics.inc("presence_session_rows_flushed", len(session_batch))
+
+    def _requeue(self, status_batch: Dict[UUID, StatusRow], session_batch: Dict[UUID, PendingSession]):
+        for user_id, row in status_batch.items():
+            self.pending_status.setdefault(user_id, row)
+        for user_id, pending in session_batch.items():
+            newer = self.pending_sessions.get(user_id)
+            if newer is None:
+                self.pending_sessions[user_id] = pending
+            else:
+                newer.merge_older(pending)
+
+    @staticmethod
+    def _status_update(batch: Dict[UUID, StatusRow]):
+        pending = values(
+            column("user_id", PG_UUID(as_uuid=True)),
+            column("room_id", PG_UUID(as_uuid=True)),
+            column("name_room", String),
+            column("status", Boolean),
+            column("at", TIMESTAMP(timezone=True)),
+            name="pending_status"
+        ).data([(user_id, *row) for user_id, row in batch.items()])
+
+        # A row written by another node for a later join or leave is not overwritten by an older flush
+        return update(models.UserStatus).where(
+            models.UserStatus.user_id == pending.c.user_id,
+            or_(models.UserStatus.updated_at.is_(None), models.UserStatus.updated_at < pending.c.at)
+        ).values(
+            room_id=pending.c.room_id,
+            name_room=pending.c.name_room,
+            status=pending.c.status,
+            updated_at=pending.c.at
+        )
+
+    @staticmethod
+    def _session_values(batch: Dict[UUID, PendingSession]):
+        return values(
+            column("user_id", PG_UUID(as_uuid=True)),
+            column("session_start", TIMESTAMP(timezone=True)),
+            column("session_end", TIMESTAMP(timezone=True)),
+            column("added", Interval),
+            name="pending_sessions"
+        ).data([
+            (user_id, pending.session_start, pending.session_end, pending.added)
+            for user_id, pending in batch.items()
+        ])
+
+    @staticmethod
+    def _online_time_update(pending):
+        online_time = models.UserOnlineTime
+        return update(online_time).where(
+            online_time.user_id == pending.c.user_id
+        ).values(
+            session_start=pending.c.session_start,
+            session_end=_session_end(pending),
+            total_online_time=func.coalesce(online_time.total_online_time, timedelta()) + pending.c.added
+        )
+
+    @staticmethod
+    def _online_time_insert(pending):
+        # Users seen for the first time; runs after the update so existing rows are not counted twice
+        online_time = models.UserOnlineTime
+        return insert(online_time).from_select(
+            ["user_id", "session_start", "session_end", "total_online_time"],
+            select(
+                pending.c.user_id, pending.c.session_start, _session_end(pending), pending.c.added
+            ).where(
+                ~exists().where(online_time.user_id == pending.c.user_id)
+            )
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.presence_flush_interval)
+            await self.load_hell()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Presence flush failed: {e}", exc_info=True)
+
+    async def close(self, attempts: int = 3):
+        """
+        Stops the flush task and writes what is left, retrying a few times before giving up.
+        Sessions still open at this point are closed, as this node is going away.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        for user_id in list(self.open_sessions):
+            self.leave(user_id)
+
+        for attempt in range(1, attempts + 1):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Final presence flush failed (attempt {attempt}/{attempts}): {e}")
+                await asyncio.sleep(attempt)
+        logger.error(f"Lost presence of {len(self.pending_status)} users "
+                     f"and {len(self.pending_sessions)} sessions on shutdown")
+
+
+presence_store = PresenceStore()
@@ -0,0 +1,138 @@
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+from uuid import UUID
+
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.models import models
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+from app.settings.notifications import RECONNECT_DELAY, listen
+
+logger = get_logger('profiles', 'profiles.log')
+
+# Sent by the users_profile_changed trigger (migration 0004) with the user id as payload
+PROFILE_CHANNEL = "user_profile_changed"
+
+
+class AuthorProfile(NamedTuple):
+    user_name: str
+    avatar: str
+    verified: bool
+
+
+class ProfileCache:
+    """
+    Bounded LRU cache of the author fields shown with each message (user_name, avatar, verified).
+
+    History reads select message columns only and take authors from here, so a room where
+    the same few people write hundreds of messages reads each profile once; misses are
+    loaded from the primary in one IN query. Profiles change in the main company service,
+    so invalidation comes from Postgres: a trigger on users sends the id on
+    user_profile_changed and a listener connection drops the entry. Profiles are cached
+    only while that listener is connected, and the cache is cleared when it is lost
+    (including a connection that stops answering its SELECT 1 pings) and again when it
+    reconnects, as changes made while it was away were not heard.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or settings.profile_cache_size
+        self.profiles: "OrderedDict[UUID, AuthorProfile]" = OrderedDict()
+        self.listening = False
+        # Bumped on every invalidation; a miss loaded across one is not cached, it may predate the change
+        self.generation = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def invalidate(self, user_id: UUID):
+        self.generation += 1
+        self.profiles.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self.profiles.clear()
+        metrics.set_gauge("profile_cache_size", 0)
+
+    async def get_many(self, user_ids: Iterable[Optional[UUID]]) -> Dict[UUID, AuthorProfile]:
+        """
+        Profiles of the given users; ids of deleted users are missing from the result.
+        """
+        found: Dict[UUID, AuthorProfile] = {}
+        misses = []
+        for user_id in set(user_ids):
+            if user_id is None:
+                continue
+            profile = self.profiles.get(user_id)
+            if profile is None:
+                misses.append(user_id)
+            else:
+                self.profiles.move_to_end(user_id)
+                found[user_id] = profile
+        metrics.inc("profile_cache_hits", len(found))
+        if not misses:
+            return found
+
+        metrics.inc("profile_cache_misses", len(misses))
+        generation = self.generation
+        loaded = await self.load(misses)
+        found.update(loaded)
+
+        if self.listening and generation == self.generation:
+            self.profiles.update(loaded)
+            while len(self.profiles) > self.size:
+                self.profiles.popitem(last=False)
+            metrics.set_gauge("profile_cache_size", len(self.profiles))
+        return found
+
+    @staticmethod
+    async def load(user_ids) -> Dict[UUID, AuthorProfile]:
+        # Always the primary: a lagging replica could hand back a profile the listener already invalidated
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(models.User.id, models.User.user_name, models.User.avatar, models.User.verified)
+                .where(models.User.id.in_(user_ids))
+            )
+            return {user_id: AuthorProfile(user_name, avatar, verified)
+                    for user_id, user_name, avatar, verified in result.all()}
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            self.invalidate(UUID(payload))
+        except ValueError:
+            logger.warning(f"Ignoring {channel} notification with payload {payload!r}")
+
+    async def _connected(self):
+        self.clear()
+        self.listening = True
+        logger.info(f"Listening on {PROFILE_CHANNEL}")
+
+    async def _listen(self):
+        try:
+            await listen(PROFILE_CHANNEL, self._on_notification, self._connected)
+        finally:
+            self.listening = False
+            self.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+                logger.warning(f"Connection listening on {PROFILE_CHANNEL} was lost")
+            except Exception as e:
+                logger.error(f"Failed to listen on {PROFILE_CHANNEL}: {e}")
+            metrics.inc("profile_listener_reconnects")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import WebSocketDisconnect
+
+from _log_config.log_config import get_logger
+from app.settings.config import settings
+from app.settings.metrics import metrics
+
+logger = get_logger('rate_limit', 'rate_limit.log')
+
+# What to do with a frame once a user's bucket for that action is empty
+DROP = "drop"
+DELAY = "delay"
+NOTIFY = "notify"
+DISCONNECT = "disconnect"
+RESPONSES = (DROP, DELAY, NOTIFY, DISCONNECT)
+
+
+def frame_action(data: dict) -> str:
+    """
+    Maps an inbound client frame to the action it is rate limited as.
+    """
+    for action in ("type", "limit", "vote", "update", "delete", "send"):
+        if action in data:
+            return action
+    return "other"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now: Optional[float] = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """
+        Seconds until the next token is available.
+        """
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+
+class ThrottleTally:
+    """
+    Throttled frames per key (a user or a room) over the last `window` seconds, for at most
+    `size` keys; the key throttled least recently is evicted first, so memory stays bounded.
+    """
+
+    def __init__(self, size: int, window: float):
+        self.size = size
+        self.window = window
+        # key -> [count, last throttled], ordered from least to most recently throttled
+        self.counts: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+
+    def add(self, key: Hashable, now: float):
+        entry = self.counts.pop(key, None)
+        if entry is None or now - entry[1] > self.window:
+            entry = [0, now]
+        entry[0] += 1
+        entry[1] = now
+        self.counts[key] = entry
+        while len(self.counts) > self.size:
+            self.counts.popitem(last=False)
+
+    def top(self, n: int, now: float) -> List[Tuple[Hashable, float]]:
+        while self.counts:
+            key, (_, last) = next(iter(self.counts.items()))
+            if now - last <= self.window:
+                break
+            del self.counts[key]
+        return [(key, count) for key, (count, _) in
+                heapq.nlargest(n, self.counts.items(), key=lambda item: item[1][0])]
+
+
+class RateLimiter:
+    """
+    Token-bucket limits per user and per action type for frames received over the socket.
+    Limits come from settings.rate_limits as {action: [tokens per second, burst]};
+    actions without an entry are not limited.
+
+    Buckets outlive the socket, so reconnecting does not refill them; a user's buckets
+    are dropped once none was used for rate_limit_bucket_ttl seconds, swept at most
+    once per ttl from check().
+
+    Throttled frames are counted per action in the metrics registry; who and where is
+    tracked in two bounded tallies over the same window, and publish() turns them into
+    the rate_limited_top_users / rate_limited_top_rooms gauges when /metrics is read.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 response: Optional[str] = None, max_delay: Optional[float] = None,
+                 bucket_ttl: Optional[float] = None):
+        self.limits = limits if limits is not None else settings.rate_limits
+        self.response = response or settings.rate_limit_response
+        self.max_delay = max_delay if max_delay is not None else settings.rate_limit_max_delay
+        self.bucket_ttl = bucket_ttl if bucket_ttl is not None else settings.rate_limit_bucket_ttl
+        if self.response not in RESPONSES:
+            raise ValueError(f"Unknown rate limit response: {self.response}")
+
+        self.buckets: Dict[UUID, Dict[str, TokenBucket]] = {}
+        self._next_sweep = time.monotonic() + self.bucket_ttl
+        self.throttled_users = ThrottleTally(settings.rate_limit_tracked_keys, self.bucket_ttl)
+        self.throttled_rooms = ThrottleTally(settings.rate_limit_tracked_keys, self.bucket_ttl)
+
+    def check(self, user_id: UUID, room_id: UUID, action: str) -> Tuple[bool, float]:
+        """
+        Takes a token for the action. Returns (allowed, seconds until a token is available).
+        """
+        limit = self.limits.get(action)
+        if limit is None:
+            return True, 0.0
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        user_buckets = self.buckets.setdefault(user_id, {})
+        bucket = user_buckets.get(action)
+        if bucket is None:
+            bucket = user_buckets[action] = TokenBucket(*limit)
+
+        if bucket.try_acquire():
+            return True, 0.0
+
+        # Labelled by action only: users and rooms go to the bounded tallies instead
+        metrics.inc("rate_limited_frames", action=action)
+        self.throttled_users.add(user_id, now)
+        self.throttled_rooms.add(room_id, now)
+        return False, bucket.wait_time()
+
+    async def admit(self, connection, user_id: UUID, room_id: UUID, action: str) -> bool:
+        """
+        Applies the configured response to a frame. Returns True when the frame should be processed.
+        Raises WebSocketDisconnect after closing the socket when the response is disconnect.
+        """
+        allowed, retry_after = self.check(user_id, room_id, action)
+        if allowed:
+            return True
+
+        if self.response == DELAY and retry_after <= self.max_delay:
+            await asyncio.sleep(retry_after)
+            return self.buckets[user_id][action].try_acquire()
+
+        if self.response == NOTIFY or self.response == DELAY:
+            await connection.send_frame({"notice": "Rate limit exceeded",
+                                         "action": action,
+                                         "retry_after": int(retry_after * 1000)})
+        elif self.response == DISCONNECT:
+            logger.warning(f"Disconnecting user {user_id} in room {room_id}: {action} rate limit exceeded")
+            await connection.websocket.close(code=1008)
+            raise WebSocketDisconnect(code=1008)
+        return False
+
+    def publish(self):
+        """
+        Sets the top-N gauges of throttled users and rooms; registered as a metrics collector.
+        """
+        now = time.monotonic()
+        n = settings.rate_limit_top_n
+        metrics.replace_gauge("rate_limited_top_users", (
+            ({"user_id": user_id}, count) for user_id, count in self.throttled_users.top(n, now)
+        ))
+        metrics.replace_gauge("rate_limited_top_rooms", (
+            ({"room_id": room_id}, count) for room_id, count in self.throttled_rooms.top(n, now)
+        ))
+
+    def _sweep(self, now: float):
+        # Only buckets idle for the whole ttl go, and with rate * ttl >= burst those are full anyway
+        self._next_sweep = now + self.bucket_ttl
+        idle = [user_id for user_id, user_buckets in self.buckets.items()
+                if all(now - bucket.updated >= self.bucket_ttl for bucket in user_buckets.values())]
+        for user_id in idle:
+            del self.buckets[user_id]
+        metrics.set_gauge("rate_limit_buckets", len(self.buckets))
@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from _log_config.log_config import get_logger
+from app.settings.config import settings
+from app.settings.database import async_session_maker, engine_async, replica_engines
+from app.settings.metrics import metrics
+
+logger = get_logger('replicas', 'replicas.log')
+
+T = TypeVar("T")
+
+# WAL position of the primary, in bytes; every commit made before it runs is at or below it
+PRIMARY_LSN_QUERY = text("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn")
+
+# Whether the server is a standby, the WAL position it has replayed (in bytes) and the
+# seconds since the last transaction it replayed was committed on the primary
+REPLICA_STATE_QUERY = text("""
+    SELECT pg_is_in_recovery(),
+           pg_last_wal_replay_lsn() - '0/0'::pg_lsn,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+""")
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+        self.lag: Optional[float] = None
+        # WAL position replayed when last checked; it only grows, so reads may rely on it until the next check
+        self.replayed_lsn = 0
+        self.checked_at = 0.0
+
+    def usable(self, now: float) -> bool:
+        return (self.lag is not None
+                and self.lag <= settings.replica_max_lag
+                and now - self.checked_at <= 3 * settings.replica_lag_check_interval)
+
+
+class ReplicaRouter:
+    """
+    Sends read-only queries to streaming replicas and everything else to the primary.
+
+    A background task reads the primary's WAL position and every replica's replayed
+    position each replica_lag_check_interval seconds. A replica that has replayed up to
+    the primary's position has no lag; one behind it lags by the age of the last
+    transaction it replayed. After a write, note_write records the primary's WAL position
+    for the writing users, and their reads only go to a replica whose replayed position
+    is at or past it, so users always see their own writes. Other reads go to any replica
+    lagging less than replica_max_lag, and everything falls back to the primary when no
+    replica qualifies or a replica read fails.
+    """
+
+    def __init__(self, engines: Dict[str, AsyncEngine]):
+        self.replicas: List[Replica] = [Replica(name, engine) for name, engine in engines.items()]
+        # Primary WAL position after each user's latest write
+        self.last_write: Dict[UUID, int] = {}
+        # Entries at or below this were pruned from last_write; no replica behind it is read from
+        self.floor_lsn = 0
+        # Users whose write position could not be read: primary only until this wall-clock time
+        self.primary_until: Dict[UUID, float] = {}
+        self.primary_lsn: Optional[int] = None
+        self._rotation = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_started(self):
+        if self._task is None and self.replicas:
+            self._task = asyncio.create_task(self._run())
+
+    async def note_write(self, *user_ids: UUID):
+        """
+        Call after a commit on the primary: reads of these users wait for a replica that has replayed it.
+        """
+        if not self.replicas:
+            return
+        try:
+            async with engine_async.connect() as connection:
+                lsn = int(await connection.scalar(PRIMARY_LSN_QUERY))
+        except Exception as e:
+            logger.warning(f"Could not read the primary WAL position, reading from the primary for now: {e}")
+            until = time.time() + settings.replica_max_lag + 3 * settings.replica_lag_check_interval
+            for user_id in user_ids:
+                self.primary_until[user_id] = until
+            return
+        for user_id in user_ids:
+            self.last_write[user_id] = max(lsn, self.last_write.get(user_id, 0))
+
+    def pick(self, user_id: Optional[UUID] = None) -> Optional[Replica]:
+        now = time.time()
+        if user_id is not None and self.primary_until.get(user_id, 0.0) > now:
+            return None
+        required = max(self.floor_lsn, self.last_write.get(user_id, 0) if user_id is not None else 0)
+        candidates = [
+            replica for replica in self.replicas
+            if replica.usable(now) and replica.replayed_lsn >= required
+        ]
+        if not candidates:
+            return None
+        return candidates[next(self._rotation) % len(candidates)]
+
+    async def read(self, query: Callable[..., Awaitable[T]], *args, user_id: Optional[UUID] = None) -> T:
+        """
+        Runs query(*args, session) on a replica if one is fresh enough for user_id, else on the primary.
+        """
+        replica = self.pick(user_id)
+        if replica is not None:
+            try:
+                async with replica.session_maker() as session:
+                    result = await query(*args, session)
+                metrics.inc("db_reads", target="replica")
+                return result
+            except (DBAPIError, OSError) as e:
+                logger.warning(f"Read on replica {replica.name} failed, using the primary: {e}")
+                replica.lag = None
+
+        async with async_session_maker() as session:
+            result = await query(*args, session)
+        metrics.inc("db_reads", target="primary")
+        return result
+
+    async def check(self, replica: Replica):
+        started = time.time()
+        try:
+            async with replica.engine.connect() as connection:
+                in_recovery, replayed_lsn, replay_age = (await connection.execute(REPLICA_STATE_QUERY)).one()
+        except Exception as e:
+            if replica.lag is not None:
+                logger.warning(f"Replica {replica.name} is unreachable: {e}")
+            in_recovery, replayed_lsn, replay_age = False, None, None
+
+        if not in_recovery or replayed_lsn is None:
+            # Unreachable, or not a standby at all
+            lag = None
+        else:
+            replica.replayed_lsn = max(replica.replayed_lsn, int(replayed_lsn))
+            if self.primary_lsn is not None and replica.replayed_lsn >= self.primary_lsn:
+                lag = 0.0
+            else:
+                # Behind, or the primary position is unknown: only the age of its last replayed commit tells
+                lag = float(replay_age) if replay_age is not None else None
+
+        replica.lag = lag
+        replica.checked_at = started
+        metrics.set_gauge("replica_lag_seconds", replica.lag if replica.lag is not None else -1, replica=replica.name)
+
+    async def check_primary(self):
+        try:
+            async with engine_async.connect() as connection:
+                self.primary_lsn = int(await connection.scalar(PRIMARY_LSN_QUERY))
+        except Exception as e:
+            logger.warning(f"Could not read the primary WAL position: {e}")
+            self.primary_lsn = None
+
+    def prune(self):
+        # Writes every usable replica has replayed need no tracking; the floor keeps lagging replicas out instead
+        now = time.time()
+        usable = [replica.replayed_lsn for replica in self.replicas if replica.usable(now)]
+        if usable:
+            horizon = min(usable)
+            if any(lsn <= horizon for lsn in self.last_write.values()):
+                self.floor_lsn = max(self.floor_lsn, horizon)
+                self.last_write = {user_id: lsn for user_id, lsn in self.last_write.items() if lsn > horizon}
+        self.primary_until = {user_id: until for user_id, until in self.primary_until.items() if until > now}
+
+    async def _run(self):
+        while True:
+            try:
+                # Read first, so a replica at or past this position has replayed everything committed before its check
+                await self.check_primary()
+                await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+                self.prune()
+            except Exception as e:
+                logger.error(f"Replica lag check failed: {e}", exc_info=True)
+
+            await asyncio.sleep(settings.replica_lag_check_interval)
+
+
+replica_router = ReplicaRouter(replica_engines)
+
@@ -0,0 +1,223 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+import pytz
+from sqlalchemy import delete, func, update
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.functions.func_socket import get_hell, get_sayory
+from app.models import models
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+
+logger = get_logger('room_scheduler', 'room_scheduler.log')
+
+# Rooms are purged this long after delete_at is set
+ROOM_DELETION_GRACE = timedelta(days=30)
+
+
+def utc_today() -> date:
+    return datetime.now(pytz.utc).date()
+
+
+class RoomDeletionScheduler:
+    """
+    Tracks rooms scheduled for deletion (rooms.delete_at set) in memory.
+
+    Instead of checking on every join, a background task reloads the scheduled rooms,
+    broadcasts the deletion warning at most once per room per day to whoever is in the
+    room, and purges rooms whose grace period is over in chunks. A user joining a
+    scheduled room gets the warning privately, once per day.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.deletion_times: Dict[UUID, datetime] = {}
+        self.room_names: Dict[UUID, str] = {}
+        self.announced: Dict[UUID, date] = {}
+        self.greeted: Dict[Tuple[UUID, UUID], date] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def track(self, room: models.Rooms):
+        """
+        Records the deletion time of a room we just loaded anyway, e.g. on join.
+        """
+        if room.delete_at:
+            self.deletion_times[room.id] = room.delete_at + ROOM_DELETION_GRACE
+            self.room_names[room.id] = room.name_room
+        else:
+            self.deletion_times.pop(room.id, None)
+
+    def days_left(self, room_id: UUID) -> Optional[int]:
+        deletion_time = self.deletion_times.get(room_id)
+        if deletion_time is None:
+            return None
+        return (deletion_time - datetime.now(pytz.utc)).days
+
+    async def on_join(self, user_id: UUID, room: models.Rooms):
+        """
+        Sends the deletion warning to the joining user only, once per day.
+        """
+        self.track(room)
+        days = self.days_left(room.id)
+        today = utc_today()
+        if days is None or days <= 0 or self.greeted.get((user_id, room.id)) == today:
+            return
+
+        self.greeted[(user_id, room.id)] = today
+        sayory = await self._sayory()
+        if not sayory:
+            return
+        await self.manager.send_message_to_user(
+            message=self.notice(days),
+            fileUrl=None,
+            voiceUrl=None,
+            videoUrl=None,
+            room=room.name_room,
+            receiver_id=sayory.id,
+            user_id=user_id,
+            user_name=sayory.user_name,
+            avatar=sayory.avatar,
+            verified=sayory.verified,
+            id_return=None,
+            room_id=room.id,
+            add_to_db=False
+        )
+
+    @staticmethod
+    def notice(days: int) -> str:
+        return f"😑 This room will be DELETED in {days} days. 😑"
+
+    @staticmethod
+    async def _sayory():
+        async with async_session_maker() as session:
+            return await get_sayory(session)
+
+    async def load(self):
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(models.Rooms.id, models.Rooms.name_room, models.Rooms.delete_at).where(
+                    models.Rooms.delete_at.isnot(None)
+                )
+            )
+            rows = result.all()
+
+        self.deletion_times = {room_id: delete_at + ROOM_DELETION_GRACE for room_id, _, delete_at in rows}
+        self.room_names = {room_id: name_room for room_id, name_room, _ in rows}
+
+    async def announce(self):
+        """
+        Broadcasts the daily deletion warning to every scheduled room that has users in it.
+        """
+        today = utc_today()
+        occupied = {user_room_id for _, _, _, user_room_id, _ in self.manager.user_connections.values()}
+        sayory = None
+
+        for room_id in list(self.deletion_times):
+            days = self.days_left(room_id)
+            if days is None or days <= 0 or self.announced.get(room_id) == today or room_id not in occupied:
+                continue
+
+            sayory = sayory or await self._sayory()
+            if not sayory:
+                return
+            self.announced[room_id] = today
+            await self.manager.broadcast_all(
+                message=self.notice(days),
+                fileUrl=None,
+                voiceUrl=None,
+                videoUrl=None,
+                room=self.room_names.get(room_id, ""),
+                receiver_id=sayory.id,
+                user_name=sayory.user_name,
+                avatar=sayory.avatar,
+                verified=sayory.verified,
+                id_return=None,
+                room_id=room_id,
+                add_to_db=False
+            )
+
+    async def purge(self):
+        """
+        Deletes rooms whose grace period is over. Messages, live and archived, are removed
+        with their votes in chunks of room_purge_chunk_size with a commit per chunk, so a big room never holds one
+        long transaction; users still pointing at the room are moved to Hell first.
+        """
+        cutoff = datetime.now(pytz.utc) - ROOM_DELETION_GRACE
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(models.Rooms.id, models.Rooms.name_room).where(
+                    models.Rooms.delete_at <= cutoff,
+                    models.Rooms.name_room != settings.hell
+                )
+            )
+            expired_rooms = result.all()
+            if not expired_rooms:
+                return
+            hell = await get_hell(session)
+
+            for room_id, name_room in expired_rooms:
+                purged_messages = 0
+                # Archived partitions hold the room's older messages; they go in the same chunks
+                for message_model in (models.ChatMessages, models.ArchivedChatMessages):
+                    while True:
+                        chunk = select(message_model.id).where(
+                            message_model.room_id == room_id
+                        ).limit(settings.room_purge_chunk_size)
+                        # Votes no longer cascade from the partitioned chat_messages
+                        deleted = delete(message_model).where(
+                            message_model.id.in_(chunk)
+                        ).returning(message_model.id).cte("deleted")
+                        deleted_votes = delete(models.ChatMessageVote).where(
+                            models.ChatMessageVote.message_id.in_(select(deleted.c.id))
+                        ).returning(models.ChatMessageVote.message_id).cte("deleted_votes")
+                        deleted_count = await session.scalar(
+                            select(func.count()).select_from(deleted).add_cte(deleted_votes)
+                        )
+                        await session.commit()
+                        purged_messages += deleted_count
+                        if deleted_count < settings.room_purge_chunk_size:
+                            break
+
+                if hell is not None:
+                    await session.execute(
+                        update(models.UserStatus).where(models.UserStatus.room_id == room_id).values(
+                            room_id=hell.id, name_room=hell.name_room
+                        )
+                    )
+                await session.execute(delete(models.Rooms).where(models.Rooms.id == room_id))
+                await session.commit()
+
+                self.deletion_times.pop(room_id, None)
+                self.room_names.pop(room_id, None)
+                self.announced.pop(room_id, None)
+                metrics.inc("purged_rooms")
+                metrics.inc("purged_messages", purged_messages)
+                logger.info(f"Purged room {name_room} ({room_id}) with {purged_messages} messages")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_purge = loop.time()
+        while True:
+            try:
+                await self.load()
+                await self.announce()
+
+                if loop.time() >= next_purge:
+                    next_purge = loop.time() + settings.room_purge_interval
+                    await self.purge()
+
+                today = utc_today()
+                self.greeted = {key: day for key, day in self.greeted.items() if day == today}
+            except Exception as e:
+                logger.error(f"Room deletion scheduler failed: {e}", exc_info=True)
+
+            await asyncio.sleep(settings.room_notice_interval)
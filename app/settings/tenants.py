@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.settings.config import settings
+from app.settings.metrics import metrics
+from app.settings.rate_limit import TokenBucket
+from app.settings.tracing import tracer
+
+# Frames that write to the database and fan out, and so count against the company message rate
+TENANT_LIMITED_ACTIONS = ("send", "vote", "update", "delete")
+
+
+def tenant_key(company_id: Optional[UUID]) -> str:
+    # Users without a company share one tenant
+    return str(company_id) if company_id is not None else "none"
+
+
+def quota(tenant: str, name: str, default: float) -> float:
+    """
+    A per-company value from settings.tenant_quotas, or the default for every company.
+    """
+    return settings.tenant_quotas.get(tenant, {}).get(name, default)
+
+
+class TenantQuotas:
+    """
+    Per-company caps on open connections and on message-writing frames, and usage counters.
+
+    Connections are checked and counted in the same step of the join handshake, and a
+    join that fails after that gives its place back, so the cap is never overshot.
+    The message rate is a token bucket per company shared by all its users, on top of the
+    per-user limits of RateLimiter.
+    """
+
+    def __init__(self):
+        self.connections: Dict[str, int] = {}
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def can_connect(self, company_id: Optional[UUID]) -> bool:
+        tenant = tenant_key(company_id)
+        cap = quota(tenant, "max_connections", settings.tenant_max_connections)
+        if cap and self.connections.get(tenant, 0) >= cap:
+            metrics.inc("tenant_rejections", company=tenant, reason="connections")
+            return False
+        return True
+
+    def opened(self, company_id: Optional[UUID]):
+        tenant = tenant_key(company_id)
+        self.connections[tenant] = self.connections.get(tenant, 0) + 1
+        metrics.set_gauge("tenant_connections", self.connections[tenant], company=tenant)
+
+    def closed(self, company_id: Optional[UUID]):
+        tenant = tenant_key(company_id)
+        self.connections[tenant] = max(self.connections.get(tenant, 0) - 1, 0)
+        metrics.set_gauge("tenant_connections", self.connections[tenant], company=tenant)
+
+    def check_frame(self, company_id: Optional[UUID], action: str) -> Tuple[bool, float]:
+        """
+        Takes a token from the company's bucket. Returns (allowed, seconds until a token is available).
+        """
+        if action not in TENANT_LIMITED_ACTIONS:
+            return True, 0.0
+
+        tenant = tenant_key(company_id)
+        metrics.inc("tenant_frames", company=tenant, action=action)
+        rate = quota(tenant, "message_rate", settings.tenant_message_rate)
+        if not rate:
+            return True, 0.0
+
+        bucket = self.buckets.get(tenant)
+        if bucket is None:
+            burst = quota(tenant, "message_burst", settings.tenant_message_burst) or rate
+            bucket = self.buckets[tenant] = TokenBucket(rate, burst)
+        if bucket.try_acquire():
+            return True, 0.0
+
+        metrics.inc("tenant_rejections", company=tenant, reason="message_rate")
+        return False, bucket.wait_time()
+
+    async def admit(self, connection, company_id: Optional[UUID], action: str) -> bool:
+        """
+        Returns True when the frame fits the company's message rate; otherwise tells the client when to retry.
+        """
+        allowed, retry_after = self.check_frame(company_id, action)
+        if not allowed:
+            await connection.send_frame({"notice": "Company message limit exceeded",
+                                         "action": action,
+                                         "retry_after": int(retry_after * 1000)})
+        return allowed
+
+
+class FairScheduler:
+    """
+    Weighted-fair ordering of message persistence across companies.
+
+    At most tenant_work_slots jobs hold a turn at once. When all slots are busy, waiting
+    jobs are granted in start-time fair queueing order: each gets a virtual finish time of
+    max(virtual clock, its company's last finish) + cost / weight, and the smallest goes
+    first. A company flooding the queue only pushes its own finish times out, so others
+    keep getting turns in proportion to their weights (settings.tenant_quotas "weight",
+    default 1). Cost is the fan-out that follows the write, so big rooms pay for their size,
+    but the turn covers the database write only: fan-out runs after it is released, so slow
+    receivers cannot hold the slots.
+    """
+
+    def __init__(self, slots: Optional[int] = None):
+        self.slots = slots or settings.tenant_work_slots
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self.last_finish: Dict[str, float] = {}
+        self.waiting: List[Tuple[float, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _tag(self, tenant: str, cost: float) -> Tuple[float, float]:
+        start = max(self.virtual_time, self.last_finish.get(tenant, 0.0))
+        finish = start + cost / quota(tenant, "weight", 1.0)
+        self.last_finish[tenant] = finish
+        return start, finish
+
+    async def _acquire(self, tenant: str, cost: float):
+        start, finish = self._tag(tenant, cost)
+        if self.in_use < self.slots and not self.waiting:
+            self.in_use += 1
+            self.virtual_time = start
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (finish, next(self._sequence), start, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just before the cancellation arrived: pass the slot on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self.in_use -= 1
+        while self.waiting and self.in_use < self.slots:
+            _, _, start, future = heapq.heappop(self.waiting)
+            if future.done():
+                continue
+            self.in_use += 1
+            self.virtual_time = start
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def turn(self, company_id: Optional[UUID], cost: float = 1.0):
+        """
+        Holds one of the work slots for the body, waiting for the company's fair turn if all are busy.
+        """
+        tenant = tenant_key(company_id)
+        queued = time.monotonic()
+        with tracer.span("tenant_wait", cost=cost):
+            await self._acquire(tenant, max(cost, 1.0))
+        metrics.observe("tenant_turn_wait_seconds", time.monotonic() - queued, company=tenant)
+        metrics.inc("tenant_work_cost", max(cost, 1.0), company=tenant)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+tenant_quotas = TenantQuotas()
+tenant_scheduler = FairScheduler()
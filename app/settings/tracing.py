@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from _log_config.log_config import get_logger
+from app.settings.config import settings
+from app.settings.metrics import metrics
+
+logger = get_logger('tracing', 'tracing.log')
+slow_logger = get_logger('slow_requests', 'slow_requests.log')
+
+# Finished spans waiting for the exporter; the oldest are dropped when the collector falls behind
+EXPORT_QUEUE_SIZE = 10000
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """
+    One join or one client frame: a root span and the spans of its stages.
+    """
+
+    def __init__(self, name: str, sampled: bool, attributes: Dict[str, Any]):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = [self.root]
+        self.current: Span = self.root
+        self.finished = False
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    """
+    Times the stages of the connect and message paths.
+
+    begin() starts a trace in the current task and span() times a stage of it; both cost
+    next to nothing when no trace is being recorded. A trace is recorded when it is
+    sampled (trace_sample_rate) or when the slow log is on, so slow requests are always
+    caught. When a trace finishes, one taking longer than trace_slow_threshold_ms is written
+    with its full stage breakdown to _log/slow_requests.log; sampled traces feed the
+    trace_stage_seconds summary and, with trace_exporter_url set, are sent to an
+    OpenTelemetry collector as OTLP/HTTP JSON every trace_export_interval seconds.
+    """
+
+    def __init__(self):
+        self.queue: Deque[Dict[str, Any]] = deque(maxlen=EXPORT_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+
+    def begin(self, name: str, **attributes) -> Optional[Trace]:
+        """
+        Starts a trace in the current task, finishing the one still open there.
+        """
+        self.finish()
+        sampled = random.random() < settings.trace_sample_rate
+        if not sampled and settings.trace_slow_threshold_ms <= 0:
+            return None
+
+        trace = Trace(name, sampled, attributes)
+        current_trace.set(trace)
+        if sampled and settings.trace_exporter_url and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return trace
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        trace = current_trace.get()
+        if trace is None or trace.finished:
+            yield None
+            return
+
+        parent = trace.current
+        span = Span(name, parent.span_id, attributes)
+        trace.spans.append(span)
+        trace.current = span
+        try:
+            yield span
+        finally:
+            span.end_ns = time.time_ns()
+            trace.current = parent
+
+    def annotate(self, **attributes):
+        """
+        Adds attributes to the root span of the current trace, e.g. the user once authenticated.
+        """
+        trace = current_trace.get()
+        if trace is not None and not trace.finished:
+            trace.root.attributes.update(attributes)
+
+    def finish(self):
+        trace = current_trace.get()
+        if trace is None:
+            return
+        current_trace.set(None)
+        if trace.finished:
+            return
+
+        trace.finished = True
+        trace.root.end_ns = time.time_ns()
+        total_ms = trace.root.duration_ms
+
+        if 0 < settings.trace_slow_threshold_ms <= total_ms:
+            metrics.inc("slow_requests", trace=trace.root.name)
+            slow_logger.warning(json.dumps(self._breakdown(trace), default=str))
+
+        if trace.sampled:
+            for span in trace.spans[1:]:
+                metrics.observe("trace_stage_seconds", span.duration_ms / 1000,
+                                trace=trace.root.name, stage=span.name)
+            metrics.observe("trace_seconds", total_ms / 1000, trace=trace.root.name)
+            if settings.trace_exporter_url:
+                self.queue.extend(self._otlp_spans(trace))
+
+    @staticmethod
+    def _breakdown(trace: Trace) -> Dict[str, Any]:
+        names = {span.span_id: span.name for span in trace.spans}
+        return {
+            "trace": trace.root.name,
+            "trace_id": trace.trace_id,
+            "total_ms": round(trace.root.duration_ms, 2),
+            "attributes": trace.root.attributes,
+            "stages": [
+                {"stage": span.name,
+                 "parent": names[span.parent_id],
+                 "offset_ms": round((span.start_ns - trace.root.start_ns) / 1e6, 2),
+                 "ms": round(span.duration_ms, 2),
+                 **span.attributes}
+                for span in trace.spans[1:]
+            ],
+        }
+
+    @staticmethod
+    def _otlp_spans(trace: Trace) -> List[Dict[str, Any]]:
+        return [
+            {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 2 if span is trace.root else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": [
+                    {"key": key, "value": {"stringValue": str(value)}}
+                    for key, value in span.attributes.items()
+                ],
+            }
+            for span in trace.spans
+        ]
+
+    async def export(self, client):
+        spans = [self.queue.popleft() for _ in range(len(self.queue))]
+        if not spans:
+            return
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "chat"}}]},
+            "scopeSpans": [{"scope": {"name": "app.settings.tracing"}, "spans": spans}],
+        }]}
+        response = await client.post(settings.trace_exporter_url, json=payload)
+        response.raise_for_status()
+        metrics.inc("trace_spans_exported", len(spans))
+
+    async def _run(self):
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            while True:
+                await asyncio.sleep(settings.trace_export_interval)
+                try:
+                    await self.export(client)
+                except Exception as e:
+                    metrics.inc("trace_export_failures")
+                    logger.warning(f"Span export to {settings.trace_exporter_url} failed: {e}")
+
+
+tracer = Tracer()
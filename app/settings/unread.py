@@ -0,0 +1,210 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Tuple
+from uuid import UUID
+
+import pytz
+from sqlalchemy import BigInteger, column, func, values
+from sqlalchemy.dialects.postgresql import TIMESTAMP, UUID as PG_UUID, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from _log_config.log_config import get_logger
+from app.models import models
+from app.schemas import schemas
+from app.settings.config import settings
+from app.settings.database import async_session_maker
+from app.settings.metrics import metrics
+from app.settings.replicas import replica_router
+
+logger = get_logger('unread', 'unread.log')
+
+
+class PendingRead(NamedTuple):
+    # Messages of the room that were still pending on this node when the user read it
+    seen: int
+    at: datetime
+
+
+class UnreadCounters:
+    """
+    Server-side read state: a message counter per room and a last-read marker per (user, room).
+
+    A user's unread count in a room is the room's counter minus the counter value their
+    marker recorded, so a new message bumps one row per room rather than one per reader,
+    and unread counts for all of a user's rooms come from a single primary-key lookup.
+    Both are coalesced in memory and written every unread_flush_interval seconds;
+    unread() adds what is still pending on this node, so its own users see exact counts.
+    """
+
+    def __init__(self):
+        self.pending_messages: Dict[UUID, int] = {}
+        self.pending_reads: Dict[Tuple[UUID, UUID], PendingRead] = {}
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    async def ensure_started(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def message_added(self, room_id: UUID, count: int = 1):
+        self.pending_messages[room_id] = self.pending_messages.get(room_id, 0) + count
+
+    def mark_read(self, user_id: UUID, room_id: UUID):
+        """
+        Marks everything posted to the room so far as read by the user.
+        """
+        self.pending_reads[(user_id, room_id)] = PendingRead(
+            self.pending_messages.get(room_id, 0), datetime.now(pytz.utc)
+        )
+
+    async def flush(self):
+        """
+        Writes pending read markers, then pending message counts, in one transaction.
+        Markers go first so the counts they add on top of are the ones they saw.
+        """
+        async with self._flush_lock:
+            read_batch, self.pending_reads = self.pending_reads, {}
+            message_batch, self.pending_messages = self.pending_messages, {}
+            if not read_batch and not message_batch:
+                return
+
+            try:
+                async with async_session_maker() as session:
+                    if read_batch:
+                        await session.execute(self._read_upsert(read_batch))
+                    if message_batch:
+                        await session.execute(self._count_upsert(message_batch))
+                    await session.commit()
+            except Exception:
+                self._requeue(read_batch, message_batch)
+                metrics.inc("unread_flush_failures")
+                raise
+
+        if read_batch:
+            await replica_router.note_write(*{user_id for user_id, _ in read_batch})
+        metrics.inc("unread_markers_flushed", len(read_batch))
+        metrics.inc("unread_room_counters_flushed", len(message_batch))
+
+    def _requeue(self, read_batch: Dict[Tuple[UUID, UUID], PendingRead], message_batch: Dict[UUID, int]):
+        # The failed batch's messages are older than anything pending now, so newer
+        # markers of the same rooms have seen them too
+        for (user_id, room_id), read in self.pending_reads.items():
+            self.pending_reads[(user_id, room_id)] = read._replace(seen=read.seen + message_batch.get(room_id, 0))
+        for room_id, count in message_batch.items():
+            self.message_added(room_id, count)
+        for key, read in read_batch.items():
+            self.pending_reads.setdefault(key, read)
+
+    @staticmethod
+    def _read_upsert(batch: Dict[Tuple[UUID, UUID], PendingRead]):
+        pending = values(
+            column("user_id", PG_UUID(as_uuid=True)),
+            column("room_id", PG_UUID(as_uuid=True)),
+            column("seen", BigInteger),
+            column("read_at", TIMESTAMP(timezone=True)),
+            name="pending_reads"
+        ).data([(user_id, room_id, read.seen, read.at) for (user_id, room_id), read in sorted(batch.items())])
+
+        counts = models.RoomMessageCount
+        read_state = models.RoomReadState
+        # Joined with rooms so a room deleted since the read does not fail the whole flush
+        stmt = insert(read_state).from_select(
+            ["user_id", "room_id", "read_count", "last_read_at"],
+            select(
+                pending.c.user_id,
+                pending.c.room_id,
+                func.coalesce(counts.message_count, 0) + pending.c.seen,
+                pending.c.read_at
+            ).join(
+                models.Rooms, models.Rooms.id == pending.c.room_id
+            ).outerjoin(
+                counts, counts.room_id == pending.c.room_id
+            )
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[read_state.user_id, read_state.room_id],
+            set_={
+                "read_count": func.greatest(read_state.read_count, stmt.excluded.read_count),
+                "last_read_at": stmt.excluded.last_read_at,
+            }
+        )
+
+    @staticmethod
+    def _count_upsert(batch: Dict[UUID, int]):
+        pending = values(
+            column("room_id", PG_UUID(as_uuid=True)),
+            column("added", BigInteger),
+            name="pending_messages"
+        ).data(sorted(batch.items()))
+
+        counts = models.RoomMessageCount
+        stmt = insert(counts).from_select(
+            ["room_id", "message_count"],
+            select(pending.c.room_id, pending.c.added).join(models.Rooms, models.Rooms.id == pending.c.room_id)
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[counts.room_id],
+            set_={"message_count": counts.message_count + stmt.excluded.message_count}
+        )
+
+    async def unread(self, user_id: UUID) -> List[schemas.UnreadCount]:
+        """
+        Unread counts of every room the user has read before, as stored plus what is pending on this node.
+        """
+        rows = await replica_router.read(fetch_unread_counts, user_id, user_id=user_id)
+
+        unread = {}
+        for room_id, last_read_at, stored in rows:
+            unread[room_id] = (stored + self.pending_messages.get(room_id, 0), last_read_at)
+        for (reader_id, room_id), read in self.pending_reads.items():
+            if reader_id == user_id:
+                unread[room_id] = (self.pending_messages.get(room_id, 0) - read.seen, read.at)
+
+        return [
+            schemas.UnreadCount(room_id=room_id, unread=max(count, 0), last_read_at=last_read_at)
+            for room_id, (count, last_read_at) in unread.items()
+        ]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.unread_flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Unread counters flush failed: {e}", exc_info=True)
+
+    async def close(self, attempts: int = 3):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        for attempt in range(1, attempts + 1):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Final unread counters flush failed (attempt {attempt}/{attempts}): {e}")
+                await asyncio.sleep(attempt)
+        logger.error(f"Lost {len(self.pending_reads)} read markers "
+                     f"and message counts of {len(self.pending_messages)} rooms on shutdown")
+
+
+async def fetch_unread_counts(user_id: UUID, session: AsyncSession):
+    counts = models.RoomMessageCount
+    read_state = models.RoomReadState
+    result = await session.execute(
+        select(
+            read_state.room_id,
+            read_state.last_read_at,
+            func.coalesce(counts.message_count, 0) - read_state.read_count
+        ).outerjoin(
+            counts, counts.room_id == read_state.room_id
+        ).where(
+            read_state.user_id == user_id
+        )
+    )
+    return result.all()
+
+
+unread_counters = UnreadCounters()
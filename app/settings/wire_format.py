@@ -0,0 +1,89 @@
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Union
+from uuid import UUID
+
+import msgpack
+from fastapi import WebSocket
+from pydantic import BaseModel
+
+
+# Wire protocols a client can negotiate through the Sec-WebSocket-Protocol header.
+# JSON text frames stay the default when the client does not ask for anything.
+JSON_PROTOCOL = "json"
+MSGPACK_PROTOCOL = "chat.msgpack.v1"
+
+# MessagePack extension type used for UUIDs (16 raw bytes instead of a 36 char string).
+# Timestamps use the standard MessagePack timestamp extension (-1).
+UUID_EXT_TYPE = 1
+
+
+def negotiate_protocol(websocket: WebSocket) -> str:
+    """
+    Picks the wire protocol for a connection from the subprotocols offered by the client.
+    """
+    requested = websocket.scope.get("subprotocols") or []
+    if MSGPACK_PROTOCOL in requested:
+        return MSGPACK_PROTOCOL
+    return JSON_PROTOCOL
+
+
+def _json_default(obj: Any):
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _msgpack_default(obj: Any):
+    if isinstance(obj, UUID):
+        return msgpack.ExtType(UUID_EXT_TYPE, obj.bytes)
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == UUID_EXT_TYPE:
+        return UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+def encode_json(frame: Union[BaseModel, Dict[str, Any]]) -> str:
+    if isinstance(frame, BaseModel):
+        return frame.model_dump_json()
+    return json.dumps(frame, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+
+
+def encode_msgpack(frame: Union[BaseModel, Dict[str, Any]]) -> bytes:
+    if isinstance(frame, BaseModel):
+        frame = frame.model_dump()
+    return msgpack.packb(frame, default=_msgpack_default)
+
+
+def decode_msgpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, timestamp=3)
+
+
+class Frame:
+    """
+    An outgoing frame that is encoded at most once per wire protocol, so a broadcast
+    to a room with mixed JSON and MessagePack clients does not re-serialize per socket.
+    """
+
+    def __init__(self, payload: Union[BaseModel, Dict[str, Any]]):
+        self.payload = payload
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encode(self, protocol: str) -> Union[str, bytes]:
+        encoded = self._encoded.get(protocol)
+        if encoded is None:
+            if protocol == MSGPACK_PROTOCOL:
+                encoded = encode_msgpack(self.payload)
+            else:
+                encoded = encode_json(self.payload)
+            self._encoded[protocol] = encoded
+        return encoded
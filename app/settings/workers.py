@@ -0,0 +1,12 @@
+from uvicorn.workers import UvicornWorker
+
+from app.settings.ws_compression import ChatWebSocketProtocol
+
+
+class ChatUvicornWorker(UvicornWorker):
+    """
+    Gunicorn worker that serves WebSockets through ChatWebSocketProtocol so the
+    permessage-deflate settings from the environment are applied.
+    """
+
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "ws": ChatWebSocketProtocol}
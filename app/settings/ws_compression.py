@@ -0,0 +1,115 @@
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets import frames
+from websockets.extensions.base import Extension, ServerExtensionFactory
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.typing import ExtensionParameter
+
+from app.settings.config import settings
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends messages smaller than ``min_size`` uncompressed.
+    RFC 7692 allows that per message (RSV1 unset), and small frames such as typing
+    notices or votes cost more CPU to deflate than they save on the wire.
+    Keeps per-connection counters of bytes before/after and time spent compressing.
+    """
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.compressed_messages = 0
+        self.skipped_messages = 0
+        self.compress_ns = 0
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+
+        if frame.opcode is not frames.OP_CONT and frame.fin and len(frame.data) < self.min_size:
+            self.skipped_messages += 1
+            self.raw_bytes += len(frame.data)
+            self.sent_bytes += len(frame.data)
+            return frame
+
+        started = time.perf_counter_ns()
+        encoded = super().encode(frame)
+        self.compress_ns += time.perf_counter_ns() - started
+        self.raw_bytes += len(frame.data)
+        self.sent_bytes += len(encoded.data)
+        if frame.fin:
+            self.compressed_messages += 1
+        return encoded
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "raw_bytes": self.raw_bytes,
+            "sent_bytes": self.sent_bytes,
+            "saved_bytes": self.raw_bytes - self.sent_bytes,
+            "compressed_messages": self.compressed_messages,
+            "skipped_messages": self.skipped_messages,
+            "compress_ms": self.compress_ns / 1e6,
+        }
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    """
+    Server-side factory that negotiates permessage-deflate as usual and hands out
+    ThresholdPerMessageDeflate instances.
+    """
+
+    def __init__(self, min_size: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(
+        self,
+        params: Sequence[ExtensionParameter],
+        accepted_extensions: Sequence[Extension],
+    ):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+def build_extensions(enabled: Optional[bool] = None) -> List[ServerExtensionFactory]:
+    """
+    Builds the WebSocket extension list from settings. Compression is opt-in.
+    """
+    if enabled is None:
+        enabled = settings.ws_deflate_enabled
+    if not enabled:
+        return []
+
+    return [
+        ThresholdPerMessageDeflateFactory(
+            min_size=settings.ws_deflate_min_size,
+            server_max_window_bits=settings.ws_deflate_window_bits,
+            compress_settings={
+                "level": settings.ws_deflate_level,
+                "memLevel": settings.ws_deflate_mem_level,
+            },
+        )
+    ]
+
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn WebSocket protocol whose permessage-deflate settings come from our settings
+    instead of uvicorn's all-or-nothing ``ws_per_message_deflate`` flag.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = build_extensions()
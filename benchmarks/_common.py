@@ -0,0 +1,66 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile, good enough for latency reports.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "min": min(values) if values else None,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def write_results(name: str, results: Dict[str, Any], output: Optional[str] = None) -> str:
+    """
+    Writes a benchmark run to a JSON file so that runs can be diffed across commits.
+    """
+    commit = git_commit()
+    payload = {
+        "benchmark": name,
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{commit or 'nogit'}.json")
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(payload, file, indent=2, default=str)
+
+    print(f"Results written to {output}")
+    return output
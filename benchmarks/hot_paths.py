@@ -0,0 +1,211 @@
+"""
+Microbenchmarks for the functions every chat message passes through.
+
+Covers censor_message, async_encrypt/async_decrypt, ChatMessagesSchema construction,
+wrap_message + model_dump_json and the history hydration loop used by
+fetch_last_messages. Corpora are generated from a fixed seed so runs are comparable.
+
+Run from the project root with the usual .env in place:
+
+    python -m benchmarks.hot_paths
+    python -m benchmarks.hot_paths --compare benchmarks/results/hot_paths-<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import string
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from benchmarks._common import write_results
+
+
+COMMON_WORDS = [
+    "hello", "team", "meeting", "today", "tomorrow", "please", "check", "the", "report", "thanks",
+    "привіт", "дякую", "зустріч", "сьогодні", "завтра", "так", "ні", "можливо", "файл", "посилання",
+]
+AVATAR = "https://tygjaceleczftbswxxei.supabase.co/storage/v1/object/public/image_bucket/inne/image/boy_1.webp"
+
+
+def build_corpus(seed: int, size: int, banned_words: set) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    banned = sorted(banned_words)
+    texts = []
+    for _ in range(size):
+        words = []
+        for _ in range(rng.randint(1, 40)):
+            # No banned words configured means a clean corpus, not an IndexError from rng.choice([])
+            if banned and rng.random() < 0.03:
+                words.append(rng.choice(banned))
+            else:
+                words.append(rng.choice(COMMON_WORDS))
+            if rng.random() < 0.1:
+                words[-1] += rng.choice(string.punctuation)
+        texts.append(" ".join(words))
+
+    room_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+    authors = [
+        SimpleNamespace(user_name=f"user_{i}", avatar=AVATAR, verified=rng.random() < 0.5)
+        for i in range(20)
+    ]
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return {
+        "texts": texts,
+        "room_id": room_id,
+        "authors": authors,
+        "ids": [uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(size)],
+        "created": [started + timedelta(seconds=i * 7) for i in range(size)],
+        "votes": [rng.randint(0, 5) for _ in range(size)],
+    }
+
+
+def measure(func: Callable[[], Any], operations: int, rounds: int) -> Dict[str, float]:
+    """
+    Runs ``func`` (which performs ``operations`` calls) ``rounds`` times and reports ns per call.
+    """
+    func()  # warm up
+    per_op = []
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        func()
+        per_op.append((time.perf_counter_ns() - started) / operations)
+    return {
+        "ns_per_op_median": statistics.median(per_op),
+        "ns_per_op_min": min(per_op),
+        "ns_per_op_stdev": statistics.pstdev(per_op),
+        "ops_per_second": 1e9 / statistics.median(per_op),
+        "operations": operations,
+        "rounds": rounds,
+    }
+
+
+def run_benchmarks(seed: int, size: int, rounds: int, history: int) -> Dict[str, Dict[str, float]]:
+    from app.functions.func_socket import async_encrypt, async_decrypt, hydrate_messages
+    from app.functions.moderator import censor_message, load_banned_words
+    from app.schemas import schemas
+    from app.settings.profiles import AuthorProfile
+
+    banned_words = load_banned_words("app/functions/banned_words.csv")
+    corpus = build_corpus(seed, size, banned_words)
+    texts = corpus["texts"]
+    loop = asyncio.new_event_loop()
+
+    encrypted = [loop.run_until_complete(async_encrypt(text)) for text in texts]
+
+    def schema_kwargs(index: int) -> Dict[str, Any]:
+        author = corpus["authors"][index % len(corpus["authors"])]
+        return dict(
+            created_at=corpus["created"][index], receiver_id=corpus["ids"][-index - 1], message=texts[index],
+            fileUrl=None, voiceUrl=None, videoUrl=None, user_name=author.user_name, avatar=author.avatar,
+            verified=author.verified, id=corpus["ids"][index], vote=corpus["votes"][index], id_return=None,
+            edited=False, deleted=False, room_id=corpus["room_id"],
+        )
+
+    kwargs = [schema_kwargs(i) for i in range(size)]
+    models = [schemas.ChatMessagesSchema(**item) for item in kwargs]
+
+    rows = []
+    for i in range(history):
+        row = SimpleNamespace(message=encrypted[i % size], **{
+            key: value for key, value in kwargs[i % size].items()
+            if key not in ("message", "user_name", "avatar", "verified", "vote")
+        })
+        rows.append((row, corpus["votes"][i % size]))
+    profiles = {
+        item["receiver_id"]: AuthorProfile(item["user_name"], item["avatar"], item["verified"]) for item in kwargs
+    }
+
+    async def encrypt_all():
+        for text in texts:
+            await async_encrypt(text)
+
+    async def decrypt_all():
+        for data in encrypted:
+            await async_decrypt(data)
+
+    async def wrap_and_dump_all():
+        for model in models:
+            (await schemas.wrap_message(model)).model_dump_json()
+
+    def censor_all():
+        for text in texts:
+            censor_message(text, banned_words)
+
+    def construct_all():
+        for item in kwargs:
+            schemas.ChatMessagesSchema(**item)
+
+    def dump_all():
+        for model in models:
+            model.model_dump_json()
+
+    cases = {
+        "censor_message": (censor_all, size),
+        "async_encrypt": (lambda: loop.run_until_complete(encrypt_all()), size),
+        "async_decrypt": (lambda: loop.run_until_complete(decrypt_all()), size),
+        "chat_messages_schema": (construct_all, size),
+        "model_dump_json": (dump_all, size),
+        "wrap_message_dump_json": (lambda: loop.run_until_complete(wrap_and_dump_all()), size),
+        "hydrate_messages": (lambda: loop.run_until_complete(hydrate_messages(rows, profiles)), history),
+    }
+
+    results = {}
+    for name, (func, operations) in cases.items():
+        results[name] = measure(func, operations, rounds)
+        print(f"{name:<24} {results[name]['ns_per_op_median']:>12.0f} ns/op")
+
+    loop.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Returns the names of benchmarks that got slower than the baseline by more than ``tolerance``.
+    """
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)["results"]["benchmarks"]
+
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["ns_per_op_median"]
+        change = (current["ns_per_op_median"] - before) / before
+        print(f"{name:<24} {change:+.1%} vs baseline")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for per-message hot functions")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--size", type=int, default=2000, help="Messages in the corpus")
+    parser.add_argument("--history", type=int, default=200, help="Rows hydrated per history call")
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown before failing")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed, args.size, args.rounds, args.history)
+    write_results("hot_paths", {
+        "config": {"seed": args.seed, "size": args.size, "history": args.history, "rounds": args.rounds},
+        "benchmarks": results,
+    }, args.output)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
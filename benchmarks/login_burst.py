@@ -0,0 +1,112 @@
+"""
+Login-burst benchmark: event-loop responsiveness while many passwords are verified.
+
+A delivery probe stands in for WebSocket fan-out: every --interval seconds it schedules
+a send and records how late it actually ran. Meanwhile a burst of --logins bcrypt
+verifications runs --concurrency at a time, either inline on the event loop (how
+routers/auth.login used to call utils.verify) or through app.settings.password_pool.
+The report has login throughput and the probe's delivery delay for both modes; with
+the pool the delay should stay at the idle baseline.
+
+No database is needed. Run from the project root with the usual .env in place:
+
+    python -m benchmarks.login_burst
+    python -m benchmarks.login_burst --logins 200 --concurrency 50 --workers 8
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from benchmarks._common import summarize, write_results
+
+
+async def probe(interval: float, delays: List[float], stop: asyncio.Event):
+    """
+    Records in ms how much later than planned each tick runs, like a frame waiting to be sent.
+    """
+    while not stop.is_set():
+        planned = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        delays.append((time.perf_counter() - planned) * 1000)
+
+
+async def burst(verify: Callable[[], Awaitable[bool]], logins: int, concurrency: int) -> float:
+    """
+    Runs the logins with at most concurrency in progress; returns the elapsed seconds.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with limit:
+            if not await verify():
+                raise RuntimeError("password did not verify")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    return time.perf_counter() - started
+
+
+async def run_mode(verify: Callable[[], Awaitable[bool]], args) -> Dict[str, Any]:
+    delays: List[float] = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(args.interval, delays, stop))
+    elapsed = await burst(verify, args.logins, args.concurrency)
+    stop.set()
+    await probe_task
+    return {
+        "elapsed_seconds": elapsed,
+        "logins_per_second": args.logins / elapsed,
+        "delivery_delay_ms": summarize(delays),
+    }
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    from app.settings import utils
+    from app.settings.password_pool import PasswordPool
+
+    password = "correct horse battery staple"
+    hashed = utils.hash_password(password)
+    pool = PasswordPool(workers=args.workers, queue_size=args.logins)
+
+    async def inline():
+        return utils.verify(password, hashed)
+
+    async def pooled():
+        return await pool.verify(password, hashed)
+
+    # Idle baseline: the probe alone
+    idle: List[float] = []
+    stop = asyncio.Event()
+    idle_task = asyncio.create_task(probe(args.interval, idle, stop))
+    await asyncio.sleep(1.0)
+    stop.set()
+    await idle_task
+
+    return {
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "idle_delivery_delay_ms": summarize(idle),
+        "inline": await run_mode(inline, args),
+        "pool": await run_mode(pooled, args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure event-loop delivery delay during a login burst")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="Logins in progress at once")
+    parser.add_argument("--workers", type=int, default=4, help="Threads of the password pool")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between delivery probes")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    print(json.dumps(results, indent=2))
+    write_results("login_burst", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Query-plan regression check for the hot queries of the chat socket.
+
+Every query is EXPLAINed against a local Postgres with sequential scans disabled for
+the planner, so it picks an index whenever one can serve the query regardless of how
+little data the local tables hold. A hot table that is still read with a Seq Scan has
+lost (or never got) its index, and the check exits with status 1.
+
+Run from the project root with the usual .env in place, after `alembic upgrade head`:
+
+    python -m benchmarks.query_plans
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from uuid import UUID, uuid4
+
+import pytz
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.future import select
+
+
+# Tables that must never be read with a sequential scan by a hot query
+HOT_TABLES = {"chat_messages", "chat_message_votes", "user_status", "bans", "user_online_time"}
+
+
+def hot_queries(room_id: UUID, user_id: UUID, message_id: UUID) -> Dict[str, Callable[[], Any]]:
+    from app.functions.export import export_query
+    from app.functions.func_socket import archived_messages_query, last_messages_query
+    from app.models import models
+
+    return {
+        "history": lambda: last_messages_query(room_id, 20),
+        "archived_history": lambda: archived_messages_query(room_id, 20),
+        "export_resume": lambda: export_query(models.ChatMessages, room_id, (datetime.now(pytz.utc), message_id)),
+        "message_votes": lambda: select(func.sum(models.ChatMessageVote.dir)).where(
+            models.ChatMessageVote.message_id == message_id
+        ),
+        "user_vote": lambda: select(models.ChatMessageVote).where(
+            models.ChatMessageVote.message_id == message_id,
+            models.ChatMessageVote.user_id == user_id
+        ),
+        "user_status": lambda: select(models.UserStatus).where(models.UserStatus.user_id == user_id),
+        "ban": lambda: select(models.Ban).where(
+            models.Ban.user_id == user_id,
+            models.Ban.room_id == room_id
+        ),
+        "online_time": lambda: select(models.UserOnlineTime).where(models.UserOnlineTime.user_id == user_id),
+        "purge_chunk": lambda: select(models.ChatMessages.id).where(
+            models.ChatMessages.room_id == room_id
+        ).limit(1000),
+    }
+
+
+def plan_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def hot_table(relation: str) -> bool:
+    # Monthly partitions (chat_messages_2026_10, chat_messages_legacy) count as chat_messages
+    return relation in HOT_TABLES or relation.startswith("chat_messages_")
+
+
+def seq_scans(plan: Dict[str, Any]) -> List[str]:
+    return [
+        node["Relation Name"] for node in plan_nodes(plan)
+        if node["Node Type"] == "Seq Scan" and hot_table(node.get("Relation Name", ""))
+    ]
+
+
+async def explain_all(verbose: bool) -> List[Tuple[str, List[str]]]:
+    from app.settings.database import async_session_maker
+
+    queries = hot_queries(uuid4(), uuid4(), uuid4())
+    dialect = postgresql.dialect()
+    report = []
+
+    async with async_session_maker() as session:
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, build in queries.items():
+            sql = str(build().compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            raw = result.scalar_one()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+            if verbose:
+                print(f"-- {name}\n{json.dumps(plan, indent=2)}")
+            report.append((name, seq_scans(plan)))
+        await session.rollback()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a hot chat query plans a sequential scan")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    args = parser.parse_args()
+
+    report = asyncio.run(explain_all(args.verbose))
+    failed = False
+    for name, tables in report:
+        if tables:
+            failed = True
+            print(f"FAIL {name}: sequential scan on {', '.join(sorted(set(tables)))}")
+        else:
+            print(f"ok   {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
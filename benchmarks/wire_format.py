@@ -0,0 +1,88 @@
+"""
+Bytes-per-frame and encode CPU for the JSON and MessagePack wire protocols.
+
+Run from the project root:
+
+    python -m benchmarks.wire_format
+"""
+import argparse
+import statistics
+from typing import Any, Dict, List
+
+from benchmarks._common import write_results
+from benchmarks.hot_paths import build_corpus, measure
+
+
+def build_frames(seed: int, size: int) -> Dict[str, List[Any]]:
+    from app.schemas import schemas
+
+    corpus = build_corpus(seed, size, set())
+    messages = []
+    for index, text in enumerate(corpus["texts"]):
+        author = corpus["authors"][index % len(corpus["authors"])]
+        messages.append(schemas.WrappedSocketMessage(message=schemas.ChatMessagesSchema(
+            created_at=corpus["created"][index], receiver_id=corpus["ids"][-index - 1], message=text,
+            user_name=author.user_name, avatar=author.avatar, verified=author.verified,
+            id=corpus["ids"][index], vote=corpus["votes"][index], edited=False, deleted=False,
+            room_id=corpus["room_id"],
+        )))
+
+    rosters = [{
+        "active_users": [
+            {"user_id": str(corpus["ids"][i]), "user_name": author.user_name,
+             "avatar": author.avatar, "verified": author.verified}
+            for i, author in enumerate(corpus["authors"])
+        ]
+    }]
+    return {"message": messages, "active_users": rosters}
+
+
+def encoded_size(encoded) -> int:
+    return len(encoded.encode("utf-8") if isinstance(encoded, str) else encoded)
+
+
+def run_benchmarks(seed: int, size: int, rounds: int) -> Dict[str, Any]:
+    from app.settings import wire_format
+
+    encoders = {
+        wire_format.JSON_PROTOCOL: wire_format.encode_json,
+        wire_format.MSGPACK_PROTOCOL: wire_format.encode_msgpack,
+    }
+    results = {}
+    for kind, frames in build_frames(seed, size).items():
+        results[kind] = {}
+        for protocol, encode in encoders.items():
+            sizes = [encoded_size(encode(frame)) for frame in frames]
+
+            def encode_all():
+                for frame in frames:
+                    encode(frame)
+
+            timing = measure(encode_all, len(frames), rounds)
+            results[kind][protocol] = {
+                "bytes_mean": statistics.mean(sizes),
+                "bytes_total": sum(sizes),
+                "encode_ns_per_frame": timing["ns_per_op_median"],
+            }
+            print(f"{kind:<14} {protocol:<18} {statistics.mean(sizes):>8.1f} B/frame "
+                  f"{timing['ns_per_op_median']:>10.0f} ns/encode")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and MessagePack frame size and encode cost")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--size", type=int, default=2000, help="Messages in the corpus")
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed, args.size, args.rounds)
+    write_results("wire_format", {
+        "config": {"seed": args.seed, "size": args.size, "rounds": args.rounds},
+        "frames": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
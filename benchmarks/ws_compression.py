@@ -0,0 +1,114 @@
+"""
+Bandwidth saved versus CPU cost of permessage-deflate for join/"load more" bursts
+and live traffic, across compression levels, window sizes and size thresholds.
+
+Every connection owns its own compressor, so the CPU figure scales with room size:
+the report includes the cost of one broadcast at each of the given room sizes.
+
+Run from the project root:
+
+    python -m benchmarks.ws_compression --room-sizes 10,50,200
+"""
+import argparse
+import itertools
+from typing import Any, Dict, List
+
+from websockets import frames
+
+from benchmarks._common import write_results
+from benchmarks.wire_format import build_frames
+
+
+def connection_traffic(seed: int, history: int, live: int) -> List[bytes]:
+    """
+    What one client receives: a history burst on join, the roster, then live messages
+    interleaved with typing notices.
+    """
+    from app.settings import wire_format
+
+    built = build_frames(seed, history + live)
+    messages = [wire_format.encode_json(frame).encode("utf-8") for frame in built["message"]]
+    roster = wire_format.encode_json(built["active_users"][0]).encode("utf-8")
+    typing = wire_format.encode_json({"type": "user_1"}).encode("utf-8")
+
+    traffic = messages[:history] + [roster]
+    for message in messages[history:]:
+        traffic.extend([typing, message])
+    return traffic
+
+
+def compressor_memory(window_bits: int, mem_level: int) -> int:
+    # zlib deflate state: (1 << (windowBits + 2)) + (1 << (memLevel + 9)) bytes
+    return (1 << (window_bits + 2)) + (1 << (mem_level + 9))
+
+
+def run_config(traffic: List[bytes], level: int, window_bits: int, mem_level: int, min_size: int,
+               room_sizes: List[int]) -> Dict[str, Any]:
+    from app.settings.ws_compression import ThresholdPerMessageDeflate
+
+    extension = ThresholdPerMessageDeflate(
+        False, False, 15, window_bits,
+        {"level": level, "memLevel": mem_level},
+        min_size=min_size,
+    )
+    for data in traffic:
+        extension.encode(frames.Frame(frames.OP_TEXT, data))
+
+    stats = extension.stats()
+    compress_ns_per_frame = extension.compress_ns / len(traffic)
+    return {
+        "level": level,
+        "window_bits": window_bits,
+        "mem_level": mem_level,
+        "min_size": min_size,
+        **stats,
+        "ratio": stats["sent_bytes"] / stats["raw_bytes"],
+        "compress_us_per_frame": compress_ns_per_frame / 1e3,
+        "compressor_memory_bytes": compressor_memory(window_bits, mem_level),
+        "broadcast_cpu_ms": {
+            str(size): compress_ns_per_frame * size / 1e6 for size in room_sizes
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="permessage-deflate bandwidth vs CPU")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--history", type=int, default=200, help="Messages in the join burst")
+    parser.add_argument("--live", type=int, default=200, help="Live messages after the burst")
+    parser.add_argument("--levels", default="1,6,9")
+    parser.add_argument("--window-bits", default="9,12,15")
+    parser.add_argument("--mem-level", type=int, default=5)
+    parser.add_argument("--min-sizes", default="0,256,512,1024")
+    parser.add_argument("--room-sizes", default="10,50,200")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    room_sizes = [int(size) for size in args.room_sizes.split(",")]
+    traffic = connection_traffic(args.seed, args.history, args.live)
+    configs = itertools.product(
+        [int(value) for value in args.levels.split(",")],
+        [int(value) for value in args.window_bits.split(",")],
+        [int(value) for value in args.min_sizes.split(",")],
+    )
+
+    results = []
+    for level, window_bits, min_size in configs:
+        result = run_config(traffic, level, window_bits, args.mem_level, min_size, room_sizes)
+        results.append(result)
+        print(f"level={level} wbits={window_bits:>2} min={min_size:>4} "
+              f"ratio={result['ratio']:.3f} {result['compress_us_per_frame']:>7.1f} us/frame "
+              f"mem={result['compressor_memory_bytes'] // 1024} KiB")
+
+    write_results("ws_compression", {
+        "config": {
+            "seed": args.seed, "history": args.history, "live": args.live,
+            "mem_level": args.mem_level, "room_sizes": room_sizes,
+            "frames": len(traffic), "raw_bytes": sum(len(data) for data in traffic),
+        },
+        "runs": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+WebSocket load generator for /ws/{room_id}.
+
+Opens N simulated users across M rooms against a running (or spawned) chat server
+backed by a local Postgres, drives a send/typing/vote mix and reports connect
+latency, end-to-end delivery latency and throughput as JSON.
+
+Run from the project root with the usual .env in place:
+
+    python -m benchmarks.ws_load --company-id <uuid> --users 200 --rooms 10 --spawn
+
+Load users and rooms are created on first run (``loadgen-*``) and reused afterwards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+from uuid import UUID
+
+import websockets
+
+from benchmarks._common import summarize, write_results
+
+
+MESSAGE_PREFIX = "lg:"
+
+
+async def seed_database(users: int, rooms: int, company_id: UUID) -> List[Dict[str, Any]]:
+    """
+    Creates (or reuses) load users, their user_status rows and load rooms, and mints
+    an access token for every user.
+    """
+    from sqlalchemy import select
+    from app.settings.database import async_session_maker
+    from app.settings import oauth2, utils
+    from app.models import models
+
+    password = utils.hash_password("loadgen")
+    clients = []
+
+    async with async_session_maker() as session:
+        room_records = []
+        for index in range(rooms):
+            name = f"loadgen-room-{index}"
+            room = (await session.execute(
+                select(models.Rooms).where(models.Rooms.name_room == name)
+            )).scalar_one_or_none()
+            if room is None:
+                room = models.Rooms(name_room=name, image_room="", company_id=company_id)
+                session.add(room)
+                await session.flush()
+            room_records.append(room)
+
+        for index in range(users):
+            name = f"loadgen-user-{index}"
+            user = (await session.execute(
+                select(models.User).where(models.User.user_name == name)
+            )).scalar_one_or_none()
+            if user is None:
+                user = models.User(email=f"{name}@loadgen.local", user_name=name, password=password,
+                                   avatar="", company_id=company_id)
+                session.add(user)
+                await session.flush()
+
+            room = room_records[index % rooms]
+            status_record = (await session.execute(
+                select(models.UserStatus).where(models.UserStatus.user_id == user.id)
+            )).scalar_one_or_none()
+            if status_record is None:
+                session.add(models.UserStatus(room_id=room.id, name_room=room.name_room,
+                                              user_id=user.id, user_name=user.user_name))
+            clients.append({"user_id": str(user.id), "room_id": str(room.id)})
+
+        await session.commit()
+
+        for client in clients:
+            client["token"] = await oauth2.create_access_token(UUID(client["user_id"]), session)
+
+    return clients
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("Chat server exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Chat server did not start listening in time")
+
+
+class LoadStats:
+    def __init__(self):
+        self.connect_handshake: List[float] = []
+        self.connect_first_frame: List[float] = []
+        self.delivery: List[float] = []
+        self.sent: Dict[str, int] = {"send": 0, "type": 0, "vote": 0}
+        self.received_frames = 0
+        self.received_bytes = 0
+        self.errors: Dict[str, int] = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimulatedUser:
+    def __init__(self, client: Dict[str, Any], base_url: str, limit: int, stats: LoadStats,
+                 rng: random.Random, mix: Dict[str, float], rate: float):
+        self.client = client
+        self.url = f"{base_url}/ws/{client['room_id']}?token={client['token']}&limit={limit}"
+        self.stats = stats
+        self.rng = rng
+        self.mix = mix
+        self.rate = rate
+        self.known_messages: List[str] = []
+        self.sequence = 0
+
+    def pick_action(self) -> str:
+        roll = self.rng.random() * sum(self.mix.values())
+        for action, weight in self.mix.items():
+            roll -= weight
+            if roll <= 0:
+                return action
+        return "send"
+
+    async def receive(self, websocket, first_frame: asyncio.Future, started: float):
+        async for frame in websocket:
+            now = time.perf_counter()
+            if not first_frame.done():
+                self.stats.connect_first_frame.append(now - started)
+                first_frame.set_result(None)
+
+            self.stats.received_frames += 1
+            self.stats.received_bytes += len(frame)
+            if isinstance(frame, bytes):
+                continue
+            try:
+                data = json.loads(frame)
+            except ValueError:
+                self.stats.error("invalid_frame")
+                continue
+
+            message = data.get("message") if isinstance(data, dict) else None
+            if not isinstance(message, dict):
+                continue
+            if message.get("id"):
+                self.known_messages.append(message["id"])
+                del self.known_messages[:-50]
+            text = message.get("message") or ""
+            if text.startswith(MESSAGE_PREFIX):
+                sent_at = int(text.split(":")[3])
+                self.stats.delivery.append((time.perf_counter_ns() - sent_at) / 1e9)
+
+    async def send(self, websocket, action: str):
+        if action == "vote" and self.known_messages:
+            payload = {"vote": {"message_id": self.rng.choice(self.known_messages), "dir": 1}}
+        elif action == "type":
+            payload = {"type": True}
+        else:
+            action = "send"
+            self.sequence += 1
+            text = f"{MESSAGE_PREFIX}{self.client['user_id']}:{self.sequence}:{time.perf_counter_ns()}"
+            payload = {"send": {"original_message_id": None, "message": text,
+                                "fileUrl": None, "voiceUrl": None, "videoUrl": None}}
+        await websocket.send(json.dumps(payload))
+        self.stats.sent[action] += 1
+
+    async def run(self, duration: float, ramp: float):
+        await asyncio.sleep(self.rng.uniform(0, ramp))
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(self.url, max_size=None) as websocket:
+                self.stats.connect_handshake.append(time.perf_counter() - started)
+                first_frame = asyncio.get_running_loop().create_future()
+                receiver = asyncio.create_task(self.receive(websocket, first_frame, started))
+                try:
+                    await asyncio.wait_for(first_frame, timeout=30)
+                    deadline = time.monotonic() + duration
+                    while time.monotonic() < deadline:
+                        await asyncio.sleep(self.rng.expovariate(self.rate))
+                        await self.send(websocket, self.pick_action())
+                    # Give in-flight broadcasts a moment to arrive
+                    await asyncio.sleep(1)
+                finally:
+                    receiver.cancel()
+        except asyncio.TimeoutError:
+            self.stats.error("first_frame_timeout")
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            self.stats.error(type(e).__name__)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        action, weight = part.split("=")
+        if action not in ("send", "type", "vote"):
+            raise argparse.ArgumentTypeError(f"Unknown action in mix: {action}")
+        mix[action] = float(weight)
+    return mix
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    clients = await seed_database(args.users, args.rooms, args.company_id)
+    stats = LoadStats()
+    rng = random.Random(args.seed)
+    simulated = [
+        SimulatedUser(client, args.url, args.limit, stats, random.Random(rng.random()), args.mix, args.rate)
+        for client in clients
+    ]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run(args.duration, args.ramp) for user in simulated))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "config": {
+            "users": args.users, "rooms": args.rooms, "duration": args.duration, "rate": args.rate,
+            "mix": args.mix, "limit": args.limit, "seed": args.seed, "ramp": args.ramp,
+        },
+        "elapsed_seconds": elapsed,
+        "connect_handshake_seconds": summarize(stats.connect_handshake),
+        "connect_first_frame_seconds": summarize(stats.connect_first_frame),
+        "delivery_seconds": summarize(stats.delivery),
+        "sent": stats.sent,
+        "sent_per_second": sum(stats.sent.values()) / elapsed,
+        "delivered_per_second": len(stats.delivery) / elapsed,
+        "received_frames": stats.received_frames,
+        "received_bytes": stats.received_bytes,
+        "errors": stats.errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-generate /ws/{room_id} and report latency")
+    parser.add_argument("--url", default="ws://127.0.0.1:8800", help="Base WebSocket URL of the chat server")
+    parser.add_argument("--spawn", action="store_true", help="Start a local uvicorn server for the run")
+    parser.add_argument("--port", type=int, default=8800, help="Port used with --spawn")
+    parser.add_argument("--company-id", type=UUID, required=True, help="Company that owns the load users")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds each user stays active")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Spread connects over this many seconds")
+    parser.add_argument("--rate", type=float, default=0.5, help="Actions per second per user")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("send=0.6,type=0.35,vote=0.05"))
+    parser.add_argument("--limit", type=int, default=20, help="History limit requested on join")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = spawn_server(args.port)
+        args.url = f"ws://127.0.0.1:{args.port}"
+    try:
+        results = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(results, indent=2))
+    write_results("ws_load", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
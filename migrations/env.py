@@ -0,0 +1,71 @@
+import asyncio
+from logging.config import fileConfig
+
+from sqlalchemy import pool
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from alembic import context
+
+from app.models import models  # noqa: F401 - registers the tables on Base.metadata
+from app.settings.database import ASYNC_SQLALCHEMY_DATABASE_URL, Base
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# The database is shared with the main API, which owns the tables themselves.
+# This service keeps its own version table and only manages what it declares in app/models.
+VERSION_TABLE = "alembic_version_chat"
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # Never autogenerate drops for tables that belong to other services
+    return not (type_ == "table" and reflected and compare_to is None)
+
+
+def run_migrations_offline() -> None:
+    """
+    Emits the migration SQL to stdout instead of running it (alembic upgrade head --sql).
+    """
+    context.configure(
+        url=ASYNC_SQLALCHEMY_DATABASE_URL,
+        target_metadata=target_metadata,
+        version_table=VERSION_TABLE,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        version_table=VERSION_TABLE,
+        include_object=include_object,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    connectable = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=pool.NullPool)
+
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+
+    await connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_async_migrations())
@@ -0,0 +1,45 @@
+"""Indexes for the hot chat queries
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 10:00:00
+
+Built with CREATE INDEX CONCURRENTLY so a live chat_messages table is not locked
+against writes; IF NOT EXISTS makes it safe on databases where an index was added by hand.
+user_status.user_id already has the index of its unique constraint.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_chat_messages_room_id_created_at', 'chat_messages', ['room_id', 'created_at']),
+    ('ix_chat_message_votes_message_id', 'chat_message_votes', ['message_id']),
+    ('ix_bans_user_id_room_id', 'bans', ['user_id', 'room_id']),
+    ('ix_user_online_time_user_id', 'user_online_time', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True)
+        for _, table, _ in INDEXES:
+            op.execute(sa.text(f'ANALYZE {table}'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
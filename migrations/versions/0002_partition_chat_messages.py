@@ -0,0 +1,122 @@
+"""Partition chat_messages by month and add the chat_archive tier
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 12:00:00
+
+The existing table is not copied: it is renamed to chat_messages_legacy and attached
+as the partition holding everything before the month after its newest row (next month
+at the earliest), so this month's messages stay in it. Monthly partitions from that
+bound on are created here; after that PartitionMaintainer (app/settings/partitions.py)
+creates future ones and moves old ones to chat_archive.
+
+A primary key on a partitioned table has to contain the partition key, so it becomes
+(id, created_at) and chat_message_votes.message_id can no longer reference chat_messages;
+votes are removed together with their messages by the application instead.
+There is no default partition, as DETACH CONCURRENTLY does not work with one.
+
+Downgrading copies every hot and archived message into a plain chat_messages table
+again and restores its primary key on id and the foreign key of the votes. Partitions
+the maintainer left detached belong to neither parent and are not copied, so let it
+reattach them first; dropping chat_archive fails while any are left there.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PREMADE_MONTHS = 3
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TABLE chat_messages RENAME TO chat_messages_legacy")
+    op.execute("ALTER INDEX IF EXISTS ix_chat_messages_room_id_created_at "
+               "RENAME TO ix_chat_messages_legacy_room_id_created_at")
+    op.execute("ALTER TABLE chat_message_votes DROP CONSTRAINT IF EXISTS chat_message_votes_message_id_fkey")
+    op.execute("ALTER TABLE chat_messages_legacy DROP CONSTRAINT chat_messages_pkey")
+    op.execute("ALTER TABLE chat_messages_legacy ADD CONSTRAINT chat_messages_legacy_pkey PRIMARY KEY (id, created_at)")
+
+    op.execute("CREATE TABLE chat_messages (LIKE chat_messages_legacy INCLUDING DEFAULTS) "
+               "PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_pkey PRIMARY KEY (id, created_at)")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_receiver_id_fkey "
+               "FOREIGN KEY (receiver_id) REFERENCES users (id) ON DELETE SET NULL")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_rooms_fkey "
+               "FOREIGN KEY (rooms) REFERENCES rooms (name_room) ON DELETE CASCADE ON UPDATE CASCADE")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_room_id_fkey "
+               "FOREIGN KEY (room_id) REFERENCES rooms (id) ON DELETE CASCADE")
+    op.execute("CREATE INDEX ix_chat_messages_room_id_created_at ON chat_messages (room_id, created_at)")
+
+    # The legacy partition keeps every row already written, so its bound comes from the data: the start
+    # of the month after the newest row, or of next month if that is later. The rename above holds an
+    # exclusive lock until commit, so nothing is written past it meanwhile. A validated CHECK matching
+    # the bound lets ATTACH skip scanning the legacy rows.
+    op.execute(f"""
+        DO $$
+        DECLARE
+            newest timestamp := (SELECT max(created_at) FROM chat_messages_legacy) AT TIME ZONE 'UTC';
+            boundary timestamp := greatest(
+                date_trunc('month', newest) + interval '1 month',
+                date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month'
+            );
+            month_start timestamp;
+        BEGIN
+            EXECUTE format('ALTER TABLE chat_messages_legacy ADD CONSTRAINT chat_messages_legacy_bounds '
+                           'CHECK (created_at IS NOT NULL AND created_at < %L) NOT VALID',
+                           boundary AT TIME ZONE 'UTC');
+            ALTER TABLE chat_messages_legacy VALIDATE CONSTRAINT chat_messages_legacy_bounds;
+            EXECUTE format('ALTER TABLE chat_messages ATTACH PARTITION chat_messages_legacy '
+                           'FOR VALUES FROM (MINVALUE) TO (%L)', boundary AT TIME ZONE 'UTC');
+            ALTER TABLE chat_messages_legacy DROP CONSTRAINT chat_messages_legacy_bounds;
+
+            FOR month_offset IN 0..{PREMADE_MONTHS - 1} LOOP
+                month_start := boundary + make_interval(months => month_offset);
+                EXECUTE format('CREATE TABLE %I PARTITION OF chat_messages FOR VALUES FROM (%L) TO (%L)',
+                               'chat_messages_' || to_char(month_start, 'YYYY_MM'),
+                               month_start AT TIME ZONE 'UTC',
+                               (month_start + interval '1 month') AT TIME ZONE 'UTC');
+            END LOOP;
+        END
+        $$
+    """)
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS chat_archive")
+    op.execute("CREATE TABLE chat_archive.chat_messages (LIKE public.chat_messages INCLUDING DEFAULTS) "
+               "PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE chat_archive.chat_messages ADD PRIMARY KEY (id, created_at)")
+    op.execute("CREATE INDEX ix_chat_archive_messages_room_id_created_at "
+               "ON chat_archive.chat_messages (room_id, created_at)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Partitioned tables cannot be turned back into plain ones in place: copy hot and archived rows out
+    op.execute("CREATE TABLE chat_messages_plain (LIKE chat_messages INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO chat_messages_plain SELECT * FROM chat_messages")
+    op.execute("INSERT INTO chat_messages_plain SELECT * FROM chat_archive.chat_messages")
+    op.execute("DROP TABLE chat_messages")
+    op.execute("DROP TABLE chat_archive.chat_messages")
+    op.execute("DROP SCHEMA IF EXISTS chat_archive")
+    op.execute("ALTER TABLE chat_messages_plain RENAME TO chat_messages")
+
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_pkey PRIMARY KEY (id)")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_receiver_id_fkey "
+               "FOREIGN KEY (receiver_id) REFERENCES users (id) ON DELETE SET NULL")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_rooms_fkey "
+               "FOREIGN KEY (rooms) REFERENCES rooms (name_room) ON DELETE CASCADE ON UPDATE CASCADE")
+    op.execute("ALTER TABLE chat_messages ADD CONSTRAINT chat_messages_room_id_fkey "
+               "FOREIGN KEY (room_id) REFERENCES rooms (id) ON DELETE CASCADE")
+    op.execute("CREATE INDEX ix_chat_messages_room_id_created_at ON chat_messages (room_id, created_at)")
+
+    # Votes of messages removed without the foreign key would block restoring it
+    op.execute("DELETE FROM chat_message_votes v "
+               "WHERE NOT EXISTS (SELECT 1 FROM chat_messages m WHERE m.id = v.message_id)")
+    op.execute("ALTER TABLE chat_message_votes ADD CONSTRAINT chat_message_votes_message_id_fkey "
+               "FOREIGN KEY (message_id) REFERENCES chat_messages (id) ON DELETE CASCADE")
@@ -0,0 +1,55 @@
+"""Room message counters and per-user read markers
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 14:00:00
+
+Unread counts are room_message_counts.message_count minus the read_count a user's
+marker recorded, so a new message bumps one row per room instead of one per reader.
+Counters start from the messages already stored, hot and archived.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'room_message_counts',
+        sa.Column('room_id', postgresql.UUID(), sa.ForeignKey('rooms.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('message_count', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    op.create_table(
+        'room_read_state',
+        sa.Column('user_id', postgresql.UUID(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('room_id', postgresql.UUID(), sa.ForeignKey('rooms.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('read_count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('last_read_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')),
+    )
+
+    op.execute("""
+        INSERT INTO room_message_counts (room_id, message_count)
+        SELECT room_id, count(*) FROM (
+            SELECT room_id FROM chat_messages
+            UNION ALL
+            SELECT room_id FROM chat_archive.chat_messages
+        ) AS messages
+        WHERE room_id IN (SELECT id FROM rooms)
+        GROUP BY room_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('room_read_state')
+    op.drop_table('room_message_counts')
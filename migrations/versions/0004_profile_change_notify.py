@@ -0,0 +1,48 @@
+"""Notify listeners when a user's profile changes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 16:00:00
+
+History reads take user_name, avatar and verified from an in-process cache
+(app/settings/profiles.py) instead of joining users. Profiles are edited by the main
+company service, so the cache is invalidated from here: any change to those columns,
+or the removal of the user, sends the user id on the user_profile_changed channel.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_user_profile_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE'
+               OR (OLD.user_name, OLD.avatar, OLD.verified) IS DISTINCT FROM (NEW.user_name, NEW.avatar, NEW.verified)
+            THEN
+                PERFORM pg_notify('user_profile_changed', OLD.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER users_profile_changed
+        AFTER UPDATE OF user_name, avatar, verified OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION notify_user_profile_changed()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS users_profile_changed ON users")
+    op.execute("DROP FUNCTION IF EXISTS notify_user_profile_changed()")
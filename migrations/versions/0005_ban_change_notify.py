@@ -0,0 +1,51 @@
+"""Notify listeners when a ban is added, changed or lifted
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 18:00:00
+
+Mutes are checked against an in-process index (app/settings/ban_index.py). Bans are
+written by the main company service as well as by this one, so the index follows the
+table from here: every insert, update or delete on bans sends "user_id,room_id" on the
+bans_changed channel and each worker reloads that pair.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_bans_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM pg_notify('bans_changed', NEW.user_id::text || ',' || NEW.room_id::text);
+            END IF;
+            IF TG_OP = 'DELETE'
+               OR (TG_OP = 'UPDATE' AND (OLD.user_id, OLD.room_id) IS DISTINCT FROM (NEW.user_id, NEW.room_id))
+            THEN
+                PERFORM pg_notify('bans_changed', OLD.user_id::text || ',' || OLD.room_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER bans_changed
+        AFTER INSERT OR UPDATE OR DELETE ON bans
+        FOR EACH ROW EXECUTE FUNCTION notify_bans_changed()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS bans_changed ON bans")
+    op.execute("DROP FUNCTION IF EXISTS notify_bans_changed()")
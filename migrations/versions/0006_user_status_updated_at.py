@@ -0,0 +1,31 @@
+"""Order presence writes by the time of the join or leave
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 19:00:00
+
+Presence is flushed to user_status by every node on its own schedule, so a user who
+leaves one node and joins another can have the older leave written last. updated_at
+records the time of the event each row holds, and flushes skip rows that are newer.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('user_status', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user_status', 'updated_at')
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from jose import jwt
+from sqlalchemy.exc import DBAPIError
+
+from app.settings import oauth2, replicas
+
+
+USER = SimpleNamespace(
+    id=uuid.uuid4(),
+    company_id=uuid.uuid4(),
+    password_changed=datetime(2026, 1, 1, tzinfo=timezone.utc),
+    blocked=False,
+)
+
+
+def make_token(user) -> str:
+    return jwt.encode({
+        "exp": int(time.time()) + 60,
+        "user_id": str(user.id),
+        "company": str(user.company_id),
+        "password_changed": str(user.password_changed),
+    }, oauth2.SECRET_KEY, algorithm=oauth2.ALGORITHM)
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+
+class FakeSession:
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.queries = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, query):
+        self.queries += 1
+        if self.fail:
+            raise DBAPIError("SELECT users", {}, ConnectionResetError("replica went away"))
+        return FakeResult(USER)
+
+
+def test_join_auth_falls_back_to_primary_when_replica_fails(monkeypatch):
+    replica_session = FakeSession(fail=True)
+    primary_session = FakeSession(fail=False)
+    monkeypatch.setattr(replicas, "async_session_maker", lambda: primary_session)
+
+    router = replicas.ReplicaRouter({})
+    replica = replicas.Replica("replica-1", None)
+    replica.session_maker = lambda: replica_session
+    replica.lag = 0.0
+    replica.checked_at = time.time()
+    router.replicas.append(replica)
+
+    # The auth step of websocket_endpoint
+    user = asyncio.run(router.read(oauth2.get_current_user, make_token(USER)))
+
+    assert user is USER
+    assert replica_session.queries == 1
+    assert primary_session.queries == 2
+    assert replica.lag is None
+
+
+def test_reads_wait_for_a_replica_that_replayed_the_users_write():
+    router = replicas.ReplicaRouter({})
+    behind, current = replicas.Replica("behind", None), replicas.Replica("current", None)
+    for replica, replayed_lsn in ((behind, 100), (current, 200)):
+        replica.lag = 0.0
+        replica.replayed_lsn = replayed_lsn
+        replica.checked_at = time.time()
+        router.replicas.append(replica)
+    writer, reader = uuid.uuid4(), uuid.uuid4()
+    router.last_write[writer] = 150
+
+    assert {router.pick(writer) for _ in range(4)} == {current}
+    assert {router.pick(reader) for _ in range(4)} == {behind, current}
+
+    router.last_write[writer] = 250
+    assert router.pick(writer) is None